@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Compares reading the geometry convergence of a long optimization by reading
+# the whole file and running a regex over it with the streaming parser
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qgrep import orca
+
+parser = argparse.ArgumentParser(description='Benchmark reading the convergence of an optimization.')
+parser.add_argument('-i', '--input', help='The file to be read, generated if not given.',
+                    type=str, default=None)
+parser.add_argument('-c', '--cycles', help='Number of cycles in the generated output.',
+                    type=int, default=1000)
+parser.add_argument('-f', '--filler', help='Lines of filler between each cycle.',
+                    type=int, default=5000)
+
+# Pattern previously used by orca.convergence
+convergence_re = r'''(Energy change\s+([-]?\d+.\d+)\s+([-]?\d+.\d+)\s+(YES|NO))?
+          RMS gradient \s+([-]?\d+.\d+)\s+([-]?\d+.\d+)\s+(YES|NO)
+          MAX gradient \s+([-]?\d+.\d+)\s+([-]?\d+.\d+)\s+(YES|NO)
+          RMS step     \s+([-]?\d+.\d+)\s+([-]?\d+.\d+)\s+(YES|NO)
+          MAX step     \s+([-]?\d+.\d+)\s+([-]?\d+.\d+)\s+(YES|NO)
+          ....................................................
+          Max\(Bonds\)\s+([-]?\d+.\d+)\s+Max\(Angles\)\s+([-]?\d+.\d+)
+          Max\(Dihed\)\s+([-]?\d+.\d+)\s+Max\(Improp\)\s+([-]?\d+.\d+)
+          -----------------------------------------------------------------'''
+
+table = """\
+               *           SCF CONVERGED AFTER  12 CYCLES          *
+FINAL SINGLE POINT ENERGY       -33.930452726594
+
+                                .--------------------.
+          ----------------------|Geometry convergence|---------------------
+          Item                value                 Tolerance   Converged
+          -----------------------------------------------------------------
+          Energy change      -0.00003171            0.00003000      NO
+          RMS gradient        0.00010478            0.00050000      YES
+          MAX gradient        0.00024295            0.00200000      YES
+          RMS step            0.00607771            0.00700000      YES
+          MAX step            0.01266595            0.01000000      NO
+          ....................................................
+          Max(Bonds)      0.0067      Max(Angles)    0.04
+          Max(Dihed)        0.00      Max(Improp)    0.00
+          -----------------------------------------------------------------
+
+"""
+
+
+def generate(file_name, cycles, filler):
+    """Write a fake orca optimization output"""
+    filler = '   {:>4d}   -33.9304527265    -0.000000001   0.00000012  0.0000001   0.00\n'*filler
+    with open(file_name, 'w') as f:
+        for i in range(cycles):
+            f.write(filler.format(*range(filler.count('{'))))
+            f.write(table)
+        f.write('TOTAL RUN TIME: 0 days 0 hours 0 minutes 1 seconds 0 msec\n')
+
+
+def regex(file_name):
+    output = open(file_name).read()
+    return len(re.findall(convergence_re, output))
+
+
+def streaming(file_name):
+    return len(orca.convergence(file_name).steps)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    file_name = args.input
+    if file_name is None:
+        file_name = os.path.join(tempfile.mkdtemp(), 'output.dat')
+        generate(file_name, args.cycles, args.filler)
+    print('{}: {:.1f} MB'.format(file_name, os.path.getsize(file_name)/2**20))
+
+    for name, function in [('regex', regex), ('streaming', streaming)]:
+        start = time.perf_counter()
+        steps = function(file_name)
+        print('{:>9s}: {:>8.4f} s  {} steps'.format(name, time.perf_counter() - start, steps))
+
+    if args.input is None:
+        os.remove(file_name)
+        os.rmdir(os.path.dirname(file_name))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+# Compares finding the last energy of a large output with readlines and with a
+# memory mapped reverse read
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qgrep import orca
+from qgrep.helper import MappedFile
+
+parser = argparse.ArgumentParser(description='Benchmark reading the last energy of an output file.')
+parser.add_argument('-i', '--input', help='The file to be read, generated if not given.',
+                    type=str, default=None)
+parser.add_argument('-s', '--size', help='Size of the generated file in MB.',
+                    type=int, default=500)
+
+
+def generate(file_name, size):
+    """Write a fake orca output of roughly the given size in MB"""
+    filler = 'x'*79 + '\n'
+    energy = 'FINAL SINGLE POINT ENERGY      -232.089449656962\n'
+    block = filler*9999 + energy
+    with open(file_name, 'w') as f:
+        for i in range(size*2**20//len(block) + 1):
+            f.write(block)
+        f.write('\nTOTAL RUN TIME: 0 days 0 hours 0 minutes 1 seconds 0 msec\n')
+
+
+def run(mode, file_name, queue):
+    start = time.perf_counter()
+    if mode == 'readlines':
+        with open(file_name) as f:
+            lines = f.readlines()
+    else:
+        lines = MappedFile(file_name)
+    energy = orca.get_energy(lines)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kB on linux
+    queue.put((energy, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    file_name = args.input
+    if file_name is None:
+        file_name = os.path.join(tempfile.mkdtemp(), 'output.dat')
+        generate(file_name, args.size)
+    print('{}: {:.1f} MB'.format(file_name, os.path.getsize(file_name)/2**20))
+
+    # Fresh processes so peak memory is not shared between modes
+    context = multiprocessing.get_context('spawn')
+    for mode in ['readlines', 'mmap']:
+        queue = context.Queue()
+        p = context.Process(target=run, args=(mode, file_name, queue))
+        p.start()
+        energy, elapsed, rss = queue.get()
+        p.join()
+        print('{:>9s}: {:>8.4f} s  {:>8.1f} MB peak RSS  energy = {}'.format(mode, elapsed, rss, energy))
+
+    if args.input is None:
+        os.remove(file_name)
+        os.rmdir(os.path.dirname(file_name))
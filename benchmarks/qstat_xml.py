@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Compares reading a large qstat xml by building the whole ElementTree with
+# streaming it through Queues.parse_tree
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+from xml.etree import ElementTree
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qgrep.queues import Queues
+from qgrep.schedulers import PBS
+
+parser = argparse.ArgumentParser(description='Benchmark reading the xml output of qstat.')
+parser.add_argument('-i', '--input', help='The PBS xml to be read, generated if not given.',
+                    type=str, default=None)
+parser.add_argument('-n', '--number', help='Number of jobs in the generated xml.',
+                    type=int, default=100000)
+
+job = """\
+    <Job>
+        <Job_Id>{0}[{1}].icqc</Job_Id>
+        <Job_Name>conformer_{1}</Job_Name>
+        <Job_Owner>mullinax@icmaster1</Job_Owner>
+        <resources_used>
+            <cput>21002:04:52</cput>
+            <mem>60978424kb</mem>
+            <vmem>73997480kb</vmem>
+            <walltime>2630:02:36</walltime>
+        </resources_used>
+        <job_state>{2}</job_state>
+        <queue>batch</queue>
+        <server>control</server>
+        <Error_Path>zeusln1:/home/mullinax/conformers/{1}/job.err</Error_Path>
+        <Output_Path>zeus1:/home/mullinax/conformers/{1}/job.o{0}</Output_Path>
+        <Resource_List>
+            <nodect>1</nodect>
+            <nodes>1</nodes>
+            <walltime>8760:00:00</walltime>
+        </Resource_List>
+        <Variable_List>PBS_O_HOME=/home/mullinax,PBS_O_WORKDIR=/home/mullinax/conformers/{1}</Variable_List>
+        <submit_args>-j oe -N conformer_{1} job.sh</submit_args>
+    </Job>
+"""
+
+
+def generate(file_name, number):
+    """Write fake PBS array tasks, each with their own job id"""
+    with open(file_name, 'w') as f:
+        f.write('<Data>\n')
+        for i in range(number):
+            f.write(job.format(77816 + i, i, 'R' if i < 100 else 'Q'))
+        f.write('</Data>\n')
+
+
+def tree(file_name):
+    """Read everything into an ElementTree and then walk it"""
+    with open(file_name, 'rb') as f:
+        root = ElementTree.fromstring(f.read())
+    return sum(PBS.read_job(job_xml)[2] != 'c' for job_xml in root)
+
+
+def streaming(file_name):
+    return sum(map(len, Queues(xml_file=file_name).queues.values()))
+
+
+def run(mode, file_name, queue):
+    start = time.perf_counter()
+    jobs = {'tree': tree, 'streaming': streaming}[mode](file_name)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kB on linux
+    queue.put((jobs, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    file_name = args.input
+    if file_name is None:
+        file_name = os.path.join(tempfile.mkdtemp(), 'qstat.xml')
+        generate(file_name, args.number)
+    print('{}: {:.1f} MB'.format(file_name, os.path.getsize(file_name)/2**20))
+
+    # Fresh processes so peak memory is not shared between modes
+    context = multiprocessing.get_context('spawn')
+    for mode in ['tree', 'streaming']:
+        queue = context.Queue()
+        p = context.Process(target=run, args=(mode, file_name, queue))
+        p.start()
+        jobs, elapsed, rss = queue.get()
+        p.join()
+        print('{:>9s}: {:>8.4f} s  {:>8.1f} MB peak RSS  {} jobs'.format(mode, elapsed, rss, jobs))
+
+    if args.input is None:
+        os.remove(file_name)
+        os.rmdir(os.path.dirname(file_name))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Times reading, diffing and rendering a large number of jobs with a recorded
+# scheduler, so no scheduler is needed
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qgrep.queues import Queues, Watcher, diff_jobs
+from qgrep.schedulers import Recorded
+
+parser = argparse.ArgumentParser(description='Benchmark the queues with many jobs.')
+parser.add_argument('-n', '--number', help='Number of jobs.',
+                    type=int, default=50000)
+parser.add_argument('-q', '--queues', help='Number of queues.',
+                    type=int, default=6)
+parser.add_argument('-c', '--changed', help='Fraction of the jobs that change between polls.',
+                    type=float, default=0.01)
+parser.add_argument('-j', '--jobs', help='Number of jobs shown in each queue.',
+                    type=int, default=50)
+
+users = ['mullinax', 'meghaanand', 'sivalingam', 'agent']
+
+
+def generate(file_name, number, queues, changed=0):
+    """Write squeue --json output of array jobs of 100 tasks, with a tenth of the tasks running"""
+    jobs = []
+    for i in range(number):
+        running = i % 10 == 0 or i < changed*number
+        jobs.append({
+            'array_job_id': {'set': True, 'infinite': False, 'number': 100001 + i - i % 100},
+            'array_task_id': {'set': True, 'infinite': False, 'number': i % 100 + 1},
+            'current_working_directory': '/home/{}/conformers/{}'.format(users[i % len(users)], i),
+            'job_id': 100001 + i,
+            'job_state': ['RUNNING' if running else 'PENDING'],
+            'name': 'conformer_{}'.format(i),
+            'partition': 'gen{}'.format(i % queues),
+            'user_name': users[i % len(users)],
+        })
+    with open(file_name, 'w') as f:
+        json.dump({'jobs': jobs}, f)
+
+
+def timed(name, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    print('{:>12s}: {:>8.4f} s'.format(name, time.perf_counter() - start))
+    return result
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    jobs_file = os.path.join(tmp_dir, 'squeue.json')
+    sizes = {'gen{}'.format(i): args.number//args.queues//5 for i in range(args.queues)}
+    generate(jobs_file, args.number, args.queues)
+    print('{} jobs in {} queues: {:.1f} MB'.format(args.number, args.queues, os.path.getsize(jobs_file)/2**20))
+
+    queues = timed('read', Queues, scheduler=Recorded(jobs_file, sizes))
+    print('{:>12s}: {} jobs'.format('', len(queues.jobs)))
+    timed('render', queues.print, numjobs=args.jobs)
+    timed('render all', queues.print, numjobs=args.number)
+
+    # Another poll where some of the jobs have started
+    generate(jobs_file, args.number, args.queues, args.changed)
+    watcher = Watcher(queues)
+    old = watcher.jobs
+    timed('refresh', queues.refresh)
+    new = queues.jobs
+    diff = timed('diff', diff_jobs, old, new)
+    print('{:>12s}: {} added, {} removed, {} changed'.format('', len(diff.added), len(diff.removed), len(diff.changed)))
+    timed('poll', watcher.poll)
+    # Only the jobs that changed are formatted again
+    timed('rerender', queues.print, numjobs=args.number)
+
+    os.remove(jobs_file)
+    os.rmdir(tmp_dir)
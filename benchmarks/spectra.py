@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+# Times broadening many transitions into a spectrum, with the peak functions
+# one point at a time (on part of the grid), with broaden and with broaden_fft
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qgrep.spectra import broaden, broaden_fft, fft_error, peak_functions, profiles
+
+parser = argparse.ArgumentParser(description='Benchmark broadening spectra.')
+parser.add_argument('-n', '--number', help='Number of transitions.',
+                    type=int, default=5000)
+parser.add_argument('-p', '--points', help='Number of points in the spectrum.',
+                    type=int, default=10001)
+parser.add_argument('-l', '--loop_points', help='Number of points to time the peak functions on.',
+                    type=int, default=20)
+parser.add_argument('-w', '--width', help='Width of the peaks.',
+                    type=float, default=0.1)
+
+
+def loop(xs, energies, intensities, width, name):
+    peaks = [peak_functions[name](e, i, width) for e, i in zip(energies, intensities)]
+    ys = np.zeros(len(xs))
+    for i, x in enumerate(xs):
+        for peak in peaks:
+            ys[i] += peak(x)
+    return ys
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    energies = np.sort(rng.uniform(2, 50, args.number))
+    intensities = rng.uniform(0, 1, args.number)
+    xs = np.linspace(0, 52, args.points)
+    print('{} transitions on {} points'.format(args.number, args.points))
+
+    for name in profiles:
+        start = time.perf_counter()
+        loop(xs[::len(xs)//args.loop_points], energies, intensities, args.width, name)
+        # Scaled to the whole grid
+        looped = (time.perf_counter() - start)*len(xs)/len(xs[::len(xs)//args.loop_points])
+        start = time.perf_counter()
+        broaden(xs, energies, intensities, args.width, name)
+        broadened = time.perf_counter() - start
+        start = time.perf_counter()
+        broaden_fft(xs, energies, intensities, args.width, name)
+        fft = time.perf_counter() - start
+        error = fft_error(xs, energies, intensities, args.width, name)
+        print('{:>10s}: {:>9.3f} s looped (estimated)  {:>7.3f} s broadened  {:>7.4f} s fft ({:.1e} error)'.format(
+            name, looped, broadened, fft, error))
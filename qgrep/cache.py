@@ -0,0 +1,241 @@
+"""Persistent cache of the data extracted from output files"""
+import io
+import os
+import time
+import sqlite3
+
+import numpy as np
+
+from configparser import ConfigParser
+
+config_file = os.path.join(os.path.expanduser("~"), '.qgrepconfig')
+config = ConfigParser()
+config.read(config_file)
+
+CACHE_FILE = os.path.join(os.path.expanduser("~"), '.cache', 'qgrep', 'parse_cache.sqlite')
+# Maximum size of all cached data in MB
+MAX_SIZE = 256
+if 'cache' in config:
+    CACHE_FILE = os.path.expanduser(config['cache'].get('file', CACHE_FILE))
+    MAX_SIZE = config['cache'].getfloat('max_size', MAX_SIZE)
+# Fraction of the maximum size pruned down to, so that pruning is rarely needed
+PRUNE_TO = 0.9
+
+# cclib attributes that are stored, atomcoords only keeps the last geometry
+ATTRIBUTES = [
+    'atomcoords', 'atomnos', 'natom', 'charge', 'mult',
+    'scfenergies', 'mpenergies', 'ccenergies',
+    'freeenergy', 'enthalpy', 'entropy',
+    'geovalues', 'geotargets', 'scfvalues',
+    'vibfreqs', 'vibirs', 'vibdisps',
+    'homos', 'moenergies',
+    'etenergies', 'etoscs',
+]
+
+
+class CachedData:
+    """
+    The cached attributes of a parsed output, accessed like a cclib ccData
+    """
+    def __init__(self, attributes):
+        self.metadata = {}
+        self.__dict__.update(attributes)
+
+    def __repr__(self):
+        return '<CachedData {}>'.format(self.metadata.get('package'))
+
+
+class ParseCache:
+    """
+    SQLite cache of parsed output files, keyed on the path and invalidated when
+    the size, modification time or inode of the file changes. The least recently
+    used entries are removed when the cache grows larger than max_size (down to
+    PRUNE_TO of it). The size is kept as a running total of what was cached
+    through this connection and only recounted when pruning.
+    """
+    def __init__(self, cache_file=CACHE_FILE, max_size=MAX_SIZE):
+        """
+        :param cache_file: name of the sqlite database
+        :param max_size: maximum size of the cached data in MB
+        """
+        self.cache_file = cache_file
+        self.max_size = max_size
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        self.connection = sqlite3.connect(cache_file, timeout=60)
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS parses (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime INTEGER,
+                inode INTEGER,
+                accessed REAL,
+                data BLOB)""")
+        # Bytes of cached data, counted when first needed
+        self._total = None
+
+    def __repr__(self):
+        return '<ParseCache {}>'.format(self.cache_file)
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM parses').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def key(file_name):
+        """The path and the file properties that invalidate the cache"""
+        stat = os.stat(file_name)
+        return os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def get(self, file_name):
+        """
+        Get the cached data of a file
+        :return: CachedData or None if not cached or out of date
+        """
+        path, size, mtime, inode = self.key(file_name)
+        row = self.connection.execute('SELECT size, mtime, inode, data FROM parses WHERE path = ?',
+                                      (path,)).fetchone()
+        if row is None or tuple(row[:3]) != (size, mtime, inode):
+            return None
+        with self.connection:
+            self.connection.execute('UPDATE parses SET accessed = ? WHERE path = ?', (time.time(), path))
+        return CachedData(unpack(row[3]))
+
+    def set(self, file_name, data, key=None):
+        """
+        Cache the data of a file
+        :param data: a cclib ccData
+        :param key: key of the file from before it was parsed, so that the data
+            of a file that changed while being parsed is never taken as current
+        :return: the blob that was cached
+        """
+        path, size, mtime, inode = self.key(file_name) if key is None else key
+        blob = pack(extract(data))
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO parses VALUES (?, ?, ?, ?, ?, ?)',
+                                    (path, size, mtime, inode, time.time(), blob))
+        if self._total is None:
+            self._total = self.size()
+        else:
+            # Replaced entries are still counted, which only makes pruning come sooner
+            self._total += len(blob)
+        if self._total > self.max_size*2**20:
+            self.prune()
+        return blob
+
+    def size(self):
+        """Bytes of cached data"""
+        return self.connection.execute('SELECT TOTAL(LENGTH(data)) FROM parses').fetchone()[0]
+
+    def prune(self):
+        """Remove the least recently used entries if over max_size, until under PRUNE_TO of it"""
+        total = self.size()
+        max_bytes = self.max_size*2**20
+        if total > max_bytes:
+            rows = self.connection.execute('SELECT path, LENGTH(data) FROM parses ORDER BY accessed').fetchall()
+            old = []
+            for path, length in rows:
+                if total <= PRUNE_TO*max_bytes:
+                    break
+                old.append((path,))
+                total -= length
+            with self.connection:
+                self.connection.executemany('DELETE FROM parses WHERE path = ?', old)
+        self._total = total
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute('DELETE FROM parses')
+        self._total = 0
+
+
+# The cache in the home directory of each process, connections cannot be shared by forked processes
+_caches = {}
+
+
+def default_cache():
+    """The ParseCache of CACHE_FILE, opened once per process"""
+    pid = os.getpid()
+    if pid not in _caches:
+        _caches[pid] = ParseCache(CACHE_FILE)
+    return _caches[pid]
+
+
+def extract(data):
+    """
+    Extract the cached attributes of a ccData into a dict of arrays
+    Lists of arrays are stored as name#0, name#1, ... and metadata as metadata.key
+    """
+    arrays = {}
+    for attribute in ATTRIBUTES:
+        value = getattr(data, attribute, None)
+        if value is None:
+            continue
+        if attribute == 'atomcoords':
+            value = value[-1:]
+        if isinstance(value, list):
+            for i, val in enumerate(value):
+                arrays['{}#{}'.format(attribute, i)] = np.asarray(val)
+        else:
+            arrays[attribute] = np.asarray(value)
+    for key, value in getattr(data, 'metadata', {}).items():
+        if isinstance(value, (str, bool, int, float)):
+            arrays['metadata.' + key] = np.asarray(value)
+    return arrays
+
+
+def pack(arrays):
+    """Compress a dict of arrays into an npz blob"""
+    f = io.BytesIO()
+    np.savez_compressed(f, **arrays)
+    return f.getvalue()
+
+
+def unpack(blob):
+    """Make the attributes of a CachedData from an npz blob"""
+    attributes = {}
+    lists = {}
+    metadata = {}
+    with np.load(io.BytesIO(blob), allow_pickle=False) as arrays:
+        for key in arrays.files:
+            value = arrays[key]
+            if value.ndim == 0:
+                value = value.item()
+            if key.startswith('metadata.'):
+                metadata[key[9:]] = value
+            elif '#' in key:
+                name, i = key.split('#')
+                lists.setdefault(name, {})[int(i)] = value
+            else:
+                attributes[key] = value
+    for name, values in lists.items():
+        attributes[name] = [values[i] for i in sorted(values)]
+    attributes['metadata'] = metadata
+    return attributes
+
+
+def ccparse(file_name, use_cache=True, cache=None):
+    """
+    Parse an output file with cclib, using the cached results if the file has
+    not changed since it was last parsed
+    :param use_cache: read from and write to the cache (otherwise a plain ccread)
+    :param cache: ParseCache to use, defaults to the one in the home directory (see default_cache)
+    :return: CachedData (or ccData if not using the cache), None if it cannot be parsed
+    """
+    from cclib.io import ccread
+
+    if not use_cache:
+        return ccread(file_name)
+
+    if cache is None:
+        cache = default_cache()
+    data = cache.get(file_name)
+    if data is None:
+        # Output may still be being written
+        key = cache.key(file_name)
+        parsed = ccread(file_name)
+        if parsed is None:
+            return None
+        data = CachedData(unpack(cache.set(file_name, parsed, key)))
+    return data
@@ -1,7 +1,7 @@
 import re
 import math
 
-from .helper import BOHR_TO_ANGSTROM
+from .helper import BOHR_TO_ANGSTROM, last_match
 
 
 def get_geom(lines, geom_type='xyz', units='bohr'):
@@ -243,13 +243,12 @@ def get_diagnostics(lines):
     return (s2, maxT2, t1)
 
 def get_final_energy(lines):
+    """ Obtain the last CCSD(T) energy. """
+    line = last_match(lines, r'\s*CCSD\(T\) energy\s+\S+\s*$')
+    if line is None:
+      return None
 
-    for i in reversed(list(range(len(lines)))):
-      if 'CCSD(T) energy' in lines[i] and len(lines[i].strip().split()) == 3:
-        ccsdpt_energy = lines[i].strip().split()[2]
-        break
-
-    return ccsdpt_energy
+    return line.split()[2]
 
 
 def get_energy(lines):
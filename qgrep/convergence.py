@@ -3,36 +3,143 @@ import numpy as np
 from collections import OrderedDict
 
 
+# One column per convergence criterion, followed by the number of SCF cycles
+step_dtype = np.dtype([
+    ('delta_e', np.float64),
+    ('rms_grad', np.float64),
+    ('max_grad', np.float64),
+    ('rms_step', np.float64),
+    ('max_step', np.float64),
+    ('scf_steps', np.int64),
+])
+
+
 class Step:
     """
-    An object that stores a convergence result
+    A single convergence result, a lightweight view of a row of a Convergence
+    (see Step.view, parsers append the row to their Convergence and view it)
     """
-    def __init__(self, params, criteria):
-        self.__dict__.update(params)
-        self.params = params
-        self.criteria = criteria
+    __slots__ = ('_convergence', '_index')
+
+    def __init__(self, params, criteria=None):
+        """
+        Makes a Step backed by its own single row Convergence
+        :param params: dict of the values, keyed by the names in step_dtype
+        :param criteria: list of tolerances (a trailing 0 for scf_steps is ignored)
+        """
+        criteria = list(criteria[:len(step_dtype) - 1]) if criteria is not None else []
+        convergence = Convergence(criteria=criteria)
+        convergence.append(params)
+        self._convergence = convergence
+        self._index = 0
+
+    @classmethod
+    def view(cls, convergence, index):
+        """A Step viewing a row of a Convergence without copying it"""
+        step = cls.__new__(cls)
+        step._convergence = convergence
+        step._index = index
+        return step
+
+    def __getattr__(self, name):
+        if name in step_dtype.names:
+            return self.row[name].item()
+        raise AttributeError("'Step' object has no attribute '{}'".format(name))
+
+    def __repr__(self):
+        return '<Step {}>'.format(self._index)
+
+    @property
+    def row(self):
+        """The underlying structured array row"""
+        return self._convergence.data[self._index]
+
+    @property
+    def params(self):
+        return OrderedDict(zip(step_dtype.names, self.row.item()))
+
+    @property
+    def criteria(self):
+        return self._convergence.criteria + [0]
 
     def __str__(self):
+        row = self.row.tolist()
+        # Without tolerances nothing is marked as converged
+        criteria = (self._convergence.criteria + [0]*len(row))[:len(row) - 1]
         out = ''
-        for (key, value), criterion in zip(self.params.items(), self.criteria):
-            # integers
-            if key in ['scf_steps']:
-                pass
+        for value, criterion in zip(row, criteria):
             out += '{:> 9.2e}'.format(value)
             out += '*' if abs(value) < criterion else ' '
 
-        out += '|{:> 7d}'.format(value)
+        out += '|{:> 7d}'.format(row[-1])
         return out
 
 
 class Convergence:
     """
-    Stores multiple convergence steps
+    Stores multiple convergence steps as a structured array with a column for
+    each criterion, Steps are views of its rows
     """
-    def __init__(self, steps, criteria, program='orca'):
-        self.steps = steps
-        self.criteria = criteria
+    def __init__(self, steps=(), criteria=None, program='orca'):
+        """
+        :param steps: iterable of Steps or dicts of params, or a structured array of step_dtype
+        :param criteria: list of tolerances of each criterion
+        """
+        self.criteria = list(criteria) if criteria is not None else []
         self.program = program
+        if isinstance(steps, np.ndarray):
+            self._data = steps.astype(step_dtype)
+            self._size = len(steps)
+        else:
+            self._data = np.zeros(8, dtype=step_dtype)
+            self._size = 0
+            for step in steps:
+                self.append(step)
+
+    def __repr__(self):
+        return '<Convergence {} steps>'.format(len(self))
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [Step.view(self, j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Convergence index out of range')
+        return Step.view(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield Step.view(self, i)
+
+    def append(self, step):
+        """
+        Add a step, the storage grows geometrically so appending while parsing is cheap
+        :param step: Step or dict of params
+        """
+        if self._size == len(self._data):
+            data = np.zeros(max(2*len(self._data), 8), dtype=step_dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+        if isinstance(step, Step):
+            self._data[self._size] = step.row
+        else:
+            row = self._data[self._size]
+            for key, value in step.items():
+                row[key] = value
+        self._size += 1
+
+    @property
+    def data(self):
+        """Structured array of all the steps (a view, not a copy)"""
+        return self._data[:self._size]
+
+    @property
+    def steps(self):
+        return list(self)
 
     def __str__(self):
         if self.program == 'orca':
@@ -40,18 +147,18 @@ class Convergence:
         else:
             raise NotImplementedError('Congervence currently only implemented for ORCA')
 
+        keys = step_dtype.names[:-1]
+        # Without tolerances nothing is marked as converged, an energy change of
+        # exactly 0 was not printed (the first step of each optimization)
+        criteria = (self.criteria + [0]*len(keys))[:len(keys)]
         line = '-'*66 + '\n'
         out = header + line
-        for i, step in enumerate(self.steps):
+        for i, row in enumerate(self.data.tolist()):
             out += '{:>3}: '.format(i)
-            for (key, value), criterion in zip(step.params.items(), step.criteria):
-                # integers
-                if key in ['scf_steps']:
-                    pass
-                else:
-                    star = '*' if abs(value) < criterion and not (i == 0 and key == 'delta_e') else ' '
-                    out += '{:> 9.2e}{}'.format(value, star)
-            out += '|{:> 7d}\n'.format(step.scf_steps)
+            for key, value, criterion in zip(keys, row, criteria):
+                star = '*' if abs(value) < criterion and not (key == 'delta_e' and (i == 0 or value == 0)) else ' '
+                out += '{:> 9.2e}{}'.format(value, star)
+            out += '|{:> 7d}\n'.format(row[-1])
 
         return out + line + '    ' + (' {:> 9.2e}'*len(self.criteria)).format(*self.criteria)
 
@@ -61,7 +168,7 @@ class Convergence:
         f, (ax0, ax1) = plt.subplots(1, 2, sharex='col')
         f.suptitle('Convergence', fontsize=16)
         plt.xlabel('Step')
-        x = range(len(self.steps))
+        x = range(len(self))
 
         ax0.set_yscale('symlog', linthreshy=1e-5)
         ax0.set_title(r'$\Delta$ Energy')
@@ -76,38 +183,38 @@ class Convergence:
         ax1.plot(x, self.rms_step, 'r-' , label='RMS Step')
         ax1.plot(x, self.max_step, 'r--', label='Max Step')
         # TODO: generalize for more than ORCA
-        ax1.plot(x, [self.criteria[1]]*len(self.steps), 'k-')
-        ax1.plot(x, [self.criteria[1]]*len(self.steps), 'b*')
-        ax1.plot(x, [self.criteria[2]]*len(self.steps), 'k--' )
-        ax1.plot(x, [self.criteria[2]]*len(self.steps), 'b*' )
-        ax1.plot(x, [self.criteria[3]]*len(self.steps), 'k-')
-        ax1.plot(x, [self.criteria[3]]*len(self.steps), 'r*')
-        ax1.plot(x, [self.criteria[4]]*len(self.steps), 'k--' )
-        ax1.plot(x, [self.criteria[4]]*len(self.steps), 'r*' )
+        ax1.plot(x, [self.criteria[1]]*len(self), 'k-')
+        ax1.plot(x, [self.criteria[1]]*len(self), 'b*')
+        ax1.plot(x, [self.criteria[2]]*len(self), 'k--' )
+        ax1.plot(x, [self.criteria[2]]*len(self), 'b*' )
+        ax1.plot(x, [self.criteria[3]]*len(self), 'k-')
+        ax1.plot(x, [self.criteria[3]]*len(self), 'r*')
+        ax1.plot(x, [self.criteria[4]]*len(self), 'k--' )
+        ax1.plot(x, [self.criteria[4]]*len(self), 'r*' )
         ax1.legend()
 
         plt.show()
 
     @property
     def delta_e(self):
-        return np.array([step.delta_e for step in self.steps])
-
-    @property
-    def rms_e(self):
-        return np.array([step.rms_e for step in self.steps])
+        return self.data['delta_e']
 
     @property
     def max_grad(self):
-        return np.array([step.max_grad for step in self.steps])
+        return self.data['max_grad']
 
     @property
     def rms_grad(self):
-        return np.array([step.rms_grad for step in self.steps])
+        return self.data['rms_grad']
 
     @property
     def max_step(self):
-        return np.array([step.max_step for step in self.steps])
+        return self.data['max_step']
 
     @property
     def rms_step(self):
-        return np.array([step.rms_step for step in self.steps])
+        return self.data['rms_step']
+
+    @property
+    def scf_steps(self):
+        return self.data['scf_steps']
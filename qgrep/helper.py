@@ -1,21 +1,148 @@
 """A repository for various helper functions"""
+import os
+import re
+import sys
+import mmap
+import itertools
+import multiprocessing
+
 import numpy as np
 
 BOHR_TO_ANGSTROM=0.52917721067
 
 
-def read(file_name):
+def read(file_name, mapped=False):
     """
     Reads the given file and returns its lines and the type of program that uses
     it
+    :param mapped: return a MappedFile instead of reading all the lines, useful
+        when only the end of a large file is needed. The orca functions take it
+        in place of the lines, the others need a list of lines.
     """
-    with open(file_name, 'r') as f:
-        lines = f.readlines()
+    if mapped:
+        lines = MappedFile(file_name)
+    else:
+        with open(file_name, 'r') as f:
+            lines = f.readlines()
     program = check_program(file_name)
 
     return lines, program
 
 
+class MappedFile:
+    """
+    Lines of a file that are only read when iterated over. Iterating in reverse
+    uses a memory map, so finding something near the end of a very large file
+    only touches the end of the file.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def __repr__(self):
+        return '<MappedFile {}>'.format(self.file_name)
+
+    def __iter__(self):
+        with open(self.file_name) as f:
+            yield from f
+
+    def __reversed__(self):
+        with open(self.file_name, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = len(mm)
+                while end > 0:
+                    # Skip the newline that ends the current line
+                    start = mm.rfind(b'\n', 0, end - 1) + 1
+                    yield mm[start:end].decode('utf-8', 'replace')
+                    end = start
+
+
+def last_match(lines, pattern):
+    """
+    Find the last line that matches the pattern, reading backwards
+    :param lines: list of lines or a MappedFile
+    :param pattern: regex that must match the beginning of the line
+    :return: the matching line or None
+    """
+    match = re.compile(pattern).match
+    for line in reversed(lines):
+        if match(line):
+            return line
+    return None
+
+
+def parallel_map(function, inputs, jobs=1, progress=False):
+    """
+    Map a function over the inputs in a pool of processes, yielding the results
+    in the same order as the inputs as soon as they are available. The processes
+    are forked where possible, so the function may be defined in a script
+    (spawned processes would run the script again and cannot find it).
+    :param jobs: number of processes, 1 runs in this process and 0 (or less) uses one per CPU
+    :param progress: write a progress line to stderr while waiting for results
+    """
+    total = len(inputs)
+    progress = progress and sys.stderr.isatty()
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+
+    def show(done):
+        if progress:
+            sys.stderr.write('\r\033[K[{}/{}]'.format(done, total))
+            sys.stderr.flush()
+
+    def clear():
+        if progress:
+            sys.stderr.write('\r\033[K')
+            sys.stderr.flush()
+
+    if jobs == 1:
+        results = map(function, inputs)
+        pool = None
+    else:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        pool = context.Pool(jobs)
+        results = pool.imap(function, inputs)
+    try:
+        show(0)
+        for i, result in enumerate(results, start=1):
+            clear()
+            yield result
+            if i < total:
+                show(i)
+    finally:
+        clear()
+        if pool is not None:
+            pool.terminate()
+
+
+# Banners (stripped lines) that identify the program that wrote a file
+programs = {
+    '* O   R   C   A *': 'orca',
+    'Welcome to Q-Chem': 'qchem',
+    'PSI4: An Open-Source Ab Initio Electronic Structure Package': 'psi4',
+    'Psi4: An Open-Source Ab Initio Electronic Structure Package': 'psi4',
+    'Northwest Computational Chemistry Package (NWChem)': 'nwchem',
+    '#ZMATRIX': 'zmatrix',
+    '* CFOUR Coupled-Cluster techniques for Computational Chemistry *': 'cfour',
+    '***  PROGRAM SYSTEM MOLPRO  ***': 'molpro', # Printed after input file
+    "----- GAMESS execution script 'rungms' -----": 'gamess',
+    'N A T U R A L   A T O M I C   O R B I T A L   A N D': 'nbo',
+    'Entering Gaussian System, Link 0=g09': 'gaussian',
+    'BAGEL - Freshly leavened quantum chemistry': 'bagel',
+}
+# A single regex that finds the first banner in a block of the file
+programs_re = re.compile(rb'^[ \t]*(' + b'|'.join(re.escape(banner.encode()) for banner in programs)
+                         + rb')[ \t]*\r?$', re.MULTILINE)
+# Size of the block at the beginning of the file that is searched for a banner
+HEADER_SIZE = 2**16
+# Results of check_program, keyed on the path, size and modification time
+_program_cache = {}
+
+
 def check_program(file_name):
     """
     Takes the name of an output file and determines what program wrote (or
@@ -23,33 +150,34 @@ def check_program(file_name):
     :param file_name: name of the output file
     :return: string of the program or None
     """
-    programs = {
-        '* O   R   C   A *': 'orca',
-        'Welcome to Q-Chem': 'qchem',
-        'PSI4: An Open-Source Ab Initio Electronic Structure Package': 'psi4',
-        'Psi4: An Open-Source Ab Initio Electronic Structure Package': 'psi4',
-        'Northwest Computational Chemistry Package (NWChem)': 'nwchem',
-        '#ZMATRIX': 'zmatrix',
-        '* CFOUR Coupled-Cluster techniques for Computational Chemistry *': 'cfour',
-        '***  PROGRAM SYSTEM MOLPRO  ***': 'molpro',
-        "----- GAMESS execution script 'rungms' -----": 'gamess',
-        'N A T U R A L   A T O M I C   O R B I T A L   A N D': 'nbo',
-        'Entering Gaussian System, Link 0=g09': 'gaussian',
-        '***  PROGRAM SYSTEM MOLPRO  ***': 'molpro', # Printed after input file
-        'BAGEL - Freshly leavened quantum chemistry': 'bagel',
-    }
+    stat = os.stat(file_name)
+    key = (os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns)
+    if key in _program_cache:
+        return _program_cache[key]
+
+    with open(file_name, 'rb') as f:
+        header = f.read(HEADER_SIZE)
 
     program = None
-    with open(file_name) as f:
-        for i in range(200):
-            line = f.readline().strip()
-            if line in programs:
-                program = programs[line]
-                break
+    match = programs_re.search(header)
+    if match:
+        program = programs[match.group(1).decode()]
 
+    _program_cache[key] = program
     return program
 
 
+# Line beginnings that identify an input file, checked in order
+input_programs_re = re.compile(r"""
+    (?P<nbo>\$NBO)
+    |(?P<qchem>\$)
+    |(?P<cfour>\*CFOUR\()
+    |(?P<orca>\*\ xyz|\*\ int)
+    |(?P<gamess>\ \$)
+    |(?P<psi4>molecule|set\ )
+""", re.VERBOSE)
+
+
 def find_input_program(in_file):
     """
     Find the type of input file based on unique identifiers
@@ -57,54 +185,74 @@ def find_input_program(in_file):
     :param: in_file: file name string
     :return: string of the program or None
     """
-    lines = open(in_file).readlines()
-    if '***,' == lines[0][:4]:
-        return 'molpro'
-    elif '% pal nprocs ' == lines[0][:13]:
-        return 'orca'
-
-    for line in lines:
-        if '$NBO' == line[:4]:
-            return 'nbo'
-        if '$' == line[0]:
-            return 'qchem'
-        elif '*CFOUR(' == line[:7]:
-            return 'cfour'
-        elif '* xyz' == line[:5] or '* int' == line[:5]:
+    with open(in_file) as f:
+        first = f.readline()
+        if '***,' == first[:4]:
+            return 'molpro'
+        elif '% pal nprocs ' == first[:13]:
             return 'orca'
-        elif ' $' == line[:2]:
-            return 'gamess'
-        elif 'molecule' == line[:8] or 'set ' == line[:4]:
-            return 'psi4'
+
+        # Stop reading as soon as an identifier is found
+        match = input_programs_re.match
+        for line in itertools.chain([first], f):
+            m = match(line)
+            if m:
+                return m.lastgroup
     return None
 
 
-# Values from NIST
-energy_conversions = {
-    'hartree': {'hartree': 1, 'kJ/mol': 2625.49962, 'kcal/mol': 627.509, 'eV': 27.21138602, '1/cm': 2.194746313702e5},
-    'kJ/mol': {'hartree': 3.8088e-4, 'kJ/mol': 1, 'kcal/mol': 0.23901, 'eV': 1.0364e-2, '1/cm': 83.593},
-    'kcal/mol': {'hartree': 1.5936e-3, 'kJ/mol': 4.1840, 'kcal/mol': 1, 'eV': 4.3363e-2, '1/cm': 349.75},
-    'eV': {'hartree': 3.6749e-2, 'kJ/mol': 96.485, 'kcal/mol': 23.061, 'eV': 1, '1/cm': 8065.5},
-    '1/cm': {'hartree': 4.556335252767e-6, 'kJ/mol': 1.1963e-2, 'kcal/mol': 2.8591e-3, 'eV': 1.2398e-4, '1/cm': 1}
-}
+# Value of one hartree in each unit, from CODATA 2014 (with thermochemical calories),
+# every conversion is the ratio of two of these
+energy_units = ('hartree', 'kJ/mol', 'kcal/mol', 'eV', '1/cm')
+energy_factors = np.array([1, 2625.499639, 627.509474, 27.21138602, 2.194746313702e5])
+energy_indices = {unit: i for i, unit in enumerate(energy_units)}
+energy_conversions = {in_type: {out_type: float(energy_factors[o]/energy_factors[i])
+                                for o, out_type in enumerate(energy_units)}
+                      for i, in_type in enumerate(energy_units)}
+
 
+def energy_factor(in_type='hartree', out_type='kcal/mol'):
+    """
+    The factor that converts energies between units
+    :param in_type: unit, or array of units (e.g. of the columns of a table)
+    :param out_type: unit, or array of units
+    :return: float, or an array of the factors broadcast over the units
+    """
+    try:
+        if isinstance(in_type, str) and isinstance(out_type, str):
+            return energy_conversions[in_type][out_type]
+        in_indices = np.vectorize(energy_indices.__getitem__, otypes=[int])(in_type)
+        out_indices = np.vectorize(energy_indices.__getitem__, otypes=[int])(out_type)
+    except KeyError:
+        raise SyntaxError("Unsupported energy type, please use {}".format(list(energy_units)))
+    return energy_factors[out_indices]/energy_factors[in_indices]
 
-def convert_energy(data, in_type='hartree', out_type='kcal/mol'):
-    if in_type not in energy_conversions or out_type not in energy_conversions[in_type]:
-        raise SyntaxError("Unsupported energy type, please use {}".format(list(energy_conversions.keys())))
-    conversion = energy_conversions[in_type][out_type]
 
-    if isinstance(data, (int, float)):
-        return data * conversion
-    elif isinstance(data, np.ndarray):
-        return data * np.full(data.shape, conversion)
-    elif isinstance(data, (list, tuple)):
+def convert_energy(data, in_type='hartree', out_type='kcal/mol', out=None):
+    """
+    Convert energies between units with a single multiply
+    :param data: number, array or sequence of energies
+    :param in_type: unit of the data, or array of units broadcast over the data
+        (e.g. one for each column)
+    :param out_type: unit to convert to, or array of units
+    :param out: array to write the result to, may be data to convert in place
+    :return: float for a number, otherwise an array (of the same floating
+        point dtype as the data)
+    """
+    factor = energy_factor(in_type, out_type)
+    if isinstance(data, (int, float)) and out is None:
+        return data*factor
+
+    if not isinstance(data, (np.ndarray, np.generic)):
+        if not isinstance(data, (int, float, list, tuple)):
+            raise SyntaxError("{} is not currently supported. Please use int, float, np.ndarray, or list".format(type(data)))
         try:
-            return [conversion * i for i in data]
-        except TypeError:
+            data = np.asarray(data, dtype=float)
+        except (TypeError, ValueError):
             raise SyntaxError("List may only be filled with numbers.")
-    else:
-        raise SyntaxError(type(data) + " is not currently supported. Please use int, float, np.ndarray, or list")
+    # Keep single (or extended) precision, integers become floats
+    dtype = data.dtype if np.issubdtype(data.dtype, np.inexact) else np.dtype(float)
+    return np.multiply(data, np.asarray(factor, dtype=dtype), out=out)
 
 
 class colors:
@@ -0,0 +1,250 @@
+"""Record the history of the queues and analyze it"""
+import os
+import sys
+import time
+import sqlite3
+
+from collections import OrderedDict
+from configparser import ConfigParser
+
+from .queues import Queues
+from .schedulers import id_text
+
+config_file = os.path.join(os.path.expanduser("~"), '.qgrepconfig')
+config = ConfigParser()
+config.read(config_file)
+
+HISTORY_FILE = os.path.join(os.path.expanduser("~"), '.cache', 'qgrep', 'queue_history.sqlite')
+# Seconds between samples of the scheduler
+HISTORY_INTERVAL = 60
+if 'history' in config:
+    HISTORY_FILE = os.path.expanduser(config['history'].get('file', HISTORY_FILE))
+    HISTORY_INTERVAL = max(config['history'].getfloat('interval', HISTORY_INTERVAL), 1)
+
+
+def snapshot(queues):
+    """
+    The state of every job of the queues
+    :return: dict of (position, queue name, owner) keyed by the job id as text
+    """
+    jobs = {}
+    for name, queue in queues.queues.items():
+        for jid, job in queue.running.items():
+            jobs[id_text(jid)] = ('running', name, job.owner)
+        for jid, job in queue.queueing.items():
+            jobs[id_text(jid)] = ('queueing', name, job.owner)
+    return jobs
+
+
+class QueueHistory:
+    """
+    SQLite record of the queues, only changes are stored:
+        events: a job arriving (queued), starting or finishing (disappearing)
+        samples: the number of used and available slots and of queued jobs of
+            a queue whenever they change
+    The time of the last sample is kept so the final state has a duration.
+    """
+    def __init__(self, history_file=HISTORY_FILE):
+        """
+        :param history_file: name of the sqlite database
+        """
+        self.history_file = history_file
+        os.makedirs(os.path.dirname(os.path.abspath(history_file)), exist_ok=True)
+        self.connection = sqlite3.connect(history_file, timeout=60)
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS events (
+                time REAL,
+                job_id TEXT,
+                event TEXT,
+                queue TEXT,
+                owner TEXT)""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS samples (
+                time REAL,
+                queue TEXT,
+                used INTEGER,
+                avail INTEGER,
+                queued INTEGER)""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value REAL)""")
+            self.connection.execute('CREATE INDEX IF NOT EXISTS events_job ON events (job_id, event)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS samples_time ON samples (queue, time)')
+        self.jobs = self._open_jobs()
+        self.usage = self._last_samples()
+
+    def __repr__(self):
+        return '<QueueHistory {}>'.format(self.history_file)
+
+    def close(self):
+        self.connection.close()
+
+    def _open_jobs(self):
+        """Jobs that have not finished, from the last event of each job"""
+        jobs = {}
+        rows = self.connection.execute("""SELECT job_id, event, queue, owner FROM events
+                                          ORDER BY time, rowid""")
+        for jid, event, queue, owner in rows:
+            if event == 'finish':
+                jobs.pop(jid, None)
+            else:
+                jobs[jid] = ('running' if event == 'start' else 'queueing', queue, owner)
+        return jobs
+
+    def _last_samples(self):
+        """The last sample of each queue"""
+        rows = self.connection.execute("""SELECT queue, used, avail, queued FROM samples
+                                          ORDER BY time, rowid""")
+        return {queue: tuple(values) for queue, *values in rows}
+
+    @property
+    def last_sample(self):
+        """Time of the last sample, None if nothing has been recorded"""
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'last_sample'").fetchone()
+        return row[0] if row else None
+
+    def record(self, queues, now=None):
+        """
+        Record the changes since the last sample
+        :param queues: Queues with the current jobs
+        :param now: time of the sample (seconds since the epoch), defaults to now
+        :return: number of events recorded
+        """
+        now = time.time() if now is None else now
+        jobs = snapshot(queues)
+        events = []
+        for jid, (position, queue, owner) in jobs.items():
+            old = self.jobs.get(jid)
+            if old is None:
+                # Jobs first seen running only have a start
+                events.append((now, jid, 'start' if position == 'running' else 'arrive', queue, owner))
+            elif position == 'running' and old[0] != 'running':
+                events.append((now, jid, 'start', queue, owner))
+        for jid, (position, queue, owner) in self.jobs.items():
+            if jid not in jobs:
+                events.append((now, jid, 'finish', queue, owner))
+
+        samples = []
+        for name in sorted(set(queues.sizes) | set(queues.queues)):
+            queue = queues.queues.get(name)
+            # Queues without jobs are not made
+            if queue is None:
+                usage = (0, queues.sizes[name], 0)
+            else:
+                usage = (queue.used, queue.avail, queue.queued)
+            if self.usage.get(name) != usage:
+                samples.append((now, name) + usage)
+                self.usage[name] = usage
+
+        with self.connection:
+            self.connection.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?)', events)
+            self.connection.executemany('INSERT INTO samples VALUES (?, ?, ?, ?, ?)', samples)
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('last_sample', ?)", (now,))
+        self.jobs = jobs
+        return len(events)
+
+    def run(self, queues=None, interval=HISTORY_INTERVAL, duration=None):
+        """
+        Sample the scheduler periodically, with a single scheduler call per sample.
+        Samples where the scheduler fails are skipped, writing the error to stderr.
+        :param queues: Queues to refresh, otherwise they are read
+        :param interval: seconds between samples
+        :param duration: seconds to record for, None records forever
+        """
+        # Queues that were passed in have just been read
+        fresh = queues is not None
+        end = None if duration is None else time.time() + duration
+        while True:
+            start = time.time()
+            try:
+                if queues is None:
+                    queues = Queues()
+                elif not fresh:
+                    queues.refresh()
+                fresh = False
+                self.record(queues, start)
+            except Exception as e:
+                # A failed query of the scheduler (e.g. a timeout) is tried again at the next sample
+                sys.stderr.write('{} Could not sample the queues: {}\n'.format(
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start)), e))
+                sys.stderr.flush()
+            if end is not None and start + interval > end:
+                break
+            time.sleep(max(interval - (time.time() - start), 0))
+
+    def wait_times(self, since=None):
+        """
+        Mean time jobs waited in each queue before starting, only jobs seen
+        arriving are counted
+        :param since: only jobs that started after this time
+        :return: OrderedDict of (mean seconds, number of jobs) keyed by queue
+        """
+        rows = self.connection.execute("""
+            SELECT s.queue, AVG(s.time - a.time), COUNT(*)
+            FROM events s JOIN events a ON a.job_id = s.job_id AND a.event = 'arrive' AND a.time <= s.time
+            WHERE s.event = 'start' AND s.time >= ?
+            GROUP BY s.queue ORDER BY s.queue""", (since or 0,))
+        return OrderedDict((queue, (mean, count)) for queue, mean, count in rows)
+
+    def throughput(self, since=None):
+        """
+        Number of jobs of each user that finished
+        :param since: only jobs that finished after this time
+        :return: OrderedDict of the number of jobs keyed by owner, most first
+        """
+        rows = self.connection.execute("""
+            SELECT owner, COUNT(*) FROM events WHERE event = 'finish' AND time >= ?
+            GROUP BY owner ORDER BY COUNT(*) DESC, owner""", (since or 0,))
+        return OrderedDict(rows)
+
+    def _usage_intervals(self, queue, since=None, until=None):
+        """
+        The usage of a queue as a step function
+        :return: generator of (start, end, used, used + avail) with nothing outside of since and until
+        """
+        until = self.last_sample if until is None else until
+        if until is None:
+            return
+        since = float('-inf') if since is None else since
+        rows = self.connection.execute('SELECT time, used, avail FROM samples WHERE queue = ? ORDER BY time, rowid',
+                                       (queue,)).fetchall()
+        for (start, used, avail), end in zip(rows, [row[0] for row in rows[1:]] + [until]):
+            start, end = max(start, since), min(end, until)
+            if end > start:
+                yield start, end, used, used + avail
+
+    def utilization(self, since=None, until=None):
+        """
+        Fraction of each queue that was used, weighted by time
+        :return: OrderedDict of fractions keyed by queue
+        """
+        out = OrderedDict()
+        for queue in self.queues():
+            used = total = 0
+            for start, end, queue_used, size in self._usage_intervals(queue, since, until):
+                used += queue_used*(end - start)
+                total += size*(end - start)
+            if total:
+                out[queue] = used/total
+        return out
+
+    def utilization_series(self, queue, bucket=3600, since=None, until=None):
+        """
+        Fraction of a queue that was used over time
+        :param bucket: seconds in each point, aligned to multiples of it since the epoch
+        :return: list of (start of bucket, fraction used)
+        """
+        buckets = OrderedDict()
+        for start, end, used, size in self._usage_intervals(queue, since, until):
+            # Split the interval at the bucket boundaries
+            while start < end:
+                key = start//bucket*bucket
+                stop = min(end, key + bucket)
+                totals = buckets.setdefault(key, [0, 0])
+                totals[0] += used*(stop - start)
+                totals[1] += size*(stop - start)
+                start = stop
+        return [(key, used/total) for key, (used, total) in buckets.items() if total]
+
+    def queues(self):
+        """Names of all the queues sampled"""
+        return [row[0] for row in self.connection.execute('SELECT DISTINCT queue FROM samples ORDER BY queue')]
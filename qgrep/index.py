@@ -0,0 +1,178 @@
+"""Single pass indexing of output files"""
+import io
+import re
+
+from .helper import MappedFile
+
+
+class OutputIndex:
+    """
+    Records the position of every section marker of an output file in a single
+    pass so that extractors can seek directly to the section they need.
+
+    Positions are byte offsets when built from a file and line numbers when
+    built from a list of lines, both increase through the file so they can be
+    compared with each other.
+    """
+    def __init__(self, file_name=None, markers=None, lines=None):
+        """
+        :param file_name: name of the output file to index
+        :param markers: dict of marker names and the regex that begins the line
+        :param lines: lines to index instead of a file (if already read)
+        """
+        self.file_name = file_name
+        self.markers = markers if markers else {}
+        self.positions = {name: [] for name in self.markers}
+        self._lines = lines
+        self._previous = {}
+        self.last_line = None
+
+        if lines is None and file_name is None:
+            raise ValueError('Must specify either a file_name or lines to index.')
+
+        # Single regex, the group that matched names the marker
+        pattern = '|'.join('(?P<{}>{})'.format(name, marker)
+                           for name, marker in self.markers.items())
+        self._regex = re.compile(pattern)
+        self._bytes_regex = re.compile(pattern.encode())
+        if lines is None:
+            self._index_file()
+        else:
+            self._index_lines()
+
+    def __repr__(self):
+        return '<OutputIndex {}>'.format(self.file_name)
+
+    def __len__(self):
+        """Number of markers found"""
+        return sum(map(len, self.positions.values()))
+
+    def _index_file(self):
+        match = self._bytes_regex.match
+        positions = self.positions
+        previous = offset = 0
+        with open(self.file_name, 'rb') as f:
+            for line in f:
+                m = match(line)
+                if m and m.lastgroup:
+                    positions[m.lastgroup].append(offset)
+                    self._previous[offset] = previous
+                previous = offset
+                offset += len(line)
+        self.last_line = previous if offset else None
+
+    def _index_lines(self):
+        self.last_line = len(self._lines) - 1 if self._lines else None
+        if not self.markers:
+            return
+        match = self._regex.match
+        for i, line in enumerate(self._lines):
+            m = match(line)
+            if m and m.lastgroup:
+                self.positions[m.lastgroup].append(i)
+
+    def first(self, name, after=None, before=None):
+        """
+        Position of the first occurrence of a marker
+        :param after: only consider markers after this position
+        :param before: only consider markers before this position
+        :return: position or None if not found
+        """
+        for pos in self.positions.get(name, []):
+            if after is not None and pos <= after:
+                continue
+            if before is not None and pos >= before:
+                break
+            return pos
+        return None
+
+    def last(self, name, before=None):
+        """
+        Position of the last occurrence of a marker
+        :param before: only consider markers before this position
+        :return: position or None if not found
+        """
+        for pos in reversed(self.positions.get(name, [])):
+            if before is None or pos < before:
+                return pos
+        return None
+
+    def previous(self, pos):
+        """Position of the line before a marker"""
+        if self._lines is not None:
+            return max(pos - 1, 0)
+        return self._previous[pos]
+
+    def line(self, pos):
+        """The line at a position"""
+        return self.lines(pos, 1)[0]
+
+    def lines(self, pos, count):
+        """
+        Read a number of lines starting at a position
+        :param pos: position of the first line
+        :param count: number of lines to read
+        """
+        if self._lines is not None:
+            return self._lines[pos:pos + count]
+        out = []
+        with open(self.file_name, 'rb') as f:
+            f.seek(pos)
+            for line in f:
+                out.append(line.decode('utf-8', 'replace'))
+                if len(out) == count:
+                    break
+        return out
+
+    def read(self, start, stop=None):
+        """
+        Read all lines between two positions
+        :param start: position of the first line
+        :param stop: position after the last line, None reads to the end
+        """
+        if self._lines is not None:
+            return self._lines[start:stop]
+        with open(self.file_name, 'rb') as f:
+            f.seek(start)
+            data = f.read() if stop is None else f.read(stop - start)
+        # Only split on newlines, like iterating over the file
+        return list(io.StringIO(data.decode('utf-8', 'replace')))
+
+    def block(self, pos, skip=0, end='\n'):
+        """
+        Read the lines after a marker until the end line is reached
+        :param pos: position of the marker
+        :param skip: number of lines after the marker to skip
+        :param end: line that terminates the block (not included)
+        :return: list of lines or None if the end line was not found
+        """
+        if self._lines is not None:
+            for i in range(pos + skip, len(self._lines)):
+                if self._lines[i] == end:
+                    return self._lines[pos + skip:i]
+            return None
+        out = []
+        with open(self.file_name, 'rb') as f:
+            f.seek(pos)
+            for i, line in enumerate(f):
+                if i < skip:
+                    continue
+                line = line.decode('utf-8', 'replace')
+                if line == end:
+                    return out
+                out.append(line)
+        return None
+
+
+def as_index(lines, markers):
+    """
+    Return an OutputIndex for the lines, indexing them if necessary
+    :param lines: an OutputIndex, a list of lines or a MappedFile (its file is
+        indexed without reading all of its lines)
+    :param markers: markers to index if lines is not already an OutputIndex
+    """
+    if isinstance(lines, OutputIndex):
+        return lines
+    if isinstance(lines, MappedFile):
+        return OutputIndex(lines.file_name, markers)
+    return OutputIndex(markers=markers, lines=lines)
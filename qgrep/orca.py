@@ -1,93 +1,138 @@
 """Source for all orca related functions"""
+import io
+import os
 import re
+import mmap
+import time
+
+import numpy as np
 
 from collections import OrderedDict
 
+from .index import OutputIndex, as_index
+from .helper import last_match
 from .molecule import Molecule
+from .trajectory import Trajectory
 from .convergence import Convergence, Step
 
+# Regexes matching the beginning of the lines that start each section
+markers = OrderedDict((
+    ('xyz_angstrom', r'CARTESIAN COORDINATES \(ANGSTROEM\)\n'),
+    ('zmat_angstrom', r'INTERNAL COORDINATES \(ANGSTROEM\)\n'),
+    ('xyz_bohr', r'CARTESIAN COORDINATES \(A\.U\.\)\n'),
+    ('zmat_bohr', r'INTERNAL COORDINATES \(A\.U\.\)\n'),
+    ('sp', r'FINAL SINGLE POINT ENERGY'),
+    ('gibbs', r'Final Gibbs free enthalpy'),
+    ('enthalpy', r'Total enthalpy'),
+    ('entropy', r'Total entropy correction'),
+    ('zpve', r'Zero point energy'),
+    ('orbital_energies', r'ORBITAL ENERGIES\n'),
+    ('vib_freqs', r'VIBRATIONAL FREQUENCIES\n'),
+    ('normal_modes', r'NORMAL MODES\n'),
+    ('ir_spectrum', r'IR SPECTRUM\n'),
+    ('first_vibration', r'The first frequency considered to be a vibration is '),
+    ('charge', r' Total Charge'),
+    ('multiplicity', r' Multiplicity'),
+    ('nat_orb_occ', r'Natural Orbital Occupation Numbers:\n'),
+    ('geometry_convergence', r'.*Geometry convergence'),
+))
+
+# IR spectrum rows (mode, T**2), e.g.
+#    6:       401.64    0.622498  ( -0.739435  -0.242807   0.129531)
+ir_re = re.compile(r'\s*(\d+):.*?(\S+)\s+\(')
+
+# Which field of the energy line holds the value
+energy_fields = {
+    'sp': 4,
+    'gibbs': -2,
+    'enthalpy': -2,
+    'entropy': 4,
+    'zpve': 4,
+}
+
+
+def index_file(file_name):
+    """
+    Index an orca output file in a single pass, the result can be passed to
+    any of the functions below in place of the lines
+    """
+    return OutputIndex(file_name, markers)
+
+
+def _last_line(lines, name):
+    """
+    Find the last line beginning with the named marker, only reading the end of
+    lists of lines and MappedFiles
+    """
+    if isinstance(lines, OutputIndex):
+        pos = lines.last(name)
+        return None if pos is None else lines.line(pos)
+    return last_match(lines, markers[name])
+
 
 def get_geom(lines, geom_type='xyz', units='angstrom'):
     """
-    Takes the lines of an orca output file and returns its last geometry in the
-    specified format
-    """
-    start = ''
-    end = '\n'
-    if geom_type == 'xyz' and units == 'angstrom':
-        start = 'CARTESIAN COORDINATES (ANGSTROEM)\n'
-    elif geom_type == 'zmat' and units == 'angstrom':
-        start = 'INTERNAL COORDINATES (ANGSTROEM)\n'
-    elif geom_type == 'xyz' and units == 'bohr':
-        start = 'CARTESIAN COORDINATES (A.U.)\n'
-    elif geom_type == 'zmat' and units == 'bohr':
-        start = 'INTERNAL COORDINATES (A.U.)\n'
-    else:
+    Takes the lines (or OutputIndex) of an orca output file and returns its last
+    geometry in the specified format
+    """
+    if geom_type not in ['xyz', 'zmat'] or units not in ['angstrom', 'bohr']:
         print("Invalid format or units")
         return ''
 
-    geom_start = -1
-    # Iterate backwards until the start of the last set of coordinates is found
-    for i in reversed(list(range(len(lines)))):
-        if start == lines[i]:
-            geom_start = i + 2
-            break
-    if geom_start == -1:
+    index = as_index(lines, markers)
+    geom_start = index.last(geom_type + '_' + units)
+    if geom_start is None:
         print("Could not find start of geometry")
         return ''
 
-    geom_end = -1
-    for i in range(geom_start, len(lines)):
-        if end == lines[i]:
-            geom_end = i
-            break
-    if geom_end == -1:
+    # The bohr cartesian coordinates have an extra header line
+    skip = 3 if geom_type == 'xyz' and units == 'bohr' else 2
+    geom = index.block(geom_start, skip)
+    if geom is None:
         return ''
 
-    if geom_type == 'xyz' and units == 'bohr':
-        geom_start += 1
-    geom = lines[geom_start: geom_end]
-
     return geom
 
 
-def plot(lines, geom_type='xyz'):
-    """Plots the geometries from the optimization steps"""
-    start = 'CARTESIAN COORDINATES (ANGSTROEM)\n'
-    end = 'CARTESIAN COORDINATES (A.U.)\n'
+def trajectory(lines):
+    """
+    Reads the geometries of all the steps (in angstrom) into a Trajectory
+    :return: Trajectory or None if no geometries are found
+    """
+    index = as_index(lines, markers)
+    starts = index.positions['xyz_angstrom']
+    if not starts:
+        return None
 
-    geoms_start = []
-    geoms_end = []
-    for i in range(len(lines)):
-        if start == lines[i]:
-            geoms_start.append(i + 2)
-        if end == lines[i]:
-            geoms_end.append(i - 2)
+    atoms, coords = None, None
+    for i, start in enumerate(starts):
+        geom = np.array(''.join(index.block(start, 2) or []).split()).reshape(-1, 4)
+        if coords is None:
+            atoms = geom[:, 0]
+            coords = np.empty((len(starts), len(atoms), 3))
+        elif len(geom) != len(atoms):
+            raise ValueError('Number of atoms changed in step {}'.format(i))
+        coords[i] = geom[:, 1:].astype(float)
 
-    geoms = []
-    length = geoms_end[0] - geoms_start[0]
-    for i in range(len(geoms_start)):
-        start = geoms_start[i]
-        end = geoms_end[i]
-        if end - start != length:
-            length = end - start
+    return Trajectory(atoms, coords)
 
-        geom = str(length) + '\nStep {0}\n'.format(i)
-        for line in lines[start:end]:
-            geom += '\t'.join(line.split()) + '\n'
 
-        geoms.append(geom)
+def plot(lines, geom_type='xyz'):
+    """Plots the geometries from the optimization steps"""
+    traj = trajectory(lines)
+    if traj is None:
+        return []
 
-    return geoms
+    form = '{}\t{:.6f}\t{:.6f}\t{:.6f}\n'
+    return [traj.frame(i, form) for i in range(len(traj))]
 
 
 def check_convergence(lines):
     """Returns all the geometry convergence results"""
-    convergence_result = 'Geometry convergence'
+    index = as_index(lines, markers)
     convergence_list = []
-    for i in range(len(lines)):
-        if convergence_result in lines[i]:
-            convergence_list.append(''.join(lines[i - 1:i + 11]))
+    for pos in index.positions['geometry_convergence']:
+        convergence_list.append(''.join(index.lines(index.previous(pos), 12)))
 
     return convergence_list
 
@@ -107,135 +152,98 @@ def template(geom='', jobtype='Opt', functional='B3LYP', basis='sto-3g'):
     return template_style.format(jobtype, functional, basis, geom)
 
 
+def normal_modes(lines):
+    """
+    Reads the last vibrational analysis
+
+    Model of the NORMAL MODES block for an N atom molecule, read in bulk one
+    column group at a time
+                  0          1      ...      5
+          0       #          #      ...      #       (atom1 x)
+          1       #          #      ...      #       (atom1 y)
+          ...
+       3N-1       #          #      ...      #       (atomN z)
+                  6          7      ...      11
+          ...
+
+    :return: structured array with a freq, ir (T**2) and disp (N x 3) field for
+        each of the 3N modes (including translations and rotations), None if
+        no frequencies are found
+    """
+    index = as_index(lines, markers)
+    vib_freqs_start = index.last('vib_freqs')
+    vib_modes_start = index.first('normal_modes', after=vib_freqs_start)
+    vib_modes_end = index.first('ir_spectrum', after=vib_freqs_start)
+    if vib_freqs_start is None or vib_modes_start is None:
+        return None
+    if vib_modes_end is None:
+        # Partial hessian calculation output looks a little different
+        ir_start = None
+        vib_modes_end = index.first('first_vibration', after=vib_freqs_start)
+        vibrations = index.read(vib_modes_start, vib_modes_end)[7:-2]
+    else:
+        ir_start = vib_modes_end
+        vibrations = index.read(vib_modes_start, vib_modes_end)[7:-3]
+
+    freq_lines = index.read(vib_freqs_start, vib_modes_start)[3:-3]
+    freqs = np.array([line.split()[1] for line in freq_lines], dtype=float)
+    ncoords = len(freqs)
+
+    # Each column group is a header followed by a row for every coordinate
+    groups = []
+    for i in range(0, len(vibrations), ncoords + 1):
+        group = ''.join(vibrations[i + 1:i + ncoords + 1]).split()
+        groups.append(np.array(group, dtype=float).reshape(ncoords, -1)[:, 1:])
+    # modes[i, j] is the displacement of coordinate i in mode j
+    modes = np.hstack(groups)
+
+    irs = np.zeros(ncoords)
+    if ir_start is not None:
+        for line in index.lines(ir_start, ncoords + 8):
+            match = ir_re.match(line)
+            if match:
+                irs[int(match.group(1))] = float(match.group(2))
+
+    vibs = np.zeros(ncoords, dtype=[('freq', float), ('ir', float), ('disp', float, (ncoords//3, 3))])
+    vibs['freq'] = freqs
+    vibs['ir'] = irs
+    vibs['disp'] = modes.T.reshape(ncoords, -1, 3)
+
+    return vibs
+
+
 def get_freqs(lines):
     """Returns all the frequencies and geometries in xyz format"""
+    index = as_index(lines, markers)
     # Find the coordinates of the vibrational modes (assumes the last coordinates given)
-    geom = get_geom(lines)
-    num_atoms = len(geom)
-    geom = [str(num_atoms), ''] + ['\t'.join(line.split()) for line in geom]
-
-    """Model of vibrational output for an N atom molecule
-            0    1    ...        5
-    atom1x    #    #    ...        #
-    atom1y    #    #    ...        #
-    atom1z    #    #    ...        #
-    atom2x    #    #    ...        #
-    atom2y    #    #    ...        #
-    atom2z    #    #    ...        #
-    ...
-    atomNz    #    #    ...        #
-            6    7    ...        11
-    atom1x    #    #    ...        #
-    atom1y    #    #    ...        #
-    atom1z    #    #    ...        #
-    atom2x    #    #    ...        #
-    atom2y    #    #    ...        #
-    atom2z    #    #    ...        #
-    ...
-    atomNz    #    #    ...        #
-    ...
-    """
-    vibrations_start = 0
-    vib_modes_start = 0
-    vib_modes_end = 0
-    vib_freqs_start = 0
-    vib_freqs_end = 0
-    hybrid_hessian_vib_modes_end = 0
-    for i in reversed(list(range(len(lines)))):
-        line = lines[i]
-        if 'The first frequency considered to be a vibration is ' == line[0:52]:
-            vibrations_start = int(line[52:].strip())
-            hybrid_hessian_vib_modes_end = i - 2
-
-        if 'IR SPECTRUM\n' == line:
-            vib_modes_end = i - 3
-        elif 'NORMAL MODES\n' == line:
-            vib_modes_start = i + 7
-        elif 'VIBRATIONAL FREQUENCIES\n' == line:
-            vib_freqs_start = i + 3
-            break
-
-    # Partial hessian calculation output looks a little different
-    if vib_modes_end == 0 and hybrid_hessian_vib_modes_end != 0:
-        vib_modes_end = hybrid_hessian_vib_modes_end
-
-    # Plot all vibrations (don't remove non-frequencies)
-    vibrations_start = 0
+    geom = ['\t'.join(line.split()) for line in get_geom(index)]
+    vibs = normal_modes(index)
+    if vibs is None:
+        return ''
 
-    vib_freqs_end = vib_modes_start - 10
-    vib_freqs = []
-    # Read in the vibrational frequencies
-    for i in range(vib_freqs_start, vib_freqs_end):
-        vib_freqs.append(lines[i].split()[1])
-
-    vibrations = lines[vib_modes_start:vib_modes_end]
-    modes = []
-    """modes list to be ordered by mode number
-    [
-        [       #mode0
-            (atom1_x,y,z),(atom2_x,y,z),...
-       ],
-        [       #mode1
-            (atom1_x,y,z),(atom2_x,y,z),...
-       ],
-        ...
-   ]
-    """
-
-    for i in range(0, len(vibrations), 3 * num_atoms + 1):
-        coords = []
-        for j in range(0, 3 * num_atoms, 3):
-            x = vibrations[i + j + 1].split()[1:]
-            y = vibrations[i + j + 2].split()[1:]
-            z = vibrations[i + j + 3].split()[1:]
-            # the xyz coordinates for atom1 across the vibrations (up to 6)
-            xyz = list(zip(x, y, z))
-            coords.append(xyz)
-            # mode0    mode1    ...    mode5
-        # atom1 xyz = [(x,y,z),(x,y,z), ...]
-        # atom2 xyz = [(x,y,z),(x,y,z), ...]
-        # ...
-        num_modes = len(coords[0])
-        for j in range(num_modes):
-            mode = []
-            for k in range(num_atoms):
-                mode.append(coords[k][j])
-            modes.append(mode)
-
-    # Apply vibrations to the last geometry
-    vibrations = []
+    output = ''
     # Don't print the first six modes, as they are not vibrations
-    for i in range(len(modes) - 6):
-        mode = modes[i + 6]
-        # xyz header including the vibrational frequency
-        # offset by 6 to avoid non-vibrational modes
-        vibrations.append([str(num_atoms), '{0} cm^-1'.format(vib_freqs[i + 6])])
-        for j in range(len(modes[i])):
+    for vib in vibs[6:]:
+        output += '{0}\n{1:.2f} cm^-1\n'.format(len(geom), vib['freq'])
+        for atom, disp in zip(geom, vib['disp']):
             # Geometry goes first, then x, y, and z displacements for modes
-            vibrations[i].append(geom[j + 2] + '\t' + '\t'.join(mode[j]))
-
-    output = ''
-    for freq in vibrations[vibrations_start:]:
-        output += '\n'.join(freq) + '\n\n'
+            output += atom + '\t{:.6f}\t{:.6f}\t{:.6f}\n'.format(*disp)
+        output += '\n'
 
     return output
 
 
 def get_ir(lines):
-    vib_freqs_start = 0
-    vib_freqs_end = 0
-    for i in reversed(list(range(len(lines)))):
-        line = lines[i]
-        if 'NORMAL MODES\n' == line:
-            vib_freqs_end = i - 3
-        elif 'VIBRATIONAL FREQUENCIES\n' == line:
-            vib_freqs_start = i + 3
-            break
+    index = as_index(lines, markers)
+    vib_freqs_start = index.last('vib_freqs')
+    vib_freqs_end = index.first('normal_modes', after=vib_freqs_start)
+    if vib_freqs_start is None or vib_freqs_end is None:
+        return []
 
     vib_freqs = []
     # Read in the vibrational frequencies
-    for i in range(vib_freqs_start, vib_freqs_end):
-        vib_freqs.append(lines[i].split()[1])
+    for line in index.read(vib_freqs_start, vib_freqs_end)[3:-3]:
+        vib_freqs.append(line.split()[1])
 
     return vib_freqs
 
@@ -244,36 +252,10 @@ def get_energy(lines, energy_type='sp'):
     """Returns the last calculated energy
     WARNING: It returns as a string in order to prevent python from rounding"""
     energy = 0
-    if energy_type == 'sp':
-        energy_line = 'FINAL SINGLE POINT ENERGY'
-        for line in reversed(lines):
-            if energy_line == line[:25]:
-                energy = line.split()[4]
-                break
-    elif energy_type == 'gibbs':
-        energy_line = 'Final Gibbs free enthalpy'
-        for line in reversed(lines):
-            if energy_line == line[:25]:
-                energy = line.split()[-2]
-                break
-    elif energy_type == 'enthalpy':
-        energy_line = 'Total enthalpy'
-        for line in reversed(lines):
-            if energy_line == line[:14]:
-                energy = line.split()[-2]
-                break
-    elif energy_type == 'entropy':
-        energy_line = 'Total entropy correction'
-        for line in reversed(lines):
-            if energy_line == line[:24]:
-                energy = line.split()[4]
-                break
-    elif energy_type == 'zpve':
-        energy_line = 'Zero point energy'
-        for line in reversed(lines):
-            if energy_line == line[:17]:
-                energy = line.split()[4]
-                break
+    if energy_type in energy_fields:
+        line = _last_line(lines, energy_type)
+        if line is not None:
+            energy = line.split()[energy_fields[energy_type]]
 
     return energy
 
@@ -283,31 +265,11 @@ def get_energies(lines, energy_type='sp'):
     Returns all of the calculated energies
     """
     energies = []
-    if energy_type == 'sp':
-        energy_line = 'FINAL SINGLE POINT ENERGY'
-        for line in lines:
-            if energy_line == line[:25]:
-                energies.append(float(line.split()[4]))
-    elif energy_type == 'gibbs':
-        energy_line = 'Final Gibbs free enthalpy'
-        for line in lines:
-            if energy_line == line[:25]:
-                energies.append(float(line.split()[-2]))
-    elif energy_type == 'enthalpy':
-        energy_line = 'Total enthalpy'
-        for line in lines:
-            if energy_line == line[:14]:
-                energies.append(float(line.split()[-2]))
-    elif energy_type == 'entropy':
-        energy_line = 'Total entropy correction'
-        for line in lines:
-            if energy_line == line[:24]:
-                energies.append(float(line.split()[4]))
-    elif energy_type == 'zpve':
-        energy_line = 'Zero point energy'
-        for line in lines:
-            if energy_line == line[:17]:
-                energies.append(float(line.split()[4]))
+    if energy_type in energy_fields:
+        index = as_index(lines, markers)
+        field = energy_fields[energy_type]
+        for pos in index.positions[energy_type]:
+            energies.append(float(index.line(pos).split()[field]))
 
     return energies
 
@@ -356,30 +318,17 @@ def energy_levels(lines):
     Returns the orbital occupations and energies of the last geometry as well as
     useful information
     """
-    start = 'ORBITAL ENERGIES\n'
-    end = '\n'
-
-    levels_start = 0
-    # Iterate backwards until the start of the last set of coordinates is found
-    for i in reversed(list(range(len(lines)))):
-        if start == lines[i]:
-            levels_start = i + 5
-            break
-    if levels_start == 0:
+    index = as_index(lines, markers)
+    levels_start = index.last('orbital_energies')
+    if levels_start is None:
         print("Could not find start of orbitals")
         return ''
 
-    levels_end = 0
-    for i in range(levels_start, len(lines)):
-        if end == lines[i]:
-            levels_end = i
-            break
-    if levels_end == 0:
+    levels = index.block(levels_start, 5)
+    if levels is None:
         print("Could not find the end of the orbitals")
         return ''
 
-    levels = lines[levels_start: levels_end]
-
     clean = []
     for level in levels:
         num, occ, hartree, eV, *sym = level.split()
@@ -399,25 +348,56 @@ def energy_levels(lines):
     return levels, info
 
 
+def orbital_energies(lines):
+    """
+    Reads the last orbital energies of each spin
+
+    Model of the ORBITAL ENERGIES block (unrestricted outputs have a SPIN UP
+    ORBITALS and a SPIN DOWN ORBITALS table, each with the header line)
+        ORBITAL ENERGIES
+        ----------------
+
+          NO   OCC          E(Eh)            E(eV)
+           0   2.0000     -10.205398      -277.7030
+
+    :return: array of the energies (in hartree) of each spin and the index of
+        the HOMO of each spin, (None, None) if no orbital energies are found
+    """
+    index = as_index(lines, markers)
+    start = index.last('orbital_energies')
+    if start is None:
+        return None, None
+
+    up = index.block(start, 2)
+    if up is None:
+        return None, None
+    if up:
+        # Unrestricted, skip the spin and the header line
+        nmo = len(up) - 2
+        tables = [up[2:], index.lines(start, 2*nmo + 7)[nmo + 7:]]
+    else:
+        tables = [index.block(start, 4) or []]
+
+    energies, homos = [], []
+    for table in tables:
+        rows = np.array(''.join(table).split(), dtype=float).reshape(-1, 4)
+        energies.append(rows[:, 2])
+        homos.append(int(np.nonzero(rows[:, 1])[0][-1]) if rows[:, 1].any() else -1)
+    return np.array(energies), homos
+
+
 def get_molecule(lines):
     """
     !Deprecated!
     Read geometry and convert to a Molecule
     """
-    start = 'CARTESIAN COORDINATES (ANGSTROEM)\n'
-    end = '\n'
-    geom_start = -1
-    for i, line in reversed(list(enumerate(lines))):
-        if start == line:
-            geom_start = i + 2
-            break
-    if geom_start == -1:
+    index = as_index(lines, markers)
+    geom_start = index.last('xyz_angstrom')
+    if geom_start is None:
         return ''
 
     mol = Molecule()
-    for line in lines[geom_start:]:
-        if end == line:
-            break
+    for line in index.block(geom_start, 2) or []:
         atom, x, y, z = line.split()[:4]
         mol.append([atom, [float(x), float(y), float(z)]])
 
@@ -428,9 +408,9 @@ def get_charge(lines):
     """
     Returns the charge of the molecule in the computations
     """
-    for line in reversed(lines):
-        if line[:13] == ' Total Charge':
-            return int(line.split()[-1])
+    line = _last_line(lines, 'charge')
+    if line is not None:
+        return int(line.split()[-1])
     return None
 
 def get_multiplicity(lines):
@@ -438,14 +418,64 @@ def get_multiplicity(lines):
     Returns the multiplicity of the computation. Uses the SCF value.
     If no multiplicity can be found, it returns 0
     """
-    for line in reversed(lines):
-        if line[:13] == ' Multiplicity':
-            return int(line.split()[-1])
+    line = _last_line(lines, 'multiplicity')
+    if line is not None:
+        return int(line.split()[-1])
     return 0
 
 
-def convergence(output_file):
+# Items of the geometry convergence table and their Step parameters
+convergence_items = OrderedDict((
+    ('Energy change', 'delta_e'),
+    ('RMS gradient', 'rms_grad'),
+    ('MAX gradient', 'max_grad'),
+    ('RMS step', 'rms_step'),
+    ('MAX step', 'max_step'),
+))
+
+
+def convergence_step(rows, scf_steps=0, convergence=None):
+    """
+    Make a Step from the rows of a geometry convergence table, each row has the
+    fixed layout: item, value, tolerance, converged
+          RMS gradient        0.47945491            0.00050000      NO
+    The energy change is not printed on the first step and is set to 0.
+    :param rows: lines of the table (other lines are ignored)
+    :param scf_steps: number of SCF cycles of the step
+    :param convergence: Convergence to append the step to, the Step is then a
+        view of its new row instead of having its own
     """
+    table = {}
+    for row in rows:
+        values = row.split()
+        if len(values) == 5 and values[4] in ('YES', 'NO'):
+            item = values[0] + ' ' + values[1]
+            if item in convergence_items:
+                table[convergence_items[item]] = (float(values[2]), float(values[3]))
+
+    params = OrderedDict()
+    criteria = []
+    for key in convergence_items.values():
+        value, tolerance = table.get(key, (0, 0))
+        params[key] = value
+        criteria.append(tolerance)
+    params['scf_steps'] = scf_steps
+
+    if convergence is None:
+        return Step(params, criteria + [0])
+    convergence.criteria = criteria
+    convergence.append(params)
+    return convergence[-1]
+
+
+def iter_convergence(output_file, convergence=None):
+    """
+    Lazily yields a Step for every geometry convergence table of an output.
+    The file is memory mapped and only the tables (and the SCF convergence line
+    before them) are parsed, so files larger than memory can be read.
+    :param convergence: Convergence the steps are appended to (they are views
+        of its rows), a new one by default
+
     Sample geometry convergence output. May not include energy change line
                                 .--------------------.
           ----------------------|Geometry convergence|---------------------
@@ -461,33 +491,170 @@ def convergence(output_file):
           Max(Dihed)        0.00      Max(Improp)    0.00
           -----------------------------------------------------------------
     """
-    convergence_re = r'''(Energy change\s+([-]?\d+.\d+)\s+([-]?\d+.\d+)\s+(YES|NO))?
-          RMS gradient \s+([-]?\d+.\d+)\s+([-]?\d+.\d+)\s+(YES|NO)
-          MAX gradient \s+([-]?\d+.\d+)\s+([-]?\d+.\d+)\s+(YES|NO)
-          RMS step     \s+([-]?\d+.\d+)\s+([-]?\d+.\d+)\s+(YES|NO)
-          MAX step     \s+([-]?\d+.\d+)\s+([-]?\d+.\d+)\s+(YES|NO)
-          ....................................................
-          Max\(Bonds\)\s+([-]?\d+.\d+)\s+Max\(Angles\)\s+([-]?\d+.\d+)
-          Max\(Dihed\)\s+([-]?\d+.\d+)\s+Max\(Improp\)\s+([-]?\d+.\d+)
-          -----------------------------------------------------------------'''
-
-    output = open(output_file).read()
-    matches = re.findall(convergence_re, output)
-    steps = []
-    for match in matches:
-        e_str, e_val,  e_tol, e_conv = match[0:4]
-        if e_val:
-            e_val = float(e_val)
-        else:
-            e_val = 0
-        rg_val, rg_tol, rg_conv = match[4:7]
-        mg_val, mg_tol, mg_conv = match[7:10]
-        rs_val, rs_tol, rs_conv = match[10:13]
-        ms_val, ms_tol, ms_conv = match[13:16]
-        rg_val, mg_val, rs_val, ms_val = float(rg_val), float(mg_val), float(rs_val), float(ms_val)
-        steps.append(Step(e_val, rg_val, mg_val, rs_val, ms_val))
+    if convergence is None:
+        convergence = Convergence()
+    with open(output_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            previous = 0
+            while True:
+                anchor = mm.find(b'Geometry convergence', previous)
+                if anchor == -1:
+                    break
+                end = mm.find(b'....', anchor)
+                if end == -1:
+                    # Table is still being written
+                    break
+
+                scf_steps = 0
+                scf = mm.rfind(b'SCF CONVERGED AFTER', previous, anchor)
+                if scf != -1:
+                    scf_steps = int(mm[scf + 19:mm.find(b'CYCLES', scf)])
+
+                rows = mm[anchor:end].decode('utf-8', 'replace').splitlines()
+                yield convergence_step(rows, scf_steps, convergence)
+                previous = end
+
+
+def convergence(output_file):
+    """
+    Reads all of the geometry convergence steps of an output
+    :return: Convergence
+    """
+    conv = Convergence()
+    for step in iter_convergence(output_file, conv):
+        pass
+
+    return conv
 
-    return Convergence(steps, [])
+
+class Follower:
+    """
+    Follows a running orca output, only reading what has been appended since
+    the last update. Keeps the parser state between updates so that new
+    convergence steps and energies can be processed as they are written.
+    """
+    scf_re = re.compile(r'.*SCF CONVERGED AFTER\s+(\d+) CYCLES')
+    # Lines ORCA writes when it stops on an error
+    error_re = re.compile(r'.*(ORCA finished by error termination|aborting the run)')
+    # Amount read at a time
+    chunk_size = 2**20
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.reset()
+        # When anything was last appended to the output
+        self.last_change = time.time()
+
+    def __repr__(self):
+        return '<Follower {} @ {}>'.format(self.output_file, self.offset)
+
+    def reset(self):
+        """Forget everything read so far"""
+        self.offset = 0
+        self.energies = []
+        self._convergence = Convergence()
+        self.completed = False
+        # The line reporting the error the job stopped on, if any
+        self.error = None
+        self._scf_steps = 0
+        self._table = None
+
+    @property
+    def finished(self):
+        """If the job has either completed or stopped on an error"""
+        return self.completed or self.error is not None
+
+    def idle(self):
+        """Seconds since anything was last appended to the output"""
+        return time.time() - self.last_change
+
+    def update(self):
+        """
+        Read everything appended since the last update
+        :return: generator of ('energy', float) and ('step', Step) tuples
+        """
+        try:
+            size = os.path.getsize(self.output_file)
+        except FileNotFoundError:
+            return
+        # The job was restarted
+        if size < self.offset:
+            self.reset()
+        if size > self.offset:
+            self.last_change = time.time()
+
+        with open(self.output_file, 'rb') as f:
+            f.seek(self.offset)
+            while self.offset < size:
+                data = f.read(min(self.chunk_size, size - self.offset))
+                # Only consume complete lines, the rest is read again
+                end = data.rfind(b'\n') + 1
+                if end == 0:
+                    if len(data) < self.chunk_size:
+                        break
+                    # Extremely long line, consume it anyway
+                    end = len(data)
+                self.offset += end
+                f.seek(self.offset)
+                for line in io.StringIO(data[:end].decode('utf-8', 'replace')):
+                    yield from self._parse_line(line)
+
+    def _parse_line(self, line):
+        if self._table is not None:
+            if line.strip().startswith('....'):
+                step = convergence_step(self._table, self._scf_steps, self._convergence)
+                self._table = None
+                # Only the SCF before the next table counts for its step
+                self._scf_steps = 0
+                yield 'step', step
+            else:
+                self._table.append(line)
+            return
+
+        if line[:25] == 'FINAL SINGLE POINT ENERGY':
+            energy = float(line.split()[4])
+            self.energies.append(energy)
+            yield 'energy', energy
+        elif 'Geometry convergence' in line:
+            self._table = []
+        elif line[:14] == 'TOTAL RUN TIME':
+            self.completed = True
+        elif 'SCF CONVERGED' in line:
+            match = self.scf_re.match(line)
+            if match:
+                self._scf_steps = int(match.group(1))
+        elif self.error_re.match(line):
+            self.error = line.strip()
+
+    @property
+    def steps(self):
+        return self._convergence.steps
+
+    @property
+    def criteria(self):
+        return self._convergence.criteria
+
+    def convergence(self):
+        """Convergence of all the steps read so far (shared, grows with each update)"""
+        return self._convergence
+
+
+def follow(output_file, interval=1, max_wait=None):
+    """
+    Follow an orca output until it completes or stops on an error
+    :param interval: seconds to wait between checking for new output
+    :param max_wait: stop following after this many seconds without new output
+        (e.g. the job was killed), None to wait forever
+    :return: generator of ('energy', float) and ('step', Step) tuples
+    """
+    follower = Follower(output_file)
+    while True:
+        yield from follower.update()
+        if follower.finished or (max_wait is not None and follower.idle() > max_wait):
+            break
+        time.sleep(interval)
 
 
 def update_geom(infile='input.dat', outfile='output.dat'):
@@ -504,10 +671,7 @@ def update_geom(infile='input.dat', outfile='output.dat'):
                 end = i
                 break
 
-    with open(outfile) as f:
-        out_lines = f.readlines()
-
-    geom = get_geom(out_lines, geom_type=geom_type)
+    geom = get_geom(index_file(outfile), geom_type=geom_type)
 
     updated = in_lines[:start] + geom + in_lines[end:]
 
@@ -519,22 +683,22 @@ def completed(lines):
     """
     Check if the output file shows successful completion
     """
-    return lines[-1][:14] == 'TOTAL RUN TIME'
+    index = as_index(lines, {})
+    if index.last_line is None:
+        return False
+    return index.line(index.last_line)[:14] == 'TOTAL RUN TIME'
 
 
 def get_nat_orb_occ(lines):
     """
     Find the natural orbital occupations
     """
+    index = as_index(lines, markers)
     nat_occ = []
-    start = False
-    for line in lines:
-        if start:
-            if line.strip():
-                nat_occ.append(abs(float(line.split('=')[-1].strip())))
-            else:
-                break
-        elif line == 'Natural Orbital Occupation Numbers:\n':
-            start = True
+    start = index.first('nat_orb_occ')
+    if start is None:
+        return nat_occ
+    for line in index.block(start, 1) or []:
+        nat_occ.append(abs(float(line.split('=')[-1].strip())))
 
     return nat_occ
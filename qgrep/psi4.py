@@ -1,4 +1,5 @@
 """Source for all psi4 related functions"""
+from .helper import last_match
 
 
 def get_geom(lines, geom_type='xyz', units='Angstroms'):
@@ -207,9 +208,9 @@ def get_energy(lines, energy_type='sp'):
     WARNING: It returns as a string in order to prevent python from rounding
     """
     if energy_type == 'sp':
-        for line in reversed(lines):
-            if line[:18] == '    Total Energy =':
-                return line.split()[-1]
+        line = last_match(lines, '    Total Energy =')
+        if line is not None:
+            return line.split()[-1]
     else:
         print('Energy type not yet supported')
 
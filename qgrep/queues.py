@@ -1,13 +1,17 @@
-import re
+import sys
+import json
+import time
+import socket
 import getpass
-import subprocess
 import os.path
 
-from collections import OrderedDict, defaultdict
-from xml.etree import ElementTree
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 
+from . import schedulers
 from .helper import colors
-from itertools import zip_longest
+from itertools import islice, zip_longest
 from configparser import ConfigParser
 
 config_file = os.path.join(os.path.expanduser("~"), '.qgrepconfig')
@@ -18,20 +22,65 @@ BAR = colors.purple + '│' + colors.normal
 JOB_ID_LENGTH = 7
 NAME_LENGTH = 22
 SMALL_QUEUE = 3
+# Seconds between polls of the scheduler when watching, the interval grows by
+# the backoff factor while nothing changes
+WATCH_INTERVAL = 1
+WATCH_MAX_INTERVAL = 30
+WATCH_BACKOFF = 1.5
+# Grid engine (sge, pbs or slurm) to use instead of detecting it, detected grid
+# engines are cached for each host so the failing probes are not run every time
+GRID_ENGINE = None
+GRID_ENGINE_CACHE = os.path.join(os.path.expanduser("~"), '.cache', 'qgrep', 'grid_engine.json')
 if 'queues' in config:
     JOB_ID_LENGTH = max(config['queues'].getint('job_id_length', 7), 4)
     NAME_LENGTH = max(config['queues'].getint('name_length', 22), 8)
     SMALL_QUEUE = max(config['queues'].getint('small_queue', 3), 1)
+    WATCH_INTERVAL = max(config['queues'].getfloat('watch_interval', WATCH_INTERVAL), 0.1)
+    WATCH_MAX_INTERVAL = max(config['queues'].getfloat('watch_max_interval', WATCH_MAX_INTERVAL), WATCH_INTERVAL)
+    WATCH_BACKOFF = max(config['queues'].getfloat('watch_backoff', WATCH_BACKOFF), 1)
+    GRID_ENGINE = config['queues'].get('grid_engine', GRID_ENGINE)
 COLUMN_WIDTH = 11 + JOB_ID_LENGTH + NAME_LENGTH
+# Formats built once instead of for every job
+JOB_FORM = '{:>' + str(JOB_ID_LENGTH) + 'd} {:<5s} {:<' + str(NAME_LENGTH) + 's} {}{:2s}' + colors.normal
+# Color queue status by type, use red if unrecognized
+JOB_COLORS = {'r': colors.green, 'qw': colors.blue, 'pd': colors.blue}
+QUEUE_FORM = '{:^' + str(COLUMN_WIDTH - 1) + '}'
+MORE_FORM = BAR + '{:^' + str(COLUMN_WIDTH + 7) + '}'
+BLANK = BAR + ' '*(COLUMN_WIDTH - 1)
+USER = getpass.getuser()
 
 
 class Queues:
-    def __init__(self, omit=None):
+    def __init__(self, omit=None, xml_file=None, sizes=None, scheduler=None):
+        """
+        Read the jobs from the scheduler, or replay them from saved scheduler output
+
+        :param omit: names of queues to leave out
+        :param xml_file: saved output of the scheduler (see schedulers.Recorded) to
+            read instead of querying the scheduler
+        :param sizes: dict of the sizes of each queue when reading an xml_file,
+            otherwise the number of running jobs
+        :param scheduler: schedulers.Scheduler to use instead of detecting it
+        """
         self.omit = omit if omit else []
         self.queues = {}
-        self.grid_engine, self.tree = self.qxml()
-        self.find_sizes(omit=self.omit)
-        self.parse_tree(omit=self.omit)
+        process = None
+        if xml_file is not None:
+            scheduler = schedulers.Recorded(xml_file, sizes)
+        if scheduler is None:
+            scheduler, process = self.detect()
+        self.scheduler = scheduler
+        self.grid_engine = scheduler.name
+        # Seconds taken by each scheduler command
+        self.latency = scheduler.latency
+        self.sizes = {}
+        self.renderer = Renderer()
+        # The sizes are read while the jobs are parsed
+        with ThreadPoolExecutor(1) as executor:
+            sizes = executor.submit(self.find_sizes, omit=self.omit)
+            self.read_jobs(scheduler.jobs(process), omit=self.omit)
+            sizes.result()
+        self.fill_sizes()
 
     def __str__(self):
         """
@@ -53,293 +102,127 @@ class Queues:
     def __ne__(self, other):
         return not self == other
 
-    # noinspection PyPep8
-    def print(self, numjobs=50, person=None):
+    @property
+    def jobs(self):
+        """All the Jobs of every queue, keyed by job id"""
+        jobs = {}
+        for queue in self.queues.values():
+            jobs.update(queue.running)
+            jobs.update(queue.queueing)
+        return jobs
+
+    def refresh(self):
         """
-        Print the queues in a nice table
+        Query the scheduler for the jobs again with a single call, the queue
+        sizes are only re-read if a job is in a queue of unknown size
         """
-        # Form header (without small queues)
-        large_num = sum([size > SMALL_QUEUE for size in self.sizes.values()])
-        # Horizontal line (uses box drawing characters)
-        top_line = '\033[95m' + '┌' + '┬'.join(['─'*(COLUMN_WIDTH - 1)]*large_num) + '┐' + '\033[0m\n'
-        mid_line = '\033[95m' + '├' + '┼'.join(['─'*(COLUMN_WIDTH - 1)]*large_num) + '┤' + '\033[0m\n'
-        bot_line = '\033[95m' + '└' + '┴'.join(['─'*(COLUMN_WIDTH - 1)]*large_num) + '┘' + '\033[0m\n'
-
-        out = top_line
-
-        name_form = '{} ({:2d}/{:2d}/{:2d})'
-        # Print a nice header
-        for name, queue in sorted(self.queues.items()):
-            # Print small queues near the end
-            if queue.size <= SMALL_QUEUE:
-                continue
-            out += BAR + ('{:^' + str(COLUMN_WIDTH-1) + '}').format(name_form.format(name, queue.used, queue.avail, queue.queued))
-        out += BAR + '\n' + mid_line
-        header = BAR + 'ID'.center(JOB_ID_LENGTH) + ' USER  ' + 'Job Name'.center(NAME_LENGTH) + ' ST'
-        out += header*large_num + BAR + '\n' + mid_line
-
-        if person is True:
-            person = getpass.getuser()
-
-        # Remove small queues for later use
-        job_list = []
-        small_queues = []
-        for name, queue in sorted(self.queues.items()):
-            if queue.size <= SMALL_QUEUE:
-                if queue.size > 0:
-                    small_queues.append(queue)
-                continue
-            job_list.append(queue.person_jobs(person).values())
-
-        blank = BAR + ' '*(COLUMN_WIDTH-1)
-        for i, job_row in enumerate(zip_longest(*job_list)):
-            if i >= numjobs:
-                # Add how many more jobs are running in each queue
-                for queue in job_list:
-                    if len(queue) > numjobs:
-                        out += BAR + ('{:^' + str(COLUMN_WIDTH + 7) + '}').format('\033[1m{: >+5} jobs\033[0m'.format(len(queue) - numjobs))
-                    else:
-                        out += blank
-                out += BAR + '\n'
-                break
-            for job in job_row:
-                out += BAR + str(job) if job else blank
-            out += BAR + '\n'
-        out += mid_line if small_queues else bot_line
-
-        # Display small queues below other queues
-        for i, queue in enumerate(small_queues):
-            out += queue.print_inline(len(self.sizes) - large_num, None, person) + '\n'
-            out += mid_line if i < len(small_queues) - 1 else bot_line
-
-        # Remove newline character
-        out = out[:-1]
-
-        return out
+        self.read_jobs(self.scheduler.jobs(), omit=self.omit)
+        self.fill_sizes()
 
     @staticmethod
-    def qxml():
-        """
-        Produce an xml ElementTree object containing all the queued jobs
-
-        Sample output from SGE:
-
-<?xml version='1.0'?>
-<job_info  xmlns:xsd="http://gridengine.sunsource.net/source/browse/*checkout*/gridengine/source/dist/util/resources/schemas/qstat/qstat.xsd?revision=1.11">
-<queue_info>
-    <Queue-List>
-    <name>debug.q@v3.cl.ccqc.uga.edu</name>
-    ...
-    </Queue-List>
-    <Queue-List>
-    <name>gen3.q@v10.cl.ccqc.uga.edu</name>
-    ...
-    <job_list state="running">
-        <JB_job_number>113254</JB_job_number>
-        <JB_name>optg</JB_name>
-        <JB_owner>mullinax</JB_owner>
-        <state>r</state>
-        <JAT_start_time>2015-05-11T15:52:49</JAT_start_time>
-        <hard_req_queue>large.q<hard_req_queue>
-        ...
-    </job_list>
-    </Queue-List>
-    ...
-</queue_info>
-<job_info>
-    <job_list state="pending">
-    <JB_job_number>112742</JB_job_number>
-    <JB_name>CH3ONO2</JB_name>
-    <JB_owner>meghaanand</JB_owner>
-    <state>qw</state>
-    <JB_submission_time>2015-05-08T16:30:25</JB_submission_time>
-    <hard_req_queue>large.q<hard_req_queue>
-    ...
-    </job_list>
-</job_info>
-...
-</job_info>
-
-    Sample output from PBS:
-<Data>
-    <Job>
-        <Job_Id>77816.icqc</Job_Id>
-        <Job_Name>e7_cas2_ddci3_tighter</Job_Name>
-        <Job_Owner>sivalingam@icmaster1</Job_Owner>
-        <resources_used>
-            <cput>21002:04:52</cput>
-            <energy_used>0</energy_used>
-            <mem>60978424kb</mem>
-            <vmem>73997480kb</vmem>
-            <walltime>2630:02:36</walltime>
-        </resources_used>
-        <job_state>R</job_state>
-        <queue>batch</queue>
-        <server>control</server>
-        <Checkpoint>u</Checkpoint>
-        <ctime>1488149683</ctime>
-        <Error_Path>zeusln1:/home/sivalingam/s4/e7_cas2_ddci3_tighter.err</Error_Path>
-        <exec_host>izeusbn13/8-11+izeusbn12/11-12+izeusbn11/12-13</exec_host>
-        <Hold_Types>n</Hold_Types>
-        <Join_Path>oe</Join_Path>
-        <Keep_Files>n</Keep_Files>
-        <Mail_Points>a</Mail_Points>
-        <mtime>1488149684</mtime>
-        <Output_Path>zeus1:/home/sivalingam/s4/e7_cas2_ddci3_tighter.o77816</Output_Path>
-        <Priority>0</Priority>
-        <qtime>1488149683</qtime>
-        <Rerunable>False</Rerunable>
-        <Resource_List>
-            <nodect>8</nodect>
-            <nodes>8</nodes>
-            <walltime>8760:00:00</walltime>
-        </Resource_List>
-        <session_id>3716</session_id>
-        <Shell_Path_List>/bin/zsh</Shell_Path_List>
-        <euser>sivalingam</euser>
-        <egroup>gl-ag orca</egroup>
-        <queue_type>E</queue_type>
-        <etime>1488149683</etime>
-        <submit_args>-j oe -e /home/sivalingam/s4/e7_cas2_ddci3_tighter.err -N e7_cas2_ddci3_tighter -r n e7_cas2_ddci3_tighter.job</submit_args>
-        <start_time>1488149684</start_time>
-        <Walltime>
-            <Remaining>22067782</Remaining>
-        </Walltime>
-        <start_count>1</start_count>
-        <fault_tolerant>False</fault_tolerant>
-        <job_radix>0</job_radix>
-        <submit_host>zeus1</submit_host>
-    </Job>
-    ...
-</Data>
-        """
-        cmds = [('sge', 'qstat -u "*" -r -f -xml'), ('pbs', 'qstat -x -t')]
-        for grid_engine, cmd in cmds:
+    def detect():
+        """
+        Start listing the jobs with the configured or cached grid engine,
+        detecting it (and caching it) if there is none or it no longer works
+        :return: schedulers.Scheduler, Popen with the jobs on its stdout
+        """
+        if GRID_ENGINE:
+            scheduler = schedulers.schedulers[GRID_ENGINE]()
+            return scheduler, scheduler.start()
+        cached = cached_grid_engine()
+        if cached in schedulers.schedulers:
             try:
-                xml = subprocess.check_output(cmd, shell=True, stderr=subprocess.DEVNULL)
-                return grid_engine, ElementTree.fromstring(xml)
-            except FileNotFoundError as e:
-                raise Exception("Could not find qstat")
-            except subprocess.CalledProcessError as e:
+                scheduler = schedulers.schedulers[cached]()
+                return scheduler, scheduler.start()
+            except Exception:
                 pass
+        scheduler, process = schedulers.detect()
+        cache_grid_engine(scheduler.name)
+        return scheduler, process
 
-        raise Exception('Could not generate XML, only PBS and SGE currently supported.')
+    def fill_sizes(self):
+        """
+        Set the size of queues that were not in the known sizes, querying the
+        scheduler again or, if it cannot be, using the number of running jobs.
+        Queues of known size without any jobs are added empty.
+        """
+        for name, size in self.sizes.items():
+            if name not in self.queues and name not in self.omit:
+                self.queues[name] = Queue(size, name)
+        missing = [queue for queue in self.queues.values() if queue.size is None]
+        if self.scheduler.live and any(queue.name not in self.sizes for queue in missing):
+            self.find_sizes(omit=self.omit)
+        for queue in missing:
+            if queue.name not in self.sizes:
+                self.sizes[queue.name] = queue.used
+            queue.size = self.sizes[queue.name]
 
-    def parse_tree(self, omit=None):
+    def print(self, numjobs=50, person=None):
         """
-        Parse the xml tree from qxml
+        Print the queues in a nice table, jobs that have not changed since the
+        last print are not formatted again
         """
-        omit = omit if omit else []
+        return '\n'.join(self.renderer.lines(self, numjobs, person))
 
-        if self.grid_engine == 'sge':
-            self.queues = OrderedDict()
-            for child in self.tree:
-                # Running jobs are arranged by node/queue
-                if child.tag == 'queue_info':
-                    for node in child:
-                        #<Queue-List>
-                        #   <name>gen3.q@v10.cl.ccqc.uga.edu</name>
-                        name = node.find('name').text.split('@')[0]
-                        # If we don't want to display the queue
-                        if name in omit:
-                            continue
-                        if name not in self.queues:
-                            self.queues[name] = Queue(self.sizes[name], name)
-
-                        for job_xml in node.iterfind('job_list'):
-                            job = Job(job_xml, self.grid_engine)
-                            self.queues[name].running[job.id] = job
-
-                # Queued jobs
-                elif child.tag == 'job_info':
-                    for job_xml in child:
-                        job = Job(job_xml, self.grid_engine)
-                        name = job.queue.split('@')[0]
-                        if name in omit:
-                            continue
-
-                        if name not in self.queues:
-                            self.queues[name] = Queue(self.sizes[name], name)
-
-                        self.queues[name].queueing[job.id] = job
-        elif self.grid_engine == 'pbs':
-            self.queues = OrderedDict()
-            for job_xml in self.tree:
-                job = Job(job_xml, self.grid_engine)
-                queue = job.queue
-
-                if job.state == 'c' or queue in omit:
-                    continue
-
-                if queue not in self.queues:
-                    self.queues[queue] = Queue(self.sizes[queue], queue)
-                if job.state == 'r':
-                    self.queues[queue].running[job.id] = job
-                else:
-                    try:
-                        self.queues[queue].queueing[job.id] = job
-                    except:
-                        print(job)
-                        raise
-        else:
-            raise Exception('Could not read XML, only PBS and SGE currently supported.')
+    def read_jobs(self, jobs, omit=None):
+        """
+        Sort the jobs into their queues as they are read
 
+        :param jobs: iterable of (queue name, position, fields) from a schedulers.Scheduler
+        """
+        self.queues = OrderedDict()
+        for name, position, fields in jobs:
+            self.add(name, Job(*fields), position, omit)
+
+    def add(self, name, job, position, omit=None):
+        """
+        Add a job to a queue, making the queue if necessary
+
+        :param position: either running or queueing
+        """
+        if omit and name in omit:
+            return
+        if name not in self.queues:
+            self.queues[name] = Queue(self.sizes.get(name), name)
+        self.queues[name].set(job.id, job, position)
 
     def find_sizes(self, omit=None):
         """
         Find the sizes of the queues
-
         """
         omit = omit if omit else []
-        self.sizes = {}
-        if self.grid_engine == 'sge':
-            """Sample output from 'qstat -g c':
-            CLUSTER QUEUE                   CQLOAD   USED    RES  AVAIL  TOTAL aoACDS  cdsuE
-            --------------------------------------------------------------------------------
-            all.q                             -NA-      0      0      0      0      0      0
-            gen3.q                            0.00      0      0      0     16      0     16
-            gen4.q                            0.26     31      0     13     48      0      4
-            gen5.q                            0.50      4      0      0      4      0      0
-            gen6.q                            0.39     19      0      0     19      0      1
-            """
-            qstat_queues_cmd = "qstat -g c"
-            out = subprocess.check_output(qstat_queues_cmd, shell=True)
-            for line in out.splitlines()[2:]:
-                line = line.decode('UTF-8')
-                if 'all.q' == line[:5]:
-                    continue
-                queue, cqload, used, res, avail, total, aoacds, cdsue = line.split()
-                if queue not in omit:
-                    self.sizes[queue] = int(used) + int(avail)
-        elif self.grid_engine == 'pbs':
-            """sample output from pbsnodes:
-izeussn153
-    state = job-exclusive
-    power_state = Running
-    np = 16
-    properties = small
-    ntype = cluster
-    jobs = 0-15/86886.icqc
-    status = rectime=1498123346,macaddr=40:f2:e9:c6:22:60,cpuclock=Fixed,varattr=,jobs=86886.icqc(cput=65375153,energy_used=0,mem=118685472kb,vmem=133127908kb,walltime=4154720,session_id=3357),state=free,netload=75804699166624,gres=,loadave=16.00,ncpus=16,physmem=131338172kb,availmem=176492292kb,totmem=265555896kb,idletime=10974874,nusers=1,nsessions=1,sessions=3357,uname=Linux zeussn153 3.10.0-229.el7.x86_64 #1 SMP Fri Mar 6 11:36:42 UTC 2015 x86_64,opsys=linux
-    mom_service_port = 15002
-    mom_manager_port = 15003
-"""
-            out = subprocess.check_output('pbsnodes', shell=True).decode('utf-8').strip()
-            for job in out.split('\n\n'):
-                try:
-                    queue = re.search('properties = (.*)', job).group(1)
-                except AttributeError as e:
-                    queue = 'batch'
-                if queue == 'big':
-                    queue = 'batch'
-
-                if queue not in omit:
-                    if queue in self.sizes:
-                        self.sizes[queue] += 1
-                    else:
-                        self.sizes[queue] = 1
-        else:
-            raise Exception('Could not read queue sizes, only PBS and SGE currently supported.')
+        # Replaced at once as the jobs may be being read at the same time
+        self.sizes = {queue: size for queue, size in self.scheduler.sizes().items() if queue not in omit}
+
+
+def cached_grid_engine():
+    """The grid engine previously detected on this host, None if unknown"""
+    try:
+        with open(GRID_ENGINE_CACHE) as f:
+            return json.load(f).get(socket.gethostname())
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def cache_grid_engine(grid_engine):
+    """Remember the grid engine of this host"""
+    try:
+        with open(GRID_ENGINE_CACHE) as f:
+            engines = json.load(f)
+        if not isinstance(engines, dict):
+            engines = {}
+    except (OSError, ValueError):
+        engines = {}
+    engines[socket.gethostname()] = grid_engine
+    try:
+        os.makedirs(os.path.dirname(GRID_ENGINE_CACHE), exist_ok=True)
+        tmp_file = '{}.{}'.format(GRID_ENGINE_CACHE, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(engines, f)
+        os.replace(tmp_file, GRID_ENGINE_CACHE)
+    except OSError:
+        # Only an optimization
+        pass
 
 
 class Queue:
@@ -363,6 +246,10 @@ class Queue:
             self.queueing = OrderedDict()
         else:
             self.queueing = queueing
+        # Sorted job ids, kept until the jobs change
+        self._version = 0
+        self._ids = []
+        self._ids_key = None
 
     def __eq__(self, other):
         if len(self) != len(other):
@@ -392,7 +279,7 @@ class Queue:
         else:
             jobs = self.jobs
 
-        out = '\n'.join(list(map(str, jobs.values()))[:numlines])
+        out = '\n'.join(map(str, islice(jobs.values(), numlines)))
         if numlines < len(self):
             out += '\n+{} jobs'.format(len(self) - numlines)
 
@@ -406,7 +293,7 @@ class Queue:
             jobs = self.jobs
 
         used_avail_queued = '{} ({:2d}/{:2d}/{:2d})'.format(self.name, self.used, self.avail, self.queued)
-        out = BAR + ('{:^' + str(COLUMN_WIDTH-1) + '}').format(used_avail_queued) + BAR
+        out = BAR + QUEUE_FORM.format(used_avail_queued) + BAR
         for i, job in enumerate(jobs.values()):
             if not (max_num is None) and i >= max_num:
                 break
@@ -423,6 +310,7 @@ class Queue:
         """
         Set a job in the specified position (running or queueing)
         """
+        self._version += 1
         if position == 'running':
             self.running[job_id] = job
         elif position == 'queueing':
@@ -433,7 +321,8 @@ class Queue:
 
     @property
     def used(self):
-        return len(self.running)
+        """Slots used by the running jobs, in the same units as the size"""
+        return sum(job.slots for job in self.running.values())
 
     @property
     def avail(self):
@@ -443,46 +332,112 @@ class Queue:
     def queued(self):
         return len(self.queueing)
 
+    @property
+    def queued_tasks(self):
+        """Number of queued tasks, counting every task of pending array jobs"""
+        return sum(job.tasks for job in self.queueing.values())
+
     @property
     def jobs(self):
         """
-        Makes an OrderedDict of all the running and queueing Jobs
+        A JobsView of all the running and then queueing Jobs
         """
-        ret = OrderedDict()
-        # OrderedDicts cannot be readily combined
-        for k, v in sorted(self.running.items()):
-            ret[k] = v
-        for k, v in sorted(self.queueing.items()):
-            ret[k] = v
-        return ret
+        return JobsView(self)
 
     def person_jobs(self, person):
-        """Return an OrderedDict of Jobs with the specified owner"""
+        """Return a JobsView of the Jobs with the specified owner"""
         if not person:
             return self.jobs
+        return JobsView(self, person)
 
-        ret = OrderedDict()
-        for job in self.jobs.values():
-            if job.owner == person:
-                ret[job.id] = job
-        return ret
+    def job_ids(self):
+        """
+        Ids of the running and then queueing jobs, each sorted. Only sorted
+        again when jobs have been set (or the number of jobs changed).
+        """
+        key = (self._version, len(self.running), len(self.queueing))
+        if self._ids_key != key:
+            self._ids = sorted(self.running, key=job_order) + sorted(self.queueing, key=job_order)
+            self._ids_key = key
+        return self._ids
+
+
+class JobsView(Mapping):
+    """
+    A read-only mapping of the running and then queueing Jobs of a Queue keyed
+    by id, optionally only those of one owner. Nothing is copied, so it stays
+    up to date with the Queue.
+    """
+    __slots__ = ('queue', 'owner')
+
+    def __init__(self, queue, owner=None):
+        self.queue = queue
+        self.owner = owner
+
+    def __repr__(self):
+        return '<JobsView {} {}>'.format(self.queue.name, self.owner if self.owner else 'all')
+
+    def __getitem__(self, job_id):
+        if job_id in self.queue.running:
+            job = self.queue.running[job_id]
+        else:
+            job = self.queue.queueing[job_id]
+        if self.owner and job.owner != self.owner:
+            raise KeyError(job_id)
+        return job
+
+    def __iter__(self):
+        if not self.owner:
+            return iter(self.queue.job_ids())
+        running, queueing = self.queue.running, self.queue.queueing
+        return (job_id for job_id in self.queue.job_ids()
+                if (running[job_id] if job_id in running else queueing[job_id]).owner == self.owner)
+
+    def __len__(self):
+        if not self.owner:
+            return len(self.queue)
+        return sum(1 for _ in self)
+
+
+def job_order(job_id):
+    """Sort key of job ids, the tasks of an array job (see schedulers.array_id) follow its number"""
+    return job_id if type(job_id) is tuple else (job_id, 0)
+
+
+def intern(string):
+    """Intern strings shared by many jobs so only one copy is stored"""
+    return sys.intern(string) if type(string) is str else string
 
 
 class Job:
     """
     A simple class that contains important information about a job and prints it
-    nicely
+    nicely, slotted as there may be tens of thousands of them
     """
-    def __init__(self, job_xml, grid_engine):
-        self.id, self.name, self.state, self.owner, self.queue, self.workdir = Job.read_job_xml(job_xml, grid_engine)
-        #self.id, self.name, self.state, self.owner, self.queue, self.workdir, (self.nodect, self.nodes) = Job.read_job_xml(job_xml, grid_engine)
+    __slots__ = ('id', 'name', 'state', 'owner', 'queue', 'workdir', 'tasks', 'slots')
+
+    def __init__(self, jid, name, state, owner, queue, workdir=None, tasks=1, slots=1):
+        """
+        :param tasks: number of tasks, more than one for array jobs whose tasks have not started
+        :param slots: number of the queue's slots used (e.g. CPUs), in the units of the queue's size
+        """
+        self.id = jid
+        self.name = name
+        self.state = intern(state)
+        self.owner = intern(owner)
+        self.queue = intern(queue)
+        self.workdir = workdir
+        self.tasks = tasks
+        self.slots = slots
 
     def __eq__(self, other):
         if self.id == other.id and \
             self.name == other.name and \
             self.state == other.state and \
             self.owner == other.owner and \
-            self.queue == other.queue:
+            self.queue == other.queue and \
+            self.tasks == other.tasks and \
+            self.slots == other.slots:
             return True
         return False
 
@@ -491,79 +446,211 @@ class Job:
 
     def __str__(self):
         """Print a short description of the job, with color"""
-        job_form = '{:>' + str(JOB_ID_LENGTH) + 'd} {:<5s} {:<' + str(NAME_LENGTH) + 's} {}{:2s}' + colors.normal
-
-        # Color queue status by type, use red if unrecognized
-        job_colors = defaultdict(lambda: colors.red, {'r': colors.green, 'qw': colors.blue})
-
         # Bold the person's jobs
-        if self.owner == getpass.getuser():
+        if self.owner == USER:
             owner = colors.bold + '{:5.5s}'.format(self.owner) + colors.normal
         else:
             owner = '{:5.5s}'.format(self.owner)
 
-        return job_form.format(int(self.id), owner, self.name[:NAME_LENGTH],
-                            job_colors[self.state], self.state[:2])# + str(self.nodes) + ', ' + str(self.nodect)
+        # Only the job number of the tasks of array jobs fits
+        number = self.id[0] if type(self.id) is tuple else self.id
+        return JOB_FORM.format(number, owner, self.name[:NAME_LENGTH],
+                               JOB_COLORS.get(self.state, colors.red), self.state[:2])
 
-    @staticmethod
-    def read_job_xml(job_xml, grid_engine):
-        """
-        Read the xml of qstat and find the necessary variables
-        """
-        if grid_engine == 'sge':
-            jid = int(job_xml.find('JB_job_number').text)
-            tasks = job_xml.find('tasks')
-            # If there are multiple tasks with the same id, make the id a float
-            # with the task number being the decimal
-            if tasks is not None:
-                # If it is a range of jobs, e.g. 17-78:1, just take the first
-                task = tasks.text.split('-')[0]  # If not a range, this does nothing
-                # SGE is being cute and comma separates two numbers if sequential
-                task = task.split(',')[0]
-                jid += int(task) / 10 ** len(task)
-            name = job_xml.find('JB_name').text
-            state = job_xml.get('state').lower()
-            owner = job_xml.find('JB_owner').text
-            state2 = job_xml.find('state').text
-            try:
-                queue = job_xml.find('hard_req_queue').text
-            except AttributeError as e:
-                queue = 'debug.q'
-            if (state == 'running' and state2 != 'r') or \
-            (state == 'pending' and state2 != 'qw'):
-                pass
-            return jid, name, state2, owner, queue
 
-        elif grid_engine == 'pbs':
-            jid = job_xml.find('Job_Id').text.split('.')[0]
-            try:
-                jid = int(jid)
-            except ValueError as e:
-                # Must be part of a job_array
-                jid, task_id = jid[:-1].split('[')
-                if task_id:
-                    jid = float(jid + '.' + task_id)
-                else:
-                    # -t must not be supported
-                    jid = int(jid)
-
-            name = job_xml.find('Job_Name').text
-            state = job_xml.find('job_state').text.lower()
-            owner = job_xml.find('Job_Owner').text.split('@')[0]
-            queue = job_xml.find('queue').text
-
-            resource_list = job_xml.find('Resource_List')
-            nodect, nodes = resource_list.find('nodect').text, resource_list.find('nodes').text
-
-            workdir = None
-            try:
-                variables = job_xml.find('Variable_List').text.split(',')
-                variables = dict(kv.split('=') for kv in variables)
-                workdir = variables['PBS_O_WORKDIR']
-            except AttributeError:
-                pass
+class Renderer:
+    """
+    Renders Queues as a table of lines, keeping the formatted cell of each job
+    until the job changes and the horizontal lines and header until the number
+    of columns changes, so redrawing a table after a poll only formats the jobs
+    that changed
+    """
+    def __init__(self):
+        # (name, state, owner, cell) keyed by job id, only the jobs last rendered
+        self.cells = {}
+        # (top, middle and bottom lines, header) keyed by the number of columns
+        self.frames = {}
+
+    def __repr__(self):
+        return '<Renderer {} cells>'.format(len(self.cells))
+
+    def frame(self, columns):
+        """The horizontal lines (uses box drawing characters) and header of a table"""
+        if columns not in self.frames:
+            lines = tuple(colors.purple + left + middle.join(['─'*(COLUMN_WIDTH - 1)]*columns) + right + colors.normal
+                          for left, middle, right in ['┌┬┐', '├┼┤', '└┴┘'])
+            header = BAR + 'ID'.center(JOB_ID_LENGTH) + ' USER  ' + 'Job Name'.center(NAME_LENGTH) + ' ST'
+            self.frames[columns] = lines + (header*columns + BAR,)
+        return self.frames[columns]
+
+    def cell(self, job, cells):
+        """
+        The formatted job, reused from the last render if it has not changed
+        :param cells: the cells of this render, the job's cell is added
+        """
+        cached = self.cells.get(job.id)
+        if cached is None or cached[0] != job.name or cached[1] != job.state or cached[2] != job.owner:
+            cached = (job.name, job.state, job.owner, str(job))
+        cells[job.id] = cached
+        return cached[3]
+
+    def lines(self, queues, numjobs=50, person=None):
+        """
+        Lines of the table of the queues (see Queues.print)
+        :param queues: Queues to render
+        :param numjobs: most jobs shown in each queue
+        :param person: only show the jobs of this person, True for the current user
+        """
+        if person is True:
+            person = getpass.getuser()
+        cells = {}
+
+        # Form header (without small queues)
+        large_queues = []
+        small_queues = []
+        for name, queue in sorted(queues.queues.items()):
+            # Print small queues near the end
+            if queue.size <= SMALL_QUEUE:
+                if queue.size > 0:
+                    small_queues.append(queue)
+            else:
+                large_queues.append(queue)
+        large_num = len(large_queues)
+        top_line, mid_line, bot_line, header = self.frame(large_num)
 
-            return jid, name, state, owner, queue, workdir
-            #return jid, name, state, owner, queue, workdir, (nodect, nodes)
+        name_form = '{} ({:2d}/{:2d}/{:2d})'
+        out = [top_line,
+               ''.join(BAR + QUEUE_FORM.format(name_form.format(queue.name, queue.used, queue.avail, queue.queued))
+                       for queue in large_queues) + BAR,
+               mid_line, header, mid_line]
+
+        job_list = [queue.person_jobs(person).values() for queue in large_queues]
+        for i, job_row in enumerate(zip_longest(*job_list)):
+            if i >= numjobs:
+                # Add how many more jobs are running in each queue
+                out.append(''.join(MORE_FORM.format('\033[1m{: >+5} jobs\033[0m'.format(len(jobs) - numjobs))
+                                   if len(jobs) > numjobs else BLANK for jobs in job_list) + BAR)
+                break
+            out.append(''.join(BAR + self.cell(job, cells) if job else BLANK for job in job_row) + BAR)
+        out.append(mid_line if small_queues else bot_line)
+
+        # Display small queues below other queues
+        width = len(queues.sizes) - large_num
+        for i, queue in enumerate(small_queues):
+            out += self.inline(queue, width, person, cells).split('\n')
+            out.append(mid_line if i < len(small_queues) - 1 else bot_line)
+
+        self.cells = cells
+        return out
+
+    def inline(self, queue, width, person, cells):
+        """Jobs of a small queue inline (see Queue.print_inline)"""
+        jobs = queue.person_jobs(person)
+        used_avail_queued = '{} ({:2d}/{:2d}/{:2d})'.format(queue.name, queue.used, queue.avail, queue.queued)
+        out = BAR + QUEUE_FORM.format(used_avail_queued) + BAR
+        for i, job in enumerate(jobs.values()):
+            if not (i + 1) % width:
+                out += '\n' + BAR
+            out += self.cell(job, cells) + BAR
+
+        # Add blank spots to fill out to end
+        if (len(jobs) + 1) % width:
+            out += (' '*COLUMN_WIDTH*(width - (len(jobs) + 1) % width))[:-1] + BAR
+        return out
+
+
+class JobDiff(namedtuple('JobDiff', 'added removed changed')):
+    """Ids of the jobs that were added, removed and changed between two polls"""
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+def diff_jobs(old, new):
+    """
+    Compare two sets of jobs
+    :param old: dict of Jobs keyed by id
+    :param new: dict of Jobs keyed by id
+    :return: JobDiff
+    """
+    added = [jid for jid in new if jid not in old]
+    removed = [jid for jid in old if jid not in new]
+    changed = [jid for jid, job in new.items() if jid in old and old[jid] != job]
+    return JobDiff(added, removed, changed)
+
+
+def redraw(old, new):
+    """
+    Terminal escape sequences that turn previously printed lines into new ones,
+    only rewriting the lines that changed. The cursor must be on the line after
+    the old lines and is left on the line after the new ones.
+    :param old: list of lines currently displayed
+    :param new: list of lines to display
+    """
+    # Move to the start of the first old line
+    out = '\033[{}F'.format(len(old)) if old else ''
+    # Unchanged lines are skipped together
+    skip = 0
+    for i, line in enumerate(new):
+        if i < len(old) and old[i] == line:
+            skip += 1
+            continue
+        if skip:
+            out += '\033[{}E'.format(skip)
+            skip = 0
+        out += '\033[2K' + line + '\n'
+    if skip:
+        out += '\033[{}E'.format(skip)
+    # Clear anything left over from a longer table
+    return out + '\033[J'
+
+
+class Watcher:
+    """
+    Polls the scheduler for changes to the jobs, polling less often while
+    nothing changes and going back to the fastest rate as soon as something does
+    """
+    def __init__(self, queues=None, interval=WATCH_INTERVAL, max_interval=WATCH_MAX_INTERVAL,
+                 backoff=WATCH_BACKOFF):
+        """
+        :param queues: Queues to update, otherwise they are read
+        :param interval: minimum seconds between polls
+        :param max_interval: maximum seconds between polls
+        :param backoff: factor to grow the interval by after each unchanged poll
+        """
+        self.queues = queues if queues is not None else Queues()
+        self.min_interval = interval
+        self.max_interval = max(max_interval, interval)
+        self.backoff = backoff
+        self.interval = interval
+        self.jobs = self.queues.jobs
+
+    def __repr__(self):
+        return '<Watcher every {:.1f}s>'.format(self.interval)
+
+    def poll(self):
+        """
+        Update the queues and find what changed, adjusting the polling interval
+        :return: JobDiff
+        """
+        self.queues.refresh()
+        jobs = self.queues.jobs
+        diff = diff_jobs(self.jobs, jobs)
+        self.jobs = jobs
+        if diff:
+            self.interval = self.min_interval
         else:
-            raise Exception('Could not read XML, only PBS and SGE currently supported.')
+            self.interval = min(self.interval*self.backoff, self.max_interval)
+        return diff
+
+    def watch(self, duration=None):
+        """
+        Poll until the duration has passed
+        :param duration: seconds to watch for, None watches forever
+        :return: generator of the JobDiff of every poll where something changed
+        """
+        end = None if duration is None else time.time() + duration
+        while end is None or time.time() < end:
+            time.sleep(self.interval)
+            diff = self.poll()
+            if diff:
+                yield diff
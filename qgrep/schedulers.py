@@ -0,0 +1,571 @@
+"""Backends that read the jobs and queue sizes of the job schedulers for qgrep.queues"""
+import re
+import json
+import time
+import subprocess
+
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+
+class Scheduler:
+    """
+    A job scheduler, lists the jobs and the sizes of the queues
+
+    Jobs are read as tuples of (queue name, position, fields), where position is
+    either running or queueing and fields are (id, name, state, owner, queue,
+    workdir, tasks, slots), tasks being the number of tasks of a pending array
+    job and slots the number of the queue's slots the job uses, in the same
+    units as the sizes of the queues
+    """
+    name = None
+    # Command that writes the list of jobs and the command that writes the queue sizes
+    jobs_cmd = None
+    sizes_cmd = None
+    # Whether the scheduler can be queried again (otherwise sizes can only be guessed)
+    live = True
+
+    def __init__(self):
+        # Seconds taken by each command
+        self.latency = OrderedDict()
+
+    def __repr__(self):
+        return '<{} scheduler>'.format(self.name)
+
+    def popen(self):
+        """Start the command listing the jobs"""
+        try:
+            return subprocess.Popen(self.jobs_cmd, shell=True, stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL)
+        except FileNotFoundError as e:
+            raise Exception('Could not run {}'.format(self.jobs_cmd))
+
+    def start(self):
+        """
+        Start the command listing the jobs
+        :return: Popen with the jobs on its stdout, raises if the command fails without output
+        """
+        process = self.popen()
+        if not process.stdout.peek(1) and process.wait():
+            process.stdout.close()
+            raise Exception('{} failed, is {} installed?'.format(self.jobs_cmd, self.name))
+        return process
+
+    def jobs(self, process=None):
+        """
+        Read the jobs as they are written
+        :param process: already started Popen of the jobs command
+        :return: generator of (queue name, position, fields)
+        """
+        start = time.perf_counter()
+        if process is None:
+            process = self.start()
+        with process:
+            # No output is no jobs
+            if process.stdout.peek(1):
+                yield from self.parse_jobs(process.stdout)
+        self.latency[self.jobs_cmd] = time.perf_counter() - start
+
+    def sizes(self):
+        """Read the sizes of the queues, a dict keyed by the queue name"""
+        start = time.perf_counter()
+        out = subprocess.check_output(self.sizes_cmd, shell=True).decode('utf-8', 'replace')
+        sizes = self.parse_sizes(out)
+        self.latency[self.sizes_cmd] = time.perf_counter() - start
+        return sizes
+
+    def record(self, jobs_file, sizes_file=None):
+        """
+        Save the output of the scheduler commands to replay them later with Recorded
+        :param jobs_file: file to write the jobs to
+        :param sizes_file: file to write the queue sizes to
+        """
+        with open(jobs_file, 'wb') as f:
+            f.write(subprocess.check_output(self.jobs_cmd, shell=True))
+        if sizes_file:
+            with open(sizes_file, 'wb') as f:
+                f.write(subprocess.check_output(self.sizes_cmd, shell=True))
+
+    def default_queue(self):
+        """The queue jobs are submitted to if none is given, None if unknown"""
+        return None
+
+    @staticmethod
+    def parse_jobs(source):
+        raise NotImplementedError
+
+    @staticmethod
+    def parse_sizes(out):
+        raise NotImplementedError
+
+
+def array_id(jid, task):
+    """The id of a task of an array job, (job number, task number) so no two tasks share an id"""
+    return int(jid), int(task)
+
+
+def count_tasks(text):
+    """
+    Number of tasks in a range of array tasks, e.g. 1-100, 17-78:2 or 1,3 (SGE)
+    and 1-100%5 (Slurm, at most 5 running at once)
+    """
+    count = 0
+    for part in text.split('%')[0].split(','):
+        first, _, last = part.partition('-')
+        last, _, step = last.partition(':')
+        count += len(range(int(first), int(last) + 1, int(step) if step else 1)) if last else 1
+    return count
+
+
+def id_text(jid):
+    """The id of a job as text, job.task for the tasks of array jobs"""
+    return '{}.{}'.format(*jid) if type(jid) is tuple else str(jid)
+
+
+def iter_xml(source, tags):
+    """
+    Incrementally parse xml, yielding each element with one of the tags (and
+    its parent) once it has been read. The elements are freed afterwards so the
+    whole tree is never held in memory.
+    :param source: file object or name of the xml
+    :param tags: set of tags to yield
+    :return: generator of (element, parent)
+    """
+    # Elements that are open, the last is the parent of the current element
+    stack = []
+    for event, elem in ElementTree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            continue
+        stack.pop()
+        if elem.tag in tags:
+            parent = stack[-1] if stack else None
+            yield elem, parent
+            elem.clear()
+            if parent is not None:
+                parent.remove(elem)
+
+
+class SGE(Scheduler):
+    """
+    Sun/Son of Grid Engine
+
+    Sample output from 'qstat -u "*" -r -f -xml':
+
+<?xml version='1.0'?>
+<job_info  xmlns:xsd="http://gridengine.sunsource.net/source/browse/*checkout*/gridengine/source/dist/util/resources/schemas/qstat/qstat.xsd?revision=1.11">
+<queue_info>
+    <Queue-List>
+    <name>debug.q@v3.cl.ccqc.uga.edu</name>
+    ...
+    </Queue-List>
+    <Queue-List>
+    <name>gen3.q@v10.cl.ccqc.uga.edu</name>
+    ...
+    <job_list state="running">
+        <JB_job_number>113254</JB_job_number>
+        <JB_name>optg</JB_name>
+        <JB_owner>mullinax</JB_owner>
+        <state>r</state>
+        <JAT_start_time>2015-05-11T15:52:49</JAT_start_time>
+        <hard_req_queue>large.q<hard_req_queue>
+        ...
+    </job_list>
+    </Queue-List>
+    ...
+</queue_info>
+<job_info>
+    <job_list state="pending">
+    <JB_job_number>112742</JB_job_number>
+    <JB_name>CH3ONO2</JB_name>
+    <JB_owner>meghaanand</JB_owner>
+    <state>qw</state>
+    <JB_submission_time>2015-05-08T16:30:25</JB_submission_time>
+    <hard_req_queue>large.q<hard_req_queue>
+    ...
+    </job_list>
+</job_info>
+...
+</job_info>
+    """
+    name = 'sge'
+    jobs_cmd = 'qstat -u "*" -r -f -xml'
+    sizes_cmd = 'qstat -g c'
+
+    @staticmethod
+    def parse_jobs(source):
+        node = None
+        # Queue-Lists are only read so they are freed
+        for elem, parent in iter_xml(source, {'name', 'job_list', 'Queue-List'}):
+            #<Queue-List>
+            #   <name>gen3.q@v10.cl.ccqc.uga.edu</name>
+            if elem.tag == 'name':
+                if parent.tag == 'Queue-List':
+                    node = elem.text.split('@')[0]
+                continue
+            elif elem.tag == 'Queue-List':
+                continue
+            fields = SGE.read_job(elem)
+            # Running jobs are arranged by node/queue
+            if parent.tag == 'Queue-List':
+                yield node, 'running', fields
+            # Queued jobs
+            else:
+                yield fields[4].split('@')[0], 'queueing', fields
+
+    @staticmethod
+    def read_job(job_xml):
+        """Read the fields of a job_list element"""
+        jid = int(job_xml.find('JB_job_number').text)
+        tasks = job_xml.find('tasks')
+        count = 1
+        # If there are multiple tasks with the same id, add the task number to the id
+        if tasks is not None:
+            # If it is a range of jobs, e.g. 17-78:1, just take the first
+            task = tasks.text.split('-')[0]  # If not a range, this does nothing
+            # SGE is being cute and comma separates two numbers if sequential
+            task = task.split(',')[0]
+            jid = array_id(jid, task)
+            count = count_tasks(tasks.text)
+        # Sizes from 'qstat -g c' are slots too
+        slots = int(job_xml.findtext('slots') or 1)
+        name = job_xml.find('JB_name').text
+        owner = job_xml.find('JB_owner').text
+        state = job_xml.find('state').text
+        try:
+            queue = job_xml.find('hard_req_queue').text
+        except AttributeError as e:
+            queue = 'debug.q'
+        return jid, name, state, owner, queue, None, count, slots
+
+    @staticmethod
+    def parse_sizes(out):
+        """Sample output from 'qstat -g c':
+        CLUSTER QUEUE                   CQLOAD   USED    RES  AVAIL  TOTAL aoACDS  cdsuE
+        --------------------------------------------------------------------------------
+        all.q                             -NA-      0      0      0      0      0      0
+        gen3.q                            0.00      0      0      0     16      0     16
+        gen4.q                            0.26     31      0     13     48      0      4
+        gen5.q                            0.50      4      0      0      4      0      0
+        gen6.q                            0.39     19      0      0     19      0      1
+        """
+        sizes = {}
+        for line in out.splitlines()[2:]:
+            if 'all.q' == line[:5]:
+                continue
+            queue, cqload, used, res, avail, total, aoacds, cdsue = line.split()
+            sizes[queue] = int(used) + int(avail)
+        return sizes
+
+
+class PBS(Scheduler):
+    """
+    PBS/Torque
+
+    Sample output from 'qstat -x -t':
+<Data>
+    <Job>
+        <Job_Id>77816.icqc</Job_Id>
+        <Job_Name>e7_cas2_ddci3_tighter</Job_Name>
+        <Job_Owner>sivalingam@icmaster1</Job_Owner>
+        <resources_used>
+            <cput>21002:04:52</cput>
+            <energy_used>0</energy_used>
+            <mem>60978424kb</mem>
+            <vmem>73997480kb</vmem>
+            <walltime>2630:02:36</walltime>
+        </resources_used>
+        <job_state>R</job_state>
+        <queue>batch</queue>
+        <server>control</server>
+        <Checkpoint>u</Checkpoint>
+        <ctime>1488149683</ctime>
+        <Error_Path>zeusln1:/home/sivalingam/s4/e7_cas2_ddci3_tighter.err</Error_Path>
+        <exec_host>izeusbn13/8-11+izeusbn12/11-12+izeusbn11/12-13</exec_host>
+        <Hold_Types>n</Hold_Types>
+        <Join_Path>oe</Join_Path>
+        <Keep_Files>n</Keep_Files>
+        <Mail_Points>a</Mail_Points>
+        <mtime>1488149684</mtime>
+        <Output_Path>zeus1:/home/sivalingam/s4/e7_cas2_ddci3_tighter.o77816</Output_Path>
+        <Priority>0</Priority>
+        <qtime>1488149683</qtime>
+        <Rerunable>False</Rerunable>
+        <Resource_List>
+            <nodect>8</nodect>
+            <nodes>8</nodes>
+            <walltime>8760:00:00</walltime>
+        </Resource_List>
+        <session_id>3716</session_id>
+        <Shell_Path_List>/bin/zsh</Shell_Path_List>
+        <euser>sivalingam</euser>
+        <egroup>gl-ag orca</egroup>
+        <queue_type>E</queue_type>
+        <etime>1488149683</etime>
+        <submit_args>-j oe -e /home/sivalingam/s4/e7_cas2_ddci3_tighter.err -N e7_cas2_ddci3_tighter -r n e7_cas2_ddci3_tighter.job</submit_args>
+        <start_time>1488149684</start_time>
+        <Walltime>
+            <Remaining>22067782</Remaining>
+        </Walltime>
+        <start_count>1</start_count>
+        <fault_tolerant>False</fault_tolerant>
+        <job_radix>0</job_radix>
+        <submit_host>zeus1</submit_host>
+    </Job>
+    ...
+</Data>
+    """
+    name = 'pbs'
+    jobs_cmd = 'qstat -x -t'
+    sizes_cmd = 'pbsnodes'
+
+    @staticmethod
+    def parse_jobs(source):
+        for elem, parent in iter_xml(source, {'Job'}):
+            fields = PBS.read_job(elem)
+            state = fields[2]
+            if state != 'c':
+                yield fields[4], 'running' if state == 'r' else 'queueing', fields
+
+    @staticmethod
+    def read_job(job_xml):
+        """Read the fields of a Job element"""
+        jid = job_xml.find('Job_Id').text.split('.')[0]
+        try:
+            jid = int(jid)
+        except ValueError as e:
+            # Must be part of a job_array
+            jid, task_id = jid[:-1].split('[')
+            if task_id:
+                jid = array_id(jid, task_id)
+            else:
+                # -t must not be supported
+                jid = int(jid)
+
+        name = job_xml.find('Job_Name').text
+        state = job_xml.find('job_state').text.lower()
+        owner = job_xml.find('Job_Owner').text.split('@')[0]
+        queue = job_xml.find('queue').text
+
+        workdir = None
+        try:
+            variables = job_xml.find('Variable_List').text.split(',')
+            variables = dict(kv.split('=') for kv in variables)
+            workdir = variables['PBS_O_WORKDIR']
+        except AttributeError:
+            pass
+
+        # Every task of an array job is listed (with -t), the sizes are nodes so each job is counted once
+        return jid, name, state, owner, queue, workdir, 1, 1
+
+    def default_queue(self):
+        """The default_queue of the server, from 'qstat -Bf'"""
+        out = subprocess.check_output(['qstat', '-Bf'], stderr=subprocess.DEVNULL).decode('utf-8', 'replace')
+        match = re.search(r'default_queue = (\S+)', out)
+        return match.group(1) if match else None
+
+    @staticmethod
+    def parse_sizes(out):
+        """sample output from pbsnodes:
+izeussn153
+    state = job-exclusive
+    power_state = Running
+    np = 16
+    properties = small
+    ntype = cluster
+    jobs = 0-15/86886.icqc
+    status = rectime=1498123346,macaddr=40:f2:e9:c6:22:60,cpuclock=Fixed,varattr=,jobs=86886.icqc(cput=65375153,energy_used=0,mem=118685472kb,vmem=133127908kb,walltime=4154720,session_id=3357),state=free,netload=75804699166624,gres=,loadave=16.00,ncpus=16,physmem=131338172kb,availmem=176492292kb,totmem=265555896kb,idletime=10974874,nusers=1,nsessions=1,sessions=3357,uname=Linux zeussn153 3.10.0-229.el7.x86_64 #1 SMP Fri Mar 6 11:36:42 UTC 2015 x86_64,opsys=linux
+    mom_service_port = 15002
+    mom_manager_port = 15003
+"""
+        sizes = {}
+        for node in out.strip().split('\n\n'):
+            try:
+                queue = re.search('properties = (.*)', node).group(1)
+            except AttributeError as e:
+                queue = 'batch'
+            if queue == 'big':
+                queue = 'batch'
+            sizes[queue] = sizes.get(queue, 0) + 1
+        return sizes
+
+
+def slurm_number(value):
+    """Slurm >= 23.02 wraps numbers, e.g. {"set": true, "infinite": false, "number": 5}"""
+    if isinstance(value, dict):
+        return value.get('number') if value.get('set', True) else None
+    return value
+
+
+class Slurm(Scheduler):
+    """
+    Slurm, the sizes of the partitions are their number of CPUs (and jobs use
+    their number of CPUs)
+
+    Sample output from 'squeue --json' (older versions do not wrap the numbers
+    and give the job_state as a string):
+{
+  "jobs": [
+    {
+      "array_job_id": {"set": true, "infinite": false, "number": 0},
+      "array_task_id": {"set": false, "infinite": false, "number": 0},
+      "array_task_string": "",
+      "cpus": {"set": true, "infinite": false, "number": 8},
+      "current_working_directory": "/home/mullinax/opt",
+      "job_id": 4242,
+      "job_state": ["RUNNING"],
+      "name": "optg",
+      "partition": "gen4",
+      "user_name": "mullinax",
+      ...
+    },
+    ...
+  ],
+  ...
+}
+    """
+    name = 'slurm'
+    jobs_cmd = 'squeue --json'
+    sizes_cmd = "sinfo -h -o '%R %C'"
+    # Short state codes, like squeue prints them
+    states = {
+        'RUNNING': 'r',
+        'PENDING': 'pd',
+        'SUSPENDED': 's',
+        'COMPLETING': 'cg',
+        'CONFIGURING': 'cf',
+        'REQUEUED': 'rq',
+    }
+    finished = {'COMPLETED', 'CANCELLED', 'FAILED', 'TIMEOUT', 'NODE_FAIL', 'PREEMPTED',
+                'OUT_OF_MEMORY', 'BOOT_FAIL', 'DEADLINE'}
+
+    @staticmethod
+    def parse_jobs(source):
+        for job in json.load(source)['jobs']:
+            state = job['job_state']
+            if isinstance(state, list):
+                state = state[0] if state else 'PENDING'
+            if state in Slurm.finished:
+                continue
+
+            jid = slurm_number(job['job_id'])
+            tasks = 1
+            array_job = slurm_number(job.get('array_job_id'))
+            if array_job and job.get('array_task_string'):
+                # The tasks of an array job that have not started are a single job, named
+                # after the next task to start (like SGE) so it becomes that task when it starts
+                task_string = job['array_task_string']
+                jid = array_id(array_job, re.match(r'\d+', task_string).group())
+                tasks = count_tasks(task_string)
+            elif array_job and slurm_number(job.get('array_task_id')) is not None:
+                jid = array_id(array_job, slurm_number(job['array_task_id']))
+            # Pending jobs may be able to run in multiple partitions
+            queue = job['partition'].split(',')[0]
+            fields = (jid, job['name'], Slurm.states.get(state, state[:2].lower()), job['user_name'],
+                      queue, job.get('current_working_directory'), tasks, slurm_number(job.get('cpus')) or 1)
+            yield queue, 'running' if state == 'RUNNING' else 'queueing', fields
+
+    def default_queue(self):
+        """The default partition, marked with a * by sinfo"""
+        out = subprocess.check_output(['sinfo', '-h', '-o', '%P'], stderr=subprocess.DEVNULL).decode('utf-8', 'replace')
+        for partition in out.split():
+            if partition.endswith('*'):
+                return partition[:-1]
+        return None
+
+    @staticmethod
+    def parse_sizes(out):
+        """Sample output from "sinfo -h -o '%R %C'" (CPUs allocated/idle/other/total):
+        debug 0/64/0/64
+        gen4 1200/336/0/1536
+        gen4 0/64/0/64
+        """
+        sizes = {}
+        for line in out.splitlines():
+            if line.strip():
+                partition, cpus = line.split()
+                sizes[partition] = sizes.get(partition, 0) + int(cpus.split('/')[-1])
+        return sizes
+
+
+class Recorded(Scheduler):
+    """
+    Replays saved output of any of the schedulers (see Scheduler.record) for
+    offline use, testing and benchmarking
+    """
+    live = False
+
+    def __init__(self, jobs_file, sizes=None):
+        """
+        :param jobs_file: saved output of the command listing the jobs
+        :param sizes: dict of the sizes of the queues or a file of the saved
+            output of the command listing the queue sizes, otherwise unknown
+        """
+        super().__init__()
+        self.jobs_cmd = jobs_file
+        self.sizes_cmd = sizes
+        self.scheduler = self.detect(jobs_file)
+        self.name = self.scheduler.name
+
+    def __repr__(self):
+        return '<Recorded {} scheduler {}>'.format(self.name, self.jobs_cmd)
+
+    @staticmethod
+    def detect(jobs_file):
+        """The scheduler that wrote the file"""
+        with open(jobs_file, 'rb') as f:
+            start = f.read(4096).lstrip()
+        if start.startswith(b'{'):
+            return Slurm
+        elif b'<job_info' in start:
+            return SGE
+        elif b'<Data' in start:
+            return PBS
+        raise Exception('Could not tell which scheduler wrote {}'.format(jobs_file))
+
+    def jobs(self, process=None):
+        start = time.perf_counter()
+        with open(self.jobs_cmd, 'rb') as f:
+            yield from self.scheduler.parse_jobs(f)
+        self.latency[self.jobs_cmd] = time.perf_counter() - start
+
+    def sizes(self):
+        if isinstance(self.sizes_cmd, str):
+            with open(self.sizes_cmd) as f:
+                return self.scheduler.parse_sizes(f.read())
+        return dict(self.sizes_cmd) if self.sizes_cmd else {}
+
+    def record(self, jobs_file, sizes_file=None):
+        raise NotImplementedError('Recorded output cannot be recorded again')
+
+
+# Detection order, Slurm first as some Slurm clusters provide a qstat wrapper
+schedulers = OrderedDict((
+    ('slurm', Slurm),
+    ('sge', SGE),
+    ('pbs', PBS),
+))
+
+
+def detect(names=None):
+    """
+    Find the installed scheduler by listing the jobs with all of them at once
+    :param names: names of the schedulers to try, defaults to all
+    :return: Scheduler, Popen with its jobs on its stdout
+    """
+    candidates = [schedulers[name]() for name in (names if names else schedulers)]
+    processes = [(scheduler, scheduler.popen()) for scheduler in candidates]
+
+    found = None
+    for scheduler, process in processes:
+        # The wrong scheduler fails without writing anything
+        if found is None and process.stdout.peek(1):
+            found = scheduler, process
+        else:
+            process.stdout.close()
+            process.wait()
+    if found:
+        return found
+
+    raise Exception('Could not find a scheduler, only {} currently supported.'.format(
+        ', '.join(schedulers)))
@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
 import numpy as np
 
-from cclib.io import ccread
+from functools import partial
+from collections import OrderedDict, namedtuple
+
 from cclib.parser.utils import convertor
 
-from matplotlib import pyplot as plt
+from .cache import ccparse
+from .helper import convert_energy, parallel_map
+
+# Most values of the line shapes evaluated at once, bounds the memory used by broaden
+CHUNK_SIZE = 2**22
+# In kJ/(mol K)
+GAS_CONSTANT = 8.314462618e-3
 
 
 def gaussian(energy, intensity, width):
@@ -25,15 +33,170 @@ def gaussian_fast(energy, intensity, width):
 
 
 def lorentzian(energy, intensity, width):
-    return lambda x: 1/(2*np.pi) * width / ((x - energy)**2 + width**2/4)
+    return lambda x: intensity/(2*np.pi) * width / ((x - energy)**2 + width**2/4)
+
+
+def voigt(energy, intensity, width):
+    return lambda x: intensity*voigt_profile(x, energy, width)
 
 
 peak_functions = {
     'gaussian' : gaussian_fast,
     'lorentzian' : lorentzian,
+    'voigt' : voigt,
 }
 
 
+def gaussian_profile(xs, energies, width):
+    """Gaussians with a height of 1 and a standard deviation of width"""
+    return np.exp(-(xs - energies)**2/(2*width**2))
+
+
+def lorentzian_profile(xs, energies, width):
+    """Lorentzians with an area of 1 and a full width at half height of width"""
+    return width/(2*np.pi)/((xs - energies)**2 + width**2/4)
+
+
+def voigt_profile(xs, energies, width, gamma=None):
+    """
+    Pseudo-Voigt profiles with an area of 1 (Thompson, Cox and Hastings, J. Appl. Cryst. 20, 79 (1987))
+    :param width: standard deviation of the gaussian
+    :param gamma: full width at half height of the lorentzian, defaults to that of the gaussian
+    """
+    f_g = 2*np.sqrt(2*np.log(2))*width
+    f_l = f_g if gamma is None else gamma
+    # Full width at half height of the Voigt profile
+    f = (f_g**5 + 2.69269*f_g**4*f_l + 2.42843*f_g**3*f_l**2 + 4.47163*f_g**2*f_l**3
+         + 0.07842*f_g*f_l**4 + f_l**5)**(1/5)
+    eta = 1.36603*(f_l/f) - 0.47719*(f_l/f)**2 + 0.11116*(f_l/f)**3
+    sigma = f/(2*np.sqrt(2*np.log(2)))
+    gaussian_part = gaussian_profile(xs, energies, sigma)/(sigma*np.sqrt(2*np.pi))
+    return eta*lorentzian_profile(xs, energies, f) + (1 - eta)*gaussian_part
+
+
+# Line shapes for broaden and how many widths from the transitions they are cut off at (None for never)
+profiles = OrderedDict([
+    ('gaussian', (gaussian_profile, 6)),
+    ('lorentzian', (lorentzian_profile, None)),
+    ('voigt', (voigt_profile, None)),
+])
+
+
+def broaden(xs, energies, intensities, width, profile='gaussian', chunk_size=CHUNK_SIZE, **options):
+    """
+    Sum the line shapes of all the transitions on a grid, evaluated for many
+    transitions at once. Line shapes with a cutoff are only evaluated on the
+    points within it (found with searchsorted), otherwise on the whole grid.
+    :param xs: sorted grid to evaluate the spectrum on
+    :param energies: transition energies
+    :param intensities: transition intensities
+    :param width: width of the line shapes (see the profile functions)
+    :param profile: name of the line shape (see profiles)
+    :param chunk_size: most values evaluated at once
+    :param options: other arguments of the line shape
+    :return: array of the spectrum at each point of xs
+    """
+    function, cutoff = profiles[profile]
+    xs = np.asarray(xs, dtype=float)
+    energies = np.asarray(energies, dtype=float).ravel()
+    intensities = np.asarray(intensities, dtype=float).ravel()
+    ys = np.zeros(len(xs))
+    if not len(energies) or not len(xs):
+        return ys
+
+    if cutoff is None:
+        step = max(chunk_size//len(xs), 1)
+        for i in range(0, len(energies), step):
+            ys += intensities[i:i + step] @ function(xs, energies[i:i + step, None], width, **options)
+        return ys
+
+    # Window of the points of each transition
+    starts = np.searchsorted(xs, energies - cutoff*width, 'left')
+    stops = np.searchsorted(xs, energies + cutoff*width, 'right')
+    length = (stops - starts).max()
+    if length <= 0:
+        return ys
+    offsets = np.arange(length)
+    step = max(chunk_size//length, 1)
+    for i in range(0, len(energies), step):
+        points = starts[i:i + step, None] + offsets
+        inside = points < stops[i:i + step, None]
+        points[~inside] = 0
+        values = intensities[i:i + step, None]*function(xs[points], energies[i:i + step, None], width, **options)
+        ys += np.bincount(points.ravel(), (values*inside).ravel(), len(xs))
+    return ys
+
+
+def broaden_fft(xs, energies, intensities, width, profile='gaussian', **options):
+    """
+    Sum the line shapes of all the transitions on a uniform grid by binning
+    the intensities onto the grid (sharing each between its two nearest
+    points) and convolving them with the line shape using FFTs, the cost
+    grows as N log N in the number of points instead of with the number of
+    transitions. Transitions further than the cutoff (or for line shapes
+    without one, the width of the grid) outside of the grid are left out.
+    :param xs: uniform grid to evaluate the spectrum on
+    :param energies: transition energies
+    :param intensities: transition intensities
+    :param width: width of the line shapes (see the profile functions)
+    :param profile: name of the line shape (see profiles)
+    :param options: other arguments of the line shape
+    :return: array of the spectrum at each point of xs
+    """
+    function, cutoff = profiles[profile]
+    xs = np.asarray(xs, dtype=float)
+    energies = np.asarray(energies, dtype=float).ravel()
+    intensities = np.asarray(intensities, dtype=float).ravel()
+    npoints = len(xs)
+    if npoints < 2:
+        return broaden(xs, energies, intensities, width, profile, **options)
+    dx = (xs[-1] - xs[0])/(npoints - 1)
+    if not np.allclose(np.diff(xs), dx, rtol=1e-6, atol=0):
+        raise ValueError('Can only broaden with FFTs on a uniform grid')
+
+    # Points of the line shape on either side of its center
+    half = npoints - 1 if cutoff is None else int(np.ceil(cutoff*width/dx))
+    kernel = function(np.arange(-half, half + 1)*dx, 0, width, **options)
+
+    # Bin onto the grid extended by half of the line shape on both sides
+    extended = npoints + 2*half
+    positions = (energies - xs[0])/dx + half
+    kept = (positions >= 0) & (positions <= extended - 1)
+    positions, intensities = positions[kept], intensities[kept]
+    lower = np.minimum(positions.astype(int), extended - 2)
+    upper_part = positions - lower
+    sticks = np.bincount(lower, intensities*(1 - upper_part), extended) \
+        + np.bincount(lower + 1, intensities*upper_part, extended)
+
+    # Linear (not circular) convolution
+    size = 2**int(np.ceil(np.log2(extended + 2*half)))
+    ys = np.fft.irfft(np.fft.rfft(sticks, size)*np.fft.rfft(kernel, size), size)
+    return ys[2*half:2*half + npoints]
+
+
+def fft_error(xs, energies, intensities, width, profile='gaussian', sample=1000, **options):
+    """
+    Check the accuracy of broaden_fft against broaden for a random sample of the transitions
+    :param sample: number of transitions to compare with, None for all of them
+    :return: the largest difference relative to the largest value of the exact spectrum
+    """
+    energies = np.asarray(energies, dtype=float).ravel()
+    intensities = np.asarray(intensities, dtype=float).ravel()
+    if sample is not None and sample < len(energies):
+        chosen = np.random.RandomState(0).choice(len(energies), sample, replace=False)
+        energies, intensities = energies[chosen], intensities[chosen]
+    exact = broaden(xs, energies, intensities, width, profile, **options)
+    binned = broaden_fft(xs, energies, intensities, width, profile, **options)
+    return np.abs(binned - exact).max()/np.abs(exact).max()
+
+
+# Ways to broaden spectra, exact is evaluated at every point (with the cutoff)
+broadenings = OrderedDict([
+    ('exact', broaden),
+    ('fft', broaden_fft),
+])
+
+
 class Spectra:
     """
     Class for plotting arbitrary spectra
@@ -51,6 +214,7 @@ class Spectra:
             'bar_width' : (energies[-1] - energies[0])/150,
             'crop': False,
             'crop_thresh': 9,
+            'broadening': 'exact',
             'norm' : True,
             'peak_function': 'gaussian',
         }
@@ -63,33 +227,22 @@ class Spectra:
         return SpectralDifference(self, other)
 
     def __add__(self, other):
-        """
-        First hack at sum of spectra
-        TODO: Make separate class akin to SpectralDifference but with more additions?
-        """
-        return SpectralSum(self.energies, other)
+        if isinstance(other, SpectralSum):
+            return SpectralSum(self, *other.spectra)
+        return SpectralSum(self, other)
 
-    def plot(self, npoints=10001, fwhh=1, units='eV'):
+    def spectrum(self, npoints=10001, fwhh=1, units='eV'):
         """
-        Plots the transitions
+        Broaden the transitions
         :param npoints: the number of points to use in the expansion
-        :param fwhh: the width of the gaussian
-        :param units: what units to plot with
+        :param fwhh: the width of the peaks
+        :param units: what units to use
+        :return: the grid and the spectrum on it
         """
-        energies, intensities = self.energies, self.intensities
-
-        if units == 'eV':
-            pass
-        else:
+        energies = np.asarray(self.energies, dtype=float)
+        if units != 'eV':
             energies = convertor(energies, 'eV', units)
 
-        # Make all of the peak functions functions
-        peak_function = peak_functions[self.options['peak_function']]
-
-        peaks = []
-        for energy, intensity in zip(energies, intensities):
-            peaks.append(peak_function(energy, intensity, fwhh))
-
         # Add a little before and after the first and last vals
         val_range = energies[-1] - energies[0]
         low, high = energies[0] - val_range/10, energies[-1] + val_range/10
@@ -99,12 +252,20 @@ class Spectra:
                             'peak width or the number of points')
 
         xs = np.linspace(low, high, npoints)
-        ys = np.zeros(npoints)
+        broadening = broadenings[self.options['broadening']]
+        return xs, broadening(xs, energies, self.intensities, fwhh, self.options['peak_function'])
 
-        # generate all values
-        for i, x in enumerate(xs):
-            for peak in peaks:
-                ys[i] += peak(x)
+    def plot(self, npoints=10001, fwhh=1, units='eV'):
+        """
+        Plots the transitions
+        :param npoints: the number of points to use in the expansion
+        :param fwhh: the width of the gaussian
+        :param units: what units to plot with
+        """
+        xs, ys = self.spectrum(npoints, fwhh, units)
+        energies, intensities = self.energies, self.intensities
+        if units != 'eV':
+            energies = convertor(energies, 'eV', units)
 
         # set max to 1
         max_int = max(ys)
@@ -124,6 +285,8 @@ class Spectra:
             energies = energies[start:end + 1]
             intensities = intensities[start:end + 1]
 
+        from matplotlib import pyplot as plt
+
         # switch to KeV
         plt.ticklabel_format(style='sci', axis='x', scilimits=(0,3))
 
@@ -135,93 +298,124 @@ class Spectra:
         plt.legend()
 
 
+def boltzmann_weights(energies, temperature=298.15, units='hartree'):
+    """
+    Boltzmann populations of states
+    :param energies: energy of each state (e.g. the free energy of each conformer)
+    :param temperature: in Kelvin
+    :param units: units of the energies (see helper.convert_energy)
+    :return: array of weights summing to 1
+    """
+    energies = np.asarray(energies, dtype=float)
+    relative = convert_energy(energies - energies.min(), units, 'kJ/mol')
+    populations = np.exp(-relative/(GAS_CONSTANT*temperature))
+    return populations/populations.sum()
+
+
 class CombinedSpectra:
+    """
+    Weighted combination of any number of spectra. Each spectrum is broadened
+    once on a grid shared by all of them and cached, so the weights can be
+    changed without broadening again.
+    """
+    symbol = '+'
 
-    def __init__(self, spectra1, spectra2):
+    def __init__(self, *spectra, weights=None, name=None):
         """
-        Combination of two spectra, either a sum or a difference
-
-        :param spectra1, spectra2: Spectra objects
+        :param spectra: Spectra objects
+        :param weights: weight of each spectrum, defaults to default_weights
+        :param name: name of the combination
+        TODO: deal with conflicting option values
         """
-        self.options = spectra1.options.copy()
-        self.spectra1, self.spectra2 = spectra1, spectra2
+        if len(spectra) < 1:
+            raise ValueError('Need spectra to combine')
+        self.options = spectra[0].options.copy()
+        self.spectra = list(spectra)
+        self.name = name
+        self.weights = self.default_weights() if weights is None else weights
+        # (grid, components) keyed by the arguments of components and the options used
+        self._components = {}
 
     def __repr__(self):
-        return '<CombinedSpectra {} : {}>'.format(self.spectra1.name, self.spectra2.name)
+        return '<{} {}>'.format(type(self).__name__, ' {} '.format(self.symbol).join(s.name for s in self.spectra))
 
-    def plot(self, npoints=1001, fwhh=1, units='eV'):
-        """
-        Plot the difference of two spectra on top of the spectras
-        of the individual spectra, with the second flipped
-        :param units: what units to plot with
-        TODO: deal with conflicting option values
-        TODO: make better
-        """
-        spectra1, spectra2 = self.spectra1, self.spectra2
-        es1, ints1 = spectra1.energies, spectra1.intensities
-        es2, ints2 = spectra2.energies, spectra2.intensities
+    @property
+    def spectra1(self):
+        return self.spectra[0]
 
-        if units == 'eV':
-            pass
-        else:
-            es1 = convertor(es1, 'eV', units)
-            es2 = convertor(es2, 'eV', units)
+    @property
+    def spectra2(self):
+        return self.spectra[1]
 
-        # Make all of the peak functions functions
-        peak_function = peak_functions[self.options['peak_function']]
+    @property
+    def weights(self):
+        return self._weights
 
-        peaks1, peaks2 = [], []
-        for (e1, e2), (int1, int2) in zip(zip(es1, es2), zip(ints1, ints2)):
-            peaks1.append(peak_function(e1, int1, fwhh))
-            peaks2.append(peak_function(e2, int2, fwhh))
+    @weights.setter
+    def weights(self, weights):
+        weights = np.asarray(weights, dtype=float)
+        if weights.shape != (len(self.spectra),):
+            raise ValueError('Need a weight for each of the {} spectra'.format(len(self.spectra)))
+        self._weights = weights
 
-        # Add a little before and after the first and last vals
-        low, high = min(es1[0], es2[0]), max(es1[-1], es2[-1])
-        val_range = high - low
-        low, high = low - val_range/10, high + val_range/10
-        if  val_range > npoints*fwhh:
-            raise Exception('Cannot properly plot the spectra, increase the ' +
-                            'peak width or the number of points')
+    def default_weights(self):
+        return np.ones(len(self.spectra))
 
-        xs = np.linspace(low, high, npoints)
-        ys1 = np.zeros(npoints)
-        ys2 = np.zeros(npoints)
-
-        # generate all values
-        for i, x in enumerate(xs):
-            for peak1, peak2 in zip(peaks1, peaks2):
-                ys1[i] += peak1(x)
-                ys2[i] += peak2(x)
-
-        if isinstance(self, SpectralDifference):
-            combo = ys1 - ys2
-        elif isinstance(self, SpectralSum):
-            combo = ys1 + ys2
-        else:
-            raise SyntaxError('Must be a sum or difference of spectra.')
+    def components(self, npoints=1001, fwhh=1, units='eV'):
+        """
+        Every spectrum broadened on the shared grid, cached
+        :return: the grid and an array with each spectrum as a column
+        """
+        key = (npoints, fwhh, units, self.options['peak_function'], self.options['broadening'])
+        if key not in self._components:
+            transitions = []
+            for spectra in self.spectra:
+                energies = np.asarray(spectra.energies, dtype=float)
+                if units != 'eV':
+                    energies = convertor(energies, 'eV', units)
+                transitions.append((energies, spectra.intensities))
+            # Add a little before and after the first and last vals
+            low = min(energies.min() for energies, intensities in transitions)
+            high = max(energies.max() for energies, intensities in transitions)
+            val_range = high - low
+            if val_range > npoints*fwhh:
+                raise Exception('Cannot properly plot the spectra, increase the ' +
+                                'peak width or the number of points')
+            xs = np.linspace(low - val_range/10, high + val_range/10, npoints)
+            self._components[key] = xs, spectra_matrix(transitions, xs, fwhh, self.options['peak_function'],
+                                                       self.options['broadening'])
+        return self._components[key]
+
+    def spectrum(self, npoints=1001, fwhh=1, units='eV', weights=None):
+        """
+        The combined spectrum, only the first call for a grid broadens the spectra
+        :param weights: weights to use instead of self.weights
+        :return: the grid and the combined spectrum on it
+        """
+        xs, components = self.components(npoints, fwhh, units)
+        return xs, components @ (self.weights if weights is None else np.asarray(weights, dtype=float))
+
+    def plot(self, npoints=1001, fwhh=1, units='eV'):
+        """
+        Plot the combination on top of the spectra of the individual spectra,
+        with those subtracted flipped
+        :param units: what units to plot with
+        TODO: make better
+        """
+        xs, components = self.components(npoints, fwhh, units)
+        combo = components @ self.weights
+        flips = np.where(self.weights < 0, -1, 1)
+        components = components*flips
+        intensities = [np.asarray(spectra.intensities)*flip for spectra, flip in zip(self.spectra, flips)]
 
         # set max to 1
         if self.options['norm']:
-            co_norm = True
-            if co_norm:
-                max_int = max(max(ys1), max(ys2), max(combo))
-                ints1 = ints1 / max_int
-                ys1 = ys1 / max_int
-                ints2 = ints2 / max_int
-                ys2 = ys2 / max_int
-                combo = combo / max_int
-            else:
-                ints1 = ints1 / max(ys1)
-                ys1 = ys1 / max(ys1)
-                ints2 = ints2 / max(ys2)
-                ys2 = ys2 / max(ys2)
-                combo = ys1 - ys2
-
-        # Flip if a difference
-        if isinstance(self, SpectralDifference):
-            ys2 = -ys2
-            ints2 = -ints2
+            max_int = max(components.max(), combo.max())
+            components = components/max_int
+            intensities = [ints/max_int for ints in intensities]
+            combo = combo/max_int
 
+        from matplotlib import pyplot as plt
 
         # switch to KeV
         plt.ticklabel_format(style='sci', axis='x', scilimits=(0,3))
@@ -229,28 +423,83 @@ class CombinedSpectra:
         # Plot
         plt.axhline(0, color='black')
 
-        plt.plot(xs, ys1, 'b-', label=spectra1.name)
-        plt.plot(xs, ys2, 'g-', label=spectra2.name)
-
-        plt.plot(xs, combo, 'y-', label='Δ')
-        plt.bar(es1, ints1, self.options['bar_width'], color='r')
-        plt.bar(es2, ints2, self.options['bar_width'], color='r')
+        line_colors = ['b', 'g', 'c', 'm', 'k']
+        for i, spectra in enumerate(self.spectra):
+            plt.plot(xs, components[:, i], line_colors[i % len(line_colors)] + '-', label=spectra.name)
+        label = self.name if self.name else {'-': 'Δ', '+': 'Σ'}.get(self.symbol, self.symbol)
+        plt.plot(xs, combo, 'y-', label=label)
+        for spectra, ints in zip(self.spectra, intensities):
+            energies = spectra.energies if units == 'eV' else convertor(np.asarray(spectra.energies), 'eV', units)
+            plt.bar(energies, ints, self.options['bar_width'], color='r')
         plt.legend()
 
 
 class SpectralDifference(CombinedSpectra):
-    def __repr__(self):
-        return '<SpectralDifference {} - {}>'.format(self.spectra1.name, self.spectra2.name)
+    """The first spectrum minus the others"""
+    symbol = '-'
+
+    def default_weights(self):
+        return np.array([1] + [-1]*(len(self.spectra) - 1), dtype=float)
 
 
 class SpectralSum(CombinedSpectra):
+    """The sum of the spectra"""
+    symbol = '+'
+
+    def __add__(self, other):
+        return SpectralSum(*self.spectra, other)
+
+
+class BoltzmannSpectra(CombinedSpectra):
+    """
+    Boltzmann weighted average of the spectra of states (e.g. conformers),
+    changing the temperature only reweights the cached spectra
+    """
+    symbol = ','
+
+    def __init__(self, *spectra, energies, temperature=298.15, units='hartree', name='Boltzmann'):
+        """
+        :param energies: energy of each state (e.g. free energies)
+        :param temperature: in Kelvin
+        :param units: units of the energies (see helper.convert_energy)
+        """
+        self.energies = np.asarray(energies, dtype=float)
+        self.energy_units = units
+        self._temperature = temperature
+        super().__init__(*spectra, name=name)
+
     def __repr__(self):
-        return '<SpectralSum {} + {}>'.format(self.spectra1.name, self.spectra2.name)
+        return '<BoltzmannSpectra {} at {} K>'.format(', '.join(s.name for s in self.spectra), self.temperature)
+
+    def default_weights(self):
+        return boltzmann_weights(self.energies, self.temperature, self.energy_units)
+
+    @property
+    def temperature(self):
+        return self._temperature
 
+    @temperature.setter
+    def temperature(self, temperature):
+        self._temperature = temperature
+        self.weights = self.default_weights()
 
-def gen_spectra(file_name, name, thresh=9):
-    data = ccread(file_name)
-    energies, intensities = convertor(data.etenergies, 'cm-1', 'eV'), data.etoscs
+
+def read_transitions(file_name, use_cache=True):
+    """
+    Read the excitations of an output file
+    :return: energies (in eV) and intensities, None if there are none
+    """
+    data = ccparse(file_name, use_cache)
+    if data is None or getattr(data, 'etenergies', None) is None:
+        return None
+    return convertor(np.asarray(data.etenergies), 'cm-1', 'eV'), np.asarray(data.etoscs)
+
+
+def gen_spectra(file_name, name, thresh=9, use_cache=True):
+    transitions = read_transitions(file_name, use_cache)
+    if transitions is None:
+        raise ValueError('No excitations found in {}'.format(file_name))
+    energies, intensities = transitions
     #intensities = abs(intensities)
 
     #print(len(energies))
@@ -269,3 +518,392 @@ def gen_spectra(file_name, name, thresh=9):
 
     s = Spectra(energies, intensities, name)
     return s
+
+
+def read_conformer(file_name, energy='free', use_cache=True):
+    """
+    Read the energy and excitations of an output file with a single parse
+    :param energy: free (Gibbs free energy), enthalpy or scf (the last SCF energy)
+    :return: energy (in hartree), transition energies (in eV) and intensities,
+        None if either the energy or the excitations are missing
+    """
+    data = ccparse(file_name, use_cache)
+    if data is None or getattr(data, 'etenergies', None) is None:
+        return None
+    if energy == 'scf':
+        scf_energies = getattr(data, 'scfenergies', None)
+        if scf_energies is None or not len(scf_energies):
+            return None
+        value = convert_energy(float(scf_energies[-1]), 'eV', 'hartree')
+    elif energy in ('free', 'enthalpy'):
+        value = getattr(data, 'freeenergy' if energy == 'free' else 'enthalpy', None)
+        if value is None:
+            return None
+    else:
+        raise ValueError('Unknown energy {}, must be free, enthalpy or scf'.format(energy))
+    return float(value), convertor(np.asarray(data.etenergies), 'cm-1', 'eV'), np.asarray(data.etoscs)
+
+
+class ConformerEnsemble:
+    """
+    Boltzmann weighted spectrum of conformers (or any states), each output
+    file is only parsed once for both its energy and excitations
+    """
+    def __init__(self, energies, transitions, names=None, temperature=298.15):
+        """
+        :param energies: energy of each conformer (in hartree)
+        :param transitions: (energies in eV, intensities) of each conformer
+        :param names: name of each conformer, defaults to their numbers
+        :param temperature: in Kelvin
+        """
+        self.energies = np.asarray(energies, dtype=float)
+        self.transitions = [(np.asarray(e, dtype=float), np.asarray(i, dtype=float)) for e, i in transitions]
+        if len(self.energies) != len(self.transitions):
+            raise ValueError('Need an energy for each set of transitions')
+        self.names = list(range(len(self.energies))) if names is None else list(names)
+        self.temperature = temperature
+        # Files that were missing the energy or the excitations
+        self.skipped = []
+
+    @classmethod
+    def from_files(cls, file_names, energy='free', temperature=298.15, names=None, jobs=1, use_cache=True,
+                   progress=False):
+        """
+        Read the conformers from their output files, in parallel, skipping
+        those without the energy or excitations
+        :param energy: energy to weight with (see read_conformer)
+        :param names: name of each conformer, defaults to the file names
+        :param jobs: number of files to read in parallel
+        :param progress: write a progress line to stderr while reading
+        """
+        file_names = list(file_names)
+        names = file_names if names is None else list(names)
+        read = partial(read_conformer, energy=energy, use_cache=use_cache)
+        kept, energies, transitions, skipped = [], [], [], []
+        for name, conformer in zip(names, parallel_map(read, file_names, jobs, progress)):
+            if conformer is None:
+                skipped.append(name)
+                continue
+            kept.append(name)
+            energies.append(conformer[0])
+            transitions.append(conformer[1:])
+        if not kept:
+            raise ValueError('No conformers with both {} energies and excitations'.format(energy))
+        ensemble = cls(energies, transitions, kept, temperature)
+        ensemble.skipped = skipped
+        return ensemble
+
+    def __repr__(self):
+        return '<ConformerEnsemble {} conformers at {} K>'.format(len(self.names), self.temperature)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def weights(self):
+        """Boltzmann weight of each conformer at the temperature"""
+        return boltzmann_weights(self.energies, self.temperature, 'hartree')
+
+    def spectrum(self, npoints=10001, fwhh=1, units='eV', limits=None, peak_function='gaussian',
+                 broadening='exact'):
+        """
+        The weighted spectrum, broadening the transitions of all the conformers
+        (with their intensities scaled by the weights) at once
+        :param limits: lowest and highest energy of the grid, otherwise covers all the transitions
+        :return: the grid and the spectrum on it
+        """
+        energies = np.concatenate([energies for energies, intensities in self.transitions])
+        if units != 'eV':
+            energies = convertor(energies, 'eV', units)
+        counts = [len(intensities) for energies, intensities in self.transitions]
+        intensities = np.concatenate([intensities for energies, intensities in self.transitions]) \
+            * np.repeat(self.weights, counts)
+        if limits is None:
+            xs = shared_grid([(energies, intensities)], npoints, fwhh)
+        else:
+            xs = np.linspace(limits[0], limits[1], npoints)
+        return xs, broadenings[broadening](xs, energies, intensities, fwhh, peak_function)
+
+    def combined(self):
+        """BoltzmannSpectra of the conformers, to plot each and to reweight without broadening again"""
+        spectra = [Spectra(energies, intensities, name)
+                   for name, (energies, intensities) in zip(self.names, self.transitions)]
+        return BoltzmannSpectra(*spectra, energies=self.energies, temperature=self.temperature)
+
+
+def shared_grid(transitions, npoints=10001, fwhh=1):
+    """
+    A grid covering all of the transitions, with a little before and after
+    :param transitions: list of (energies, intensities), None for no transitions
+    """
+    energies = [energies for energies, intensities in filter(None, transitions) if len(energies)]
+    if not energies:
+        raise ValueError('No transitions to make a grid for')
+    low, high = min(map(np.min, energies)), max(map(np.max, energies))
+    val_range = high - low
+    if val_range > npoints*fwhh:
+        raise Exception('Cannot properly plot the spectra, increase the ' +
+                        'peak width or the number of points')
+    # Wide enough for a single transition
+    pad = max(val_range/10, 6*fwhh)
+    return np.linspace(low - pad, high + pad, npoints)
+
+
+def spectra_matrix(transitions, xs, fwhh=1, peak_function='gaussian', broadening='exact', norm=False):
+    """
+    Broaden many sets of transitions on the same grid
+    :param transitions: list of (energies, intensities), None for no transitions
+    :param norm: scale each spectrum to a maximum of 1
+    :return: array with the spectrum of each set of transitions as a column,
+        leaving out those that are None
+    """
+    broadening = broadenings[broadening]
+    transitions = [transition for transition in transitions if transition is not None]
+    out = np.zeros((len(xs), len(transitions)))
+    for i, (energies, intensities) in enumerate(transitions):
+        out[:, i] = broadening(xs, energies, intensities, fwhh, peak_function)
+    if norm:
+        max_ints = np.abs(out).max(axis=0)
+        out[:, max_ints > 0] /= max_ints[max_ints > 0]
+    return out
+
+
+def batch_spectra(file_names, npoints=10001, fwhh=1, units='eV', limits=None, jobs=1, use_cache=True,
+                  progress=False, **options):
+    """
+    Broaden the spectra of many output files on a shared grid without plotting
+    :param limits: lowest and highest energy of the grid, otherwise covers all the transitions
+    :param jobs: number of files to read in parallel
+    :param progress: write a progress line to stderr while reading
+    :param options: peak_function, broadening and norm (see spectra_matrix)
+    :return: the grid, an array with the spectrum of each file as a column and
+        the list of files skipped for having no excitations (left out of the array)
+    """
+    file_names = list(file_names)
+    transitions = list(parallel_map(partial(read_transitions, use_cache=use_cache), file_names, jobs, progress))
+    skipped = [file_name for file_name, t in zip(file_names, transitions) if t is None]
+    if len(skipped) == len(file_names):
+        raise ValueError('No excitations found in any of the files')
+    if units != 'eV':
+        transitions = [None if t is None else (convertor(t[0], 'eV', units), t[1]) for t in transitions]
+    if limits is None:
+        xs = shared_grid(transitions, npoints, fwhh)
+    else:
+        xs = np.linspace(limits[0], limits[1], npoints)
+    return xs, spectra_matrix(transitions, xs, fwhh, **options), skipped
+
+
+def save_spectra(file_name, xs, spectra, names=None):
+    """
+    Write spectra sharing a grid to a single file, chosen by the extension
+        .npy: array with the grid as the first column and then each spectrum
+        .npz: arrays of the grid (energies), spectra and names
+        otherwise: comma separated values with a header of the names
+    :param spectra: array with each spectrum as a column
+    :param names: name of each spectrum, defaults to their numbers
+    """
+    names = [str(name) for name in (range(spectra.shape[1]) if names is None else names)]
+    extension = file_name.rsplit('.', 1)[-1].lower()
+    if extension == 'npy':
+        np.save(file_name, np.column_stack([xs, spectra]))
+    elif extension == 'npz':
+        np.savez_compressed(file_name, energies=xs, spectra=spectra, names=np.array(names))
+    else:
+        np.savetxt(file_name, np.column_stack([xs, spectra]), delimiter=',',
+                   header=','.join(['energy'] + names), comments='')
+
+
+class Match(namedtuple('Match', 'name index score shift')):
+    """A spectrum of a SpectraLibrary similar to a query, shift is the energy it was shifted by"""
+
+
+class SpectraLibrary:
+    """
+    Spectra broadened on a common grid, stored as the rows of a dense matrix
+    so a query is compared with all of them at once. Similarities:
+        cosine: cosine of the angle between the spectra
+        overlap: shared area of the spectra scaled to an area of 1
+        shifted: largest cosine when shifting the query by up to max_shift
+            (cross-correlation with FFTs)
+    """
+    similarities = ('cosine', 'overlap', 'shifted')
+
+    def __init__(self, xs, fwhh=1, peak_function='gaussian', broadening='exact'):
+        """
+        :param xs: uniform grid to broaden the spectra on
+        :param fwhh: width of the peaks
+        :param peak_function: shape of the peaks (see profiles)
+        :param broadening: way to broaden the spectra (see broadenings)
+        """
+        self.xs = np.asarray(xs, dtype=float)
+        self.fwhh = fwhh
+        self.peak_function = peak_function
+        self.broadening = broadening
+        self.names = []
+        self._data = np.zeros((8, len(self.xs)))
+        # Norms and areas of the spectra, kept until spectra are added
+        self._norms = None
+        self._areas = None
+        # Files that were missing the excitations
+        self.skipped = []
+
+    def __repr__(self):
+        return '<SpectraLibrary {} spectra>'.format(len(self))
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_files(cls, file_names, names=None, npoints=10001, fwhh=1, limits=None, jobs=1, use_cache=True,
+                   progress=False, **options):
+        """
+        Make a library from the spectra of output files, read in parallel (see batch_spectra),
+        skipping those without excitations
+        :param names: name of each spectrum, defaults to the file names
+        """
+        file_names = list(file_names)
+        names = file_names if names is None else list(names)
+        xs, spectra, skipped = batch_spectra(file_names, npoints, fwhh, limits=limits, jobs=jobs,
+                                             use_cache=use_cache, progress=progress, **options)
+        skipped = set(skipped)
+        library = cls(xs, fwhh, options.get('peak_function', 'gaussian'), options.get('broadening', 'exact'))
+        library.extend(spectra.T, [name for file_name, name in zip(file_names, names) if file_name not in skipped])
+        library.skipped = [name for file_name, name in zip(file_names, names) if file_name in skipped]
+        return library
+
+    @property
+    def matrix(self):
+        """The spectra, one per row"""
+        return self._data[:len(self)]
+
+    @property
+    def norms(self):
+        if self._norms is None:
+            self._norms = np.linalg.norm(self.matrix, axis=1)
+        return self._norms
+
+    @property
+    def areas(self):
+        if self._areas is None:
+            self._areas = self.matrix.sum(axis=1)
+        return self._areas
+
+    def vector(self, spectra):
+        """
+        A spectrum on the grid of the library
+        :param spectra: Spectra (broadened with the settings of the library) or values on the grid
+        """
+        if isinstance(spectra, Spectra):
+            energies = np.asarray(spectra.energies, dtype=float)
+            return broadenings[self.broadening](self.xs, energies, spectra.intensities, self.fwhh, self.peak_function)
+        values = np.asarray(spectra, dtype=float)
+        if values.shape != self.xs.shape:
+            raise ValueError('Spectrum has {} points, the library has {}'.format(len(values), len(self.xs)))
+        return values
+
+    def add(self, spectra, name=None):
+        """
+        Add a spectrum
+        :param spectra: Spectra or values on the grid
+        :param name: defaults to the name of the Spectra
+        """
+        self.extend([self.vector(spectra)], [spectra.name if name is None else name])
+
+    def add_file(self, file_name, name=None, use_cache=True):
+        """Add the spectrum of an output file (see gen_spectra)"""
+        self.add(gen_spectra(file_name, file_name if name is None else name, use_cache=use_cache))
+
+    def extend(self, spectra, names):
+        """
+        Add many spectra on the grid at once
+        :param spectra: array with a spectrum in each row
+        """
+        spectra = np.asarray(spectra, dtype=float).reshape(-1, len(self.xs))
+        if len(spectra) != len(names):
+            raise ValueError('Need a name for every spectrum')
+        size = len(self)
+        if size + len(spectra) > len(self._data):
+            data = np.zeros((max(2*len(self._data), size + len(spectra)), len(self.xs)))
+            data[:size] = self._data[:size]
+            self._data = data
+        self._data[size:size + len(spectra)] = spectra
+        self.names.extend(names)
+        self._norms = self._areas = None
+
+    def _chunks(self, width):
+        """Slices of the rows with at most CHUNK_SIZE values of the given width"""
+        step = max(CHUNK_SIZE//width, 1)
+        return (slice(i, i + step) for i in range(0, len(self), step))
+
+    def similarity(self, query, method='cosine', max_shift=None):
+        """
+        Compare a spectrum with every spectrum of the library
+        :param query: Spectra or values on the grid
+        :param method: one of similarities
+        :param max_shift: largest energy to shift by for shifted, defaults to the whole grid
+        :return: array of the similarity to each spectrum, and for shifted an
+            array of the energy each was shifted by (add it to the query to match)
+        """
+        query = self.vector(query)
+        matrix = self.matrix
+        norms = self.norms*np.linalg.norm(query)
+        if method == 'cosine':
+            return np.divide(matrix @ query, norms, out=np.zeros(len(self)), where=norms > 0)
+        elif method == 'overlap':
+            areas = self.areas
+            query = query/query.sum() if query.sum() else query
+            out = np.zeros(len(self))
+            for rows in self._chunks(len(self.xs)):
+                scaled = matrix[rows]/np.where(areas[rows] > 0, areas[rows], 1)[:, None]
+                out[rows] = np.minimum(scaled, query).sum(axis=1)
+            return out
+        elif method != 'shifted':
+            raise ValueError('Unknown similarity {}, must be one of {}'.format(method, self.similarities))
+
+        npoints = len(self.xs)
+        dx = (self.xs[-1] - self.xs[0])/(npoints - 1)
+        lags = npoints - 1 if max_shift is None else min(int(max_shift/dx), npoints - 1)
+        # Padded so the correlation is not circular
+        size = 2**int(np.ceil(np.log2(2*npoints)))
+        query_fft = np.conj(np.fft.rfft(query, size))
+        scores, shifts = np.zeros(len(self)), np.zeros(len(self))
+        for rows in self._chunks(size):
+            correlation = np.fft.irfft(np.fft.rfft(matrix[rows], size)*query_fft, size)
+            # Lags from -lags to lags, a positive lag is the library spectrum at higher energy
+            correlation = np.concatenate([correlation[:, size - lags:], correlation[:, :lags + 1]], axis=1)
+            best = correlation.argmax(axis=1)
+            scores[rows] = correlation[np.arange(len(best)), best]
+            shifts[rows] = (best - lags)*dx
+        scores = np.divide(scores, norms, out=np.zeros(len(self)), where=norms > 0)
+        return scores, shifts
+
+    def search(self, query, k=5, method='cosine', max_shift=None):
+        """
+        The most similar spectra of the library
+        :param k: number of spectra to find
+        :return: list of Matches, most similar first
+        """
+        scores = self.similarity(query, method, max_shift)
+        shifts = np.zeros(len(self))
+        if method == 'shifted':
+            scores, shifts = scores
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [Match(self.names[i], int(i), float(scores[i]), float(shifts[i])) for i in best]
+
+    def save(self, file_name):
+        """Write the library to a .npz file"""
+        np.savez_compressed(file_name, energies=self.xs, spectra=self.matrix, names=np.array(self.names, dtype=str),
+                            settings=np.array([self.fwhh, self.peak_function, self.broadening], dtype=str))
+
+    @classmethod
+    def load(cls, file_name):
+        """Read a library written by save"""
+        with np.load(file_name) as saved:
+            fwhh, peak_function, broadening = saved['settings'].tolist()
+            library = cls(saved['energies'], float(fwhh), peak_function, broadening)
+            library.extend(saved['spectra'], saved['names'].tolist())
+        return library
@@ -0,0 +1,263 @@
+"""Submit many jobs at once, as array jobs where possible, throttled by the depth of the queue"""
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+from configparser import ConfigParser
+
+from .queues import Queues
+
+config_file = os.path.join(os.path.expanduser("~"), '.qgrepconfig')
+config = ConfigParser()
+config.read(config_file)
+
+# Most tasks that may be queued (in the queue being submitted to) before waiting
+MAX_QUEUED = 500
+# Most tasks in a single array job
+CHUNK = 100
+# Seconds between checks of the queue depth while waiting
+POLL = 60
+# Command run in the directory of each input
+COMMAND = 'orca input.dat > output.dat'
+# Parallel environment for SGE
+PE = 'smp'
+if 'submit' in config:
+    MAX_QUEUED = max(config['submit'].getint('max_queued', MAX_QUEUED), 1)
+    CHUNK = max(config['submit'].getint('chunk', CHUNK), 1)
+    POLL = max(config['submit'].getfloat('poll', POLL), 1)
+    COMMAND = config['submit'].get('command', COMMAND)
+    PE = config['submit'].get('pe', PE)
+
+# Directives of the array job script and the command to submit N tasks
+array_directives = {
+    'slurm': ('#SBATCH -J {name}\n#SBATCH -n {nprocs}\n', '#SBATCH -p {queue}\n', ['sbatch', '--array=1-{tasks}']),
+    'sge': ('#$ -N {name}\n#$ -pe ' + PE + ' {nprocs}\n#$ -S /bin/sh\n#$ -cwd\n', '#$ -q {queue}\n', ['qsub', '-t', '1-{tasks}']),
+    'pbs': ('#PBS -N {name}\n#PBS -l nodes=1:ppn={nprocs}\n', '#PBS -q {queue}\n', ['qsub', '-t', '1-{tasks}']),
+}
+
+array_script = """\
+#!/bin/sh
+{directives}
+# Each task runs in the directory on its line of the task file
+TASK=${{SLURM_ARRAY_TASK_ID:-${{SGE_TASK_ID:-$PBS_ARRAYID}}}}
+cd "$(sed -n "${{TASK}}p" {task_file})" || exit 1
+{command}
+"""
+
+
+def read_geom(file_name):
+    """
+    Read the last geometry of an xyz file or an output file (with cclib)
+    :return: geometry formatted for an ORCA input, charge, multiplicity
+    """
+    charge = 0
+    multiplicity = 1
+    if file_name.split('.')[-1] == 'xyz':
+        with open(file_name) as f:
+            lines = f.readlines()
+        # If starting with the number of atoms, skip it and the (possibly blank) comment line
+        if lines and len(lines[0].split()) == 1:
+            lines = lines[2:]
+        lines = [line for line in lines if line.strip()]
+
+        val_form = '    {:<2}' + '  {:> 10.7f}'*3 + '\n'
+        geom = ''
+        for line in lines:
+            atom, x, y, z, *other = line.split()
+            geom += val_form.format(atom, float(x), float(y), float(z))
+        geom = geom[:-1]
+    else:
+        from cclib import ccopen
+
+        data = ccopen(file_name).parse()
+        # Strip the number of atoms and comment lines
+        geom = '    ' + '\n    '.join(data.writexyz().splitlines()[2:])
+        charge = data.charge
+        multiplicity = data.mult
+
+    return geom, charge, multiplicity
+
+
+def input_directories(file_names, base):
+    """
+    Name a directory for the input made from each file, after the file name or,
+    if those are not unique, after its path (e.g. conf1/output.dat -> conf1_output)
+    :param base: directory the directories are made in
+    :return: list of the directories, in the order of the files
+    """
+    names = [os.path.splitext(os.path.basename(file_name))[0] for file_name in file_names]
+    if len(set(names)) < len(names):
+        common = os.path.commonpath([os.path.abspath(file_name) for file_name in file_names])
+        names = [os.path.splitext(os.path.relpath(os.path.abspath(file_name), common))[0].replace(os.sep, '_')
+                 for file_name in file_names]
+    if len(set(names)) < len(names):
+        raise ValueError('Cannot name a directory for each input, the same file was given more than once')
+    return [os.path.join(base, name) for name in names]
+
+
+def write_inputs(inputs, input_name='input.dat'):
+    """
+    Write each input in its own new directory
+    :param inputs: list of (directory, input file contents)
+    :return: list of the directories
+    """
+    directories = []
+    for directory, input_file in inputs:
+        # Fails rather than overwriting an input
+        os.makedirs(directory, exist_ok=False)
+        with open(os.path.join(directory, input_name), 'w') as f:
+            f.write(input_file)
+        directories.append(directory)
+    return directories
+
+
+class BatchSubmitter:
+    """
+    Submits jobs in many directories, as array jobs of at most chunk tasks when
+    the scheduler supports them (otherwise one job at a time with SubmitJob).
+    Before each submission the queue is checked and submission waits until it
+    holds fewer than max_queued tasks (every task of a pending array job counts).
+    """
+    def __init__(self, name='batch', queue=None, nprocs=8, command=COMMAND, max_queued=MAX_QUEUED,
+                 chunk=CHUNK, poll=POLL, array=True, debug=False, queues=None):
+        """
+        :param name: name of the jobs (and of the array job scripts)
+        :param queue: queue to submit to, otherwise the default queue
+        :param nprocs: number of processors of each job
+        :param command: command run in each directory
+        :param max_queued: most tasks queued before waiting, None to never wait
+        :param chunk: most tasks in an array job
+        :param poll: seconds between checks of the queue while waiting
+        :param array: submit array jobs when possible
+        :param debug: generate but don't submit the jobs
+        :param queues: Queues to check the depth with, otherwise they are read
+        """
+        self.name = name
+        self.queue = queue
+        self.nprocs = nprocs
+        self.command = command
+        self.max_queued = max_queued
+        self.chunk = chunk
+        self.poll = poll
+        self.debug = debug
+        self._queues = queues
+        self.array = array
+        self.submitted = []
+        # Queue the scheduler submits to when none is given, found once
+        self._default_queue = None
+
+    def __repr__(self):
+        return '<BatchSubmitter {} ({} submitted)>'.format(self.name, len(self.submitted))
+
+    @property
+    def queues(self):
+        if self._queues is None:
+            self._queues = Queues()
+        return self._queues
+
+    @property
+    def target(self):
+        """The queue being submitted to, None if the scheduler has no default queue"""
+        if self.queue:
+            return self.queue
+        if self._default_queue is None:
+            try:
+                self._default_queue = self.queues.scheduler.default_queue() or ''
+            except Exception:
+                self._default_queue = ''
+        return self._default_queue or None
+
+    def depth(self):
+        """
+        Number of tasks currently queued in the queue being submitted to, or in
+        every queue if the scheduler does not say where jobs go (e.g. SGE)
+        """
+        self.queues.refresh()
+        queues = self.queues.queues
+        target = self.target
+        if target:
+            return queues[target].queued_tasks if target in queues else 0
+        return sum(queue.queued_tasks for queue in queues.values())
+
+    def wait(self, number=1):
+        """
+        Wait until there is room for tasks in the queue, stops waiting
+        altogether if the queue cannot be checked
+        :return: the number of tasks (at most number) that can be submitted
+        """
+        if self.debug or self.max_queued is None:
+            return number
+        while True:
+            try:
+                depth = self.depth()
+            except Exception as e:
+                sys.stderr.write('Cannot check the queue, submitting without waiting: {}\n'.format(e))
+                self.max_queued = None
+                return number
+            room = self.max_queued - depth
+            if room > 0:
+                return min(room, number)
+            time.sleep(self.poll)
+
+    def submit(self, directories):
+        """
+        Submit a job in each directory
+        :return: list of what the submissions printed (or would submit if debugging)
+        """
+        directories = [os.path.abspath(directory) for directory in directories]
+        if len(directories) == 1:
+            # Nothing to throttle, so the scheduler is not queried
+            self.submitted.append(self.submit_job(directories[0]))
+            return self.submitted
+        try:
+            use_array = self.array and self.queues.grid_engine in array_directives
+        except Exception:
+            use_array = False
+        i = 0
+        while i < len(directories):
+            number = self.wait(self.chunk if use_array else 1)
+            if use_array:
+                self.submitted.append(self.submit_array(directories[i:i + number], len(self.submitted)))
+            else:
+                self.submitted.append(self.submit_job(directories[i]))
+            i += number
+        return self.submitted
+
+    def submit_array(self, directories, index=0):
+        """
+        Submit an array job with a task for each directory, the directories are
+        written to a task file named {name}_{index}_{random}.tasks next to its script
+        :param index: number of the array job, to name its files
+        """
+        directives, queue_directive, submit_cmd = array_directives[self.queues.grid_engine]
+        directives = directives.format(name=self.name, nprocs=self.nprocs)
+        if self.queue:
+            directives += queue_directive.format(queue=self.queue)
+
+        # Unique names, as pending tasks of an earlier run may still read their task file
+        fd, task_file = tempfile.mkstemp(suffix='.tasks', prefix='{}_{}_'.format(self.name, index), dir=os.getcwd())
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(directories) + '\n')
+        base = task_file[:-len('.tasks')]
+        script = base + '.sh'
+        with open(script, 'w') as f:
+            f.write(array_script.format(directives=directives.rstrip('\n'), task_file=task_file,
+                                        command=self.command))
+
+        cmd = [arg.format(tasks=len(directories)) for arg in submit_cmd] + [script]
+        if self.debug:
+            return ' '.join(cmd)
+        return subprocess.check_output(cmd).decode('utf-8').strip()
+
+    def submit_job(self, directory):
+        """Submit a single job with SubmitJob (from sq)"""
+        from job_queue import SubmitJob
+
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            return SubmitJob({'debug': self.debug}).submit()
+        finally:
+            os.chdir(cwd)
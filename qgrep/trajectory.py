@@ -0,0 +1,65 @@
+import numpy as np
+
+from .atom import numbers_atomic
+from .molecule import Molecule
+
+
+class Trajectory:
+    """
+    Geometries of multiple steps of the same atoms, stored as a contiguous
+    (nsteps, natoms, 3) array
+    """
+    def __init__(self, atoms, coords):
+        """
+        :param atoms: list of atom names
+        :param coords: array of shape (nsteps, natoms, 3)
+        """
+        self.atoms = list(atoms)
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64)
+        if self.coords.ndim != 3 or self.coords.shape[1:] != (len(self.atoms), 3):
+            raise ValueError('Coordinates must have shape (nsteps, {}, 3), got {}'.format(
+                len(self.atoms), self.coords.shape))
+
+    def __repr__(self):
+        return '<Trajectory {} steps of {} atoms>'.format(*self.coords.shape[:2])
+
+    def __len__(self):
+        """Return the number of steps"""
+        return len(self.coords)
+
+    def __getitem__(self, i):
+        """Returns the ith step as a Molecule"""
+        return Molecule([[atom, list(xyz)] for atom, xyz in zip(self.atoms, self.coords[i])])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def natoms(self):
+        return len(self.atoms)
+
+    @staticmethod
+    def from_cclib(data):
+        """Make a Trajectory from the geometries of a cclib ccData"""
+        return Trajectory([numbers_atomic[atom] for atom in data.atomnos], data.atomcoords)
+
+    def frame(self, i, form='{:2} {:>15.10f} {:>15.10f} {:>15.10f}\n', comment='Step {}'):
+        """
+        A single step in xyz format
+        :param form: format of each atom line
+        :param comment: format of the comment line, filled with the step number
+        """
+        return '{}\n{}\n'.format(self.natoms, comment.format(i)) \
+            + ''.join(form.format(atom, *xyz) for atom, xyz in zip(self.atoms, self.coords[i].tolist()))
+
+    def write_xyz(self, f, form='{:2} {:>15.10f} {:>15.10f} {:>15.10f}\n', comment='Step {}', blank=True):
+        """
+        Write all the steps as a multi-frame xyz, one frame at a time
+        :param f: file handle to write to
+        :param blank: put a blank line after each frame
+        """
+        for i in range(len(self)):
+            f.write(self.frame(i, form, comment))
+            if blank:
+                f.write('\n')
@@ -0,0 +1,103 @@
+import os
+import shutil
+import unittest
+import tempfile
+import numpy as np
+
+from sys import path
+
+path.insert(0, '..')
+
+from cclib.io import ccread
+
+from qgrep import cache
+from qgrep.cache import ParseCache, ccparse
+
+
+class TestCache(unittest.TestCase):
+    """Tests the parse cache"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmpdir, 'output.dat')
+        shutil.copy('orca/Benzene_freqs.out', self.output)
+        self.cache = ParseCache(os.path.join(self.tmpdir, 'cache.sqlite'))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_ccparse(self):
+        data = ccread(self.output)
+        self.assertIsNone(self.cache.get(self.output))
+        parsed = ccparse(self.output, cache=self.cache)
+        cached = self.cache.get(self.output)
+        self.assertEqual(len(self.cache), 1)
+        for cache_data in [parsed, cached]:
+            self.assertEqual(cache_data.metadata['package'], 'ORCA')
+            self.assertEqual(cache_data.natom, data.natom)
+            self.assertEqual(cache_data.freeenergy, data.freeenergy)
+            self.assertTrue(np.array_equal(cache_data.atomcoords[-1], data.atomcoords[-1]))
+            self.assertTrue(np.array_equal(cache_data.vibfreqs, data.vibfreqs))
+            self.assertTrue(np.array_equal(cache_data.homos, data.homos))
+            self.assertEqual(len(cache_data.scfvalues), len(data.scfvalues))
+            self.assertEqual(len(cache_data.moenergies), len(data.moenergies))
+            self.assertFalse(hasattr(cache_data, 'etenergies'))
+
+    def test_invalidate(self):
+        ccparse(self.output, cache=self.cache)
+        with open(self.output, 'a') as f:
+            f.write('\n')
+        self.assertIsNone(self.cache.get(self.output))
+
+    def test_growing(self):
+        # Written to while being parsed
+        key = self.cache.key(self.output)
+        data = ccread(self.output)
+        with open(self.output, 'a') as f:
+            f.write('\n')
+        self.cache.set(self.output, data, key)
+        self.assertIsNone(self.cache.get(self.output))
+
+    def test_prune(self):
+        ccparse(self.output, cache=self.cache)
+        self.cache.max_size = 0
+        self.cache.prune()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_running_total(self):
+        data = ccread(self.output)
+        outputs = []
+        for i in range(4):
+            outputs.append(os.path.join(self.tmpdir, 'output{}.dat'.format(i)))
+            shutil.copy(self.output, outputs[-1])
+        blob = self.cache.set(outputs[0], data)
+        # Room for three and a half parses, pruned down to three
+        self.cache.max_size = 3.5*len(blob)/2**20
+        for output in outputs[1:3]:
+            self.cache.set(output, data)
+        self.assertEqual(self.cache._total, self.cache.size())
+        self.assertEqual(len(self.cache), 3)
+        self.cache.set(outputs[3], data)
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get(outputs[0]))
+        self.assertEqual(self.cache._total, self.cache.size())
+
+    def test_default_cache(self):
+        old = cache.CACHE_FILE
+        cache.CACHE_FILE = os.path.join(self.tmpdir, 'default.sqlite')
+        cache._caches.pop(os.getpid(), None)
+        try:
+            ccparse(self.output)
+            default = cache.default_cache()
+            # Reused by every parse of the process
+            self.assertIs(default, cache.default_cache())
+            self.assertEqual(len(default), 1)
+            default.close()
+        finally:
+            cache._caches.pop(os.getpid(), None)
+            cache.CACHE_FILE = old
+
+
+if __name__ == '__main__':
+    unittest.main()
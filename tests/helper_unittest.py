@@ -11,12 +11,73 @@ from qgrep import helper
 class TestHelper(unittest.TestCase):
 
     def test_convert_energy(self):
-        self.assertEqual(627.509, helper.convert_energy(1, 'hartree', 'kcal/mol'))
+        self.assertAlmostEqual(627.509, helper.convert_energy(1, 'hartree', 'kcal/mol'), 3)
         self.assertAlmostEqual(0.0251223, helper.convert_energy(2.1, '1/cm', 'kJ/mol'), 5)
         self.assertRaises(SyntaxError, helper.convert_energy, 1, 'hart', '1/cm')
         self.assertAlmostEqual(0, sum(np.array([27.21138602, 54.42277204]) - helper.convert_energy([1, 2], 'hartree', 'eV')), 5)
         self.assertAlmostEqual(0, sum([11.7152, 16.3176]) -
                                sum(helper.convert_energy([2.8, 3.9], 'kcal/mol', 'kJ/mol')), 5)
 
+    def test_convert_energy_arrays(self):
+        # Conversions are consistent both ways
+        for in_type in helper.energy_units:
+            for out_type in helper.energy_units:
+                self.assertAlmostEqual(1, helper.convert_energy(helper.convert_energy(1, in_type, out_type), out_type, in_type))
+        data = np.arange(6, dtype=np.float32).reshape(3, 2)
+        self.assertEqual(np.float32, helper.convert_energy(data, 'hartree', 'eV').dtype)
+        self.assertEqual(np.float64, helper.convert_energy(np.arange(3), 'hartree', 'eV').dtype)
+        # In place
+        out = helper.convert_energy(data, 'eV', 'hartree', out=data)
+        self.assertIs(data, out)
+        self.assertAlmostEqual(5/27.21138602, data[2, 1], 6)
+        # A unit for each column
+        mixed = helper.convert_energy(np.ones((2, 3)), ['hartree', 'eV', 'kcal/mol'], 'kJ/mol')
+        np.testing.assert_allclose(mixed[1], [2625.499639, 96.48533, 4.184], rtol=1e-6)
+        self.assertIsInstance(helper.convert_energy([1, 2], 'hartree', 'eV'), np.ndarray)
+        self.assertRaises(SyntaxError, helper.convert_energy, ['a'], 'hartree', 'eV')
+        self.assertRaises(SyntaxError, helper.convert_energy, np.ones(2), ['hartree', 'hart'], 'eV')
+
+    def test_mapped_file(self):
+        with open('psi4_output.dat') as f:
+            lines = f.readlines()
+        mapped = helper.MappedFile('psi4_output.dat')
+        self.assertEqual(lines, list(mapped))
+        self.assertEqual(lines[::-1], list(reversed(mapped)))
+
+    def test_last_match(self):
+        with open('psi4_output.dat') as f:
+            lines = f.readlines()
+        mapped = helper.MappedFile('psi4_output.dat')
+        line = '    Total Energy =                        -74.9663802481987886\n'
+        self.assertEqual(line, helper.last_match(lines, '    Total Energy ='))
+        self.assertEqual(line, helper.last_match(mapped, '    Total Energy ='))
+        self.assertIsNone(helper.last_match(mapped, 'Not in the file'))
+
+    def test_parallel_map(self):
+        inputs = list(range(-20, 20))
+        self.assertEqual(list(map(abs, inputs)), list(helper.parallel_map(abs, inputs)))
+        self.assertEqual(list(map(abs, inputs)), list(helper.parallel_map(abs, inputs, jobs=3)))
+        # One process per CPU
+        self.assertEqual(list(map(abs, inputs)), list(helper.parallel_map(abs, inputs, jobs=0)))
+
+    def test_check_program(self):
+        self.assertEqual('orca', helper.check_program('orca/Benzene_freqs.out'))
+        self.assertEqual('psi4', helper.check_program('psi4_output.dat'))
+        self.assertEqual('qchem', helper.check_program('qchem_output.dat'))
+        self.assertEqual('cfour', helper.check_program('cfour/h2o.out'))
+        self.assertEqual('gamess', helper.check_program('gamess/CH2_opt.out'))
+        self.assertEqual('nbo', helper.check_program('population/nbo/H2O.nbo'))
+        self.assertIsNone(helper.check_program('orca/Benzene_freqs.inp'))
+        # Cached
+        self.assertEqual('orca', helper.check_program('orca/Benzene_freqs.out'))
+
+    def test_find_input_program(self):
+        self.assertEqual('orca', helper.find_input_program('orca/Benzene_freqs.inp'))
+        self.assertEqual('cfour', helper.find_input_program('cfour/h2o.ZMAT'))
+        self.assertEqual('gamess', helper.find_input_program('gamess/CH2_opt.inp'))
+        self.assertEqual('nbo', helper.find_input_program('population/nbo/H2O.47'))
+        self.assertIsNone(helper.find_input_program('cfour/h2o.xyz'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,16 @@
+import io
+import os
 import unittest
+import tempfile
+import numpy as np
 
 from sys import path
 
 path.insert(0, '../..')
 
 from qgrep import orca
+from qgrep.convergence import Convergence, Step, step_dtype
+from qgrep.helper import read
 
 
 class TestOrca(unittest.TestCase):
@@ -44,6 +50,37 @@ class TestOrca(unittest.TestCase):
         self.assertEqual(len(checklist), 74)
         self.assertEqual(checklist[-1], ''.join(self.files['CH3F_Cl_scan.check']))
 
+    def test_convergence(self):
+        """Testing convergence"""
+        conv = orca.convergence('CH3F_Cl_scan.out')
+        self.assertEqual(len(conv.steps), 74)
+        self.assertEqual(conv.criteria, [0.00003, 0.0005, 0.002, 0.007, 0.01])
+        first, last = conv.steps[0], conv.steps[-1]
+        self.assertEqual([first.delta_e, first.rms_grad, first.scf_steps], [0, 0.47945491, 18])
+        self.assertEqual([last.delta_e, last.rms_grad, last.max_grad, last.rms_step, last.max_step],
+                         [-0.00003171, 0.00010478, 0.00024295, 0.00607771, 0.01266595])
+        follower = orca.Follower('CH3F_Cl_scan.out')
+        follower_steps = [value for kind, value in follower.update() if kind == 'step']
+        self.assertEqual([step.params for step in conv.steps],
+                         [step.params for step in follower_steps])
+        self.assertEqual(orca.convergence('Benzene_freqs.inp').steps, [])
+        # Parsed steps are views of the rows of the Convergence they are appended to
+        self.assertIs(follower_steps[-1]._convergence, follower.convergence())
+        self.assertEqual(str(follower_steps[-1]), str(last))
+        self.assertEqual(str(Step(first.params)), ' 0.00e+00  4.79e-01  1.97e+00  7.28e-02  2.97e-01 |     18')
+        # Appending to a Convergence made from an empty array
+        empty = Convergence(np.zeros(0, step_dtype))
+        empty.append(first)
+        empty.append(first.params)
+        self.assertEqual([step.params for step in empty], [first.params]*2)
+        # Columns are views of the structured array
+        self.assertEqual(conv.rms_grad.base is not None, True)
+        self.assertEqual(conv.rms_grad[-1], last.rms_grad)
+        self.assertEqual(list(conv.scf_steps[:1]), [18])
+        conv.append(first)
+        self.assertEqual(len(conv), 75)
+        self.assertEqual(conv[-1].params, first.params)
+
     def test_get_energy(self):
         """Testing get_energy"""
         energy = orca.get_energy(self.files['CH3F_Cl_scan.out'])
@@ -64,11 +101,34 @@ class TestOrca(unittest.TestCase):
         self.assertEqual(benzene_freqs, ''.join(self.files['Benzene_freqs.freqs']))
         self.assertEqual(H2O_freqs, ''.join(self.files['H2O_hybrid_hess.freqs']))
 
+    def test_normal_modes(self):
+        """Testing normal_modes"""
+        vibs = orca.normal_modes(self.files['Benzene_freqs.out'])
+        self.assertEqual(vibs.shape, (36,))
+        self.assertEqual(vibs['disp'].shape, (36, 12, 3))
+        self.assertEqual(list(vibs['freq'][5:8]), [0, 401.64, 412.58])
+        self.assertEqual(vibs['ir'][10], 82.744698)
+        self.assertEqual(list(vibs['disp'][6][1]), [-0.007796, 0.000938, -0.242215])
+        vibs = orca.normal_modes(self.files['H2O_hybrid_hess.out'])
+        self.assertEqual(list(vibs['ir'][6:]), [68.739825, 1.091436, 21.094117])
+        self.assertIsNone(orca.normal_modes(self.files['CH3F_Cl_scan.out']))
+
     def test_plot(self):
         """Testing plot"""
         geoms = orca.plot(self.files['CH3F_Cl_scan.out'])
         self.assertEqual('\n'.join(geoms), ''.join(self.files['CH3F_Cl_scan.plot']))
 
+    def test_trajectory(self):
+        """Testing trajectory"""
+        traj = orca.trajectory(self.files['CH3F_Cl_scan.out'])
+        self.assertEqual(traj.coords.shape, (len(orca.plot(self.files['CH3F_Cl_scan.out'])), 6, 3))
+        self.assertEqual(traj.atoms, ['C', 'Cl', 'H', 'H', 'H', 'F'])
+        self.assertEqual(list(traj.coords[0, 1]), [-0.482478, -0.437225, -0.000034])
+        f = io.StringIO()
+        traj.write_xyz(f, '{}\t{:.6f}\t{:.6f}\t{:.6f}\n', blank=False)
+        self.assertEqual(f.getvalue(), ''.join(orca.plot(self.files['CH3F_Cl_scan.out'])))
+        self.assertIsNone(orca.trajectory(self.files['CH3F_Cl_scan.xyz']))
+
     def test_convert_zmatrix(self):
         zmat = orca.convert_zmatrix(self.files['CH3F_Cl_scan.out'], 'angstrom')
         self.assertEqual(['\t'.join(line) + '\n' for line in zmat],
@@ -96,6 +156,18 @@ H      -2.14677300    0.52045900    0.36334300
 F      -3.76420600   -0.44266200    0.03854700'''
         self.assertEqual(molecule, str(orca.get_molecule(self.files['CH3F_Cl_scan.out'])))
 
+    def test_orbital_energies(self):
+        """Testing orbital_energies"""
+        energies, homos = orca.orbital_energies(self.files['Benzene_freqs.out'])
+        self.assertEqual(energies.shape, (1, 96))
+        self.assertEqual(homos, [20])
+        self.assertEqual(list(energies[0, homos[0]:homos[0] + 2]), [-0.242627, 0.00677])
+        # Unrestricted
+        energies, homos = orca.orbital_energies(orca.index_file('H2O_hybrid_hess.out'))
+        self.assertEqual(energies.shape, (2, 18))
+        self.assertEqual(homos, [4, 4])
+        self.assertEqual(orca.orbital_energies(self.files['Benzene_freqs.freqs']), (None, None))
+
     def test_get_charge(self):
         self.assertEqual(orca.get_charge(self.files['Benzene_freqs.out']), 0)
         self.assertEqual(orca.get_charge(self.files['CH3F_Cl_scan.out']), -1)
@@ -104,6 +176,94 @@ F      -3.76420600   -0.44266200    0.03854700'''
         self.assertTrue(orca.completed(self.files['Benzene_freqs.out']))
         self.assertTrue(orca.completed(self.files['CH3F_Cl_scan.out']))
 
+    def test_index_file(self):
+        """Testing that an OutputIndex gives the same results as the lines"""
+        for out in ['CH3F_Cl_scan.out', 'Benzene_freqs.out', 'H2O_hybrid_hess.out']:
+            index = orca.index_file(out)
+            lines = self.files[out]
+            for geom_type in ['xyz', 'zmat']:
+                for units in ['angstrom', 'bohr']:
+                    self.assertEqual(orca.get_geom(lines, geom_type, units),
+                                     orca.get_geom(index, geom_type, units))
+            self.assertEqual(orca.plot(lines), orca.plot(index))
+            self.assertEqual(orca.check_convergence(lines), orca.check_convergence(index))
+            self.assertEqual(orca.get_energy(lines), orca.get_energy(index))
+            self.assertEqual(orca.get_energies(lines), orca.get_energies(index))
+            self.assertEqual(orca.energy_levels(lines), orca.energy_levels(index))
+            self.assertEqual(orca.get_charge(lines), orca.get_charge(index))
+            self.assertEqual(orca.get_multiplicity(lines), orca.get_multiplicity(index))
+            self.assertEqual(orca.completed(lines), orca.completed(index))
+        self.assertEqual(orca.get_freqs(orca.index_file('Benzene_freqs.out')),
+                         ''.join(self.files['Benzene_freqs.freqs']))
+        self.assertEqual(orca.get_freqs(orca.index_file('H2O_hybrid_hess.out')),
+                         ''.join(self.files['H2O_hybrid_hess.freqs']))
+
+    def test_mapped(self):
+        """Testing a MappedFile gives the same results as the lines"""
+        for out in ['CH3F_Cl_scan.out', 'Benzene_freqs.out']:
+            mapped, program = read(out, mapped=True)
+            lines = self.files[out]
+            self.assertEqual(program, 'orca')
+            self.assertEqual(orca.get_geom(lines), orca.get_geom(mapped))
+            self.assertEqual(orca.get_energy(lines), orca.get_energy(mapped))
+            self.assertEqual(orca.get_energies(lines), orca.get_energies(mapped))
+            self.assertEqual(orca.get_charge(lines), orca.get_charge(mapped))
+            self.assertEqual(orca.get_multiplicity(lines), orca.get_multiplicity(mapped))
+            self.assertEqual(orca.energy_levels(lines), orca.energy_levels(mapped))
+            self.assertEqual(orca.completed(lines), orca.completed(mapped))
+        mapped = read('Benzene_freqs.out', mapped=True)[0]
+        self.assertEqual(orca.get_freqs(mapped), ''.join(self.files['Benzene_freqs.freqs']))
+
+    def test_follower(self):
+        """Testing Follower with an output that is written in chunks"""
+        lines = self.files['CH3F_Cl_scan.out']
+        with tempfile.TemporaryDirectory() as tmpdir:
+            out = os.path.join(tmpdir, 'output.dat')
+            follower = orca.Follower(out)
+            self.assertEqual(list(follower.update()), [])
+            events = []
+            with open(out, 'w') as f:
+                # Chunks that split lines
+                data = ''.join(lines)
+                for i in range(0, len(data), 100003):
+                    f.write(data[i:i + 100003])
+                    f.flush()
+                    events += list(follower.update())
+        energies = [value for kind, value in events if kind == 'energy']
+        steps = [value for kind, value in events if kind == 'step']
+        self.assertEqual(orca.get_energies(lines), energies)
+        self.assertEqual(follower.energies, energies)
+        self.assertEqual(len(orca.check_convergence(lines)), len(steps))
+        self.assertTrue(follower.completed)
+        self.assertEqual(steps[0].delta_e, 0)
+        self.assertEqual(steps[0].scf_steps, 18)
+        last = steps[-1]
+        self.assertEqual([last.delta_e, last.rms_grad, last.max_grad, last.rms_step, last.max_step],
+                         [-0.00003171, 0.00010478, 0.00024295, 0.00607771, 0.01266595])
+        self.assertEqual(follower.criteria, [0.00003, 0.0005, 0.002, 0.007, 0.01])
+        self.assertEqual(len(follower.convergence().steps), len(steps))
+        self.assertEqual([step.scf_steps for step in steps],
+                         [step.scf_steps for step in orca.convergence('CH3F_Cl_scan.out').steps])
+
+    def test_follow_failed(self):
+        """Testing following stops for jobs that failed or stopped writing"""
+        lines = self.files['CH3F_Cl_scan.out']
+        with tempfile.TemporaryDirectory() as tmpdir:
+            out = os.path.join(tmpdir, 'output.dat')
+            with open(out, 'w') as f:
+                f.writelines(lines[:len(lines)//2])
+            # Killed, so neither completed nor failed
+            events = list(orca.follow(out, interval=0.01, max_wait=0.05))
+            self.assertEqual(len([kind for kind, value in events if kind == 'step']), len(orca.convergence(out).steps))
+            with open(out, 'a') as f:
+                f.write('ORCA finished by error termination in SCF\n')
+            follower = orca.Follower(out)
+            list(follower.update())
+            self.assertFalse(follower.completed)
+            self.assertTrue(follower.finished)
+            self.assertEqual(follower.error, 'ORCA finished by error termination in SCF')
+            self.assertEqual(len(list(orca.follow(out, interval=0.01))), len(events))
+
 
 if __name__ == '__main__':
     unittest.main()
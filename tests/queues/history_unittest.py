@@ -0,0 +1,114 @@
+import io
+import os
+import json
+import unittest
+import tempfile
+
+from contextlib import redirect_stderr
+
+from sys import path
+
+path.insert(0, '../..')
+
+from qgrep.queues import Queues
+from qgrep.history import QueueHistory
+from qgrep.schedulers import Recorded
+
+
+def squeue(file_name, jobs):
+    """Write squeue --json output for a list of (id, state, partition, user)"""
+    with open(file_name, 'w') as f:
+        json.dump({'jobs': [{'job_id': jid, 'job_state': state, 'name': 'job', 'partition': partition,
+                             'user_name': user} for jid, state, partition, user in jobs]}, f)
+
+
+class TestHistory(unittest.TestCase):
+    """Tests recording and analyzing the queues"""
+
+    def test_history(self):
+        """Testing recording and querying the history"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs_file = os.path.join(tmp_dir, 'squeue.json')
+            history_file = os.path.join(tmp_dir, 'history.sqlite')
+            sizes = {'gen3': 2, 'gen4': 4}
+            polls = [
+                [(1, 'PENDING', 'gen4', 'alice'), (2, 'RUNNING', 'gen3', 'bob')],
+                [(1, 'RUNNING', 'gen4', 'alice'), (2, 'RUNNING', 'gen3', 'bob'), (3, 'PENDING', 'gen4', 'bob')],
+                [(3, 'RUNNING', 'gen4', 'bob')],
+                [],
+            ]
+            history = QueueHistory(history_file)
+            squeue(jobs_file, polls[0])
+            queues = Queues(scheduler=Recorded(jobs_file, sizes))
+            for i, jobs in enumerate(polls):
+                squeue(jobs_file, jobs)
+                queues.refresh()
+                history.record(queues, now=1000*i)
+            history.close()
+
+            # Reopening continues from the recorded jobs
+            history = QueueHistory(history_file)
+            self.assertEqual(history.jobs, {})
+            self.assertEqual(history.wait_times(), {'gen4': (1000, 2)})
+            self.assertEqual(history.throughput(), {'bob': 2, 'alice': 1})
+            self.assertEqual(history.throughput(since=3000), {'bob': 1})
+            # gen3 ran one of its two slots for 2000 s of 3000 s
+            utilization = history.utilization()
+            self.assertAlmostEqual(utilization['gen3'], 1/3)
+            self.assertAlmostEqual(utilization['gen4'], 2/12)
+            self.assertEqual(history.utilization_series('gen3', bucket=1500),
+                             [(0, 0.5), (1500, 1/6)])
+            history.close()
+
+    def test_array(self):
+        """Testing the pending tasks of an array job are not recorded as finishing when they start"""
+        def array(task_string, started):
+            """The pending tasks of array job 500 and the tasks that started"""
+            jobs = [{'array_job_id': 500, 'array_task_id': task, 'job_id': 600 + task, 'job_state': 'RUNNING',
+                     'name': 'conf', 'partition': 'gen4', 'user_name': 'alice'} for task in started]
+            if task_string:
+                jobs.append({'array_job_id': 500, 'array_task_id': None, 'array_task_string': task_string,
+                             'job_id': 500, 'job_state': 'PENDING', 'name': 'conf', 'partition': 'gen4',
+                             'user_name': 'alice'})
+            return {'jobs': jobs}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs_file = os.path.join(tmp_dir, 'squeue.json')
+            history = QueueHistory(os.path.join(tmp_dir, 'history.sqlite'))
+            polls = [array('1-3', []), array('2-3', [1]), array('', [1, 2, 3]), array('', [])]
+            with open(jobs_file, 'w') as f:
+                json.dump(polls[0], f)
+            queues = Queues(scheduler=Recorded(jobs_file, {'gen4': 4}))
+            for i, jobs in enumerate(polls[:3]):
+                with open(jobs_file, 'w') as f:
+                    json.dump(jobs, f)
+                queues.refresh()
+                history.record(queues, now=100*i)
+            self.assertEqual(history.throughput(), {})
+            # The pending record is named after the next task to start, so that task's wait is known
+            self.assertEqual(history.wait_times(), {'gen4': (100, 2)})
+            with open(jobs_file, 'w') as f:
+                json.dump(polls[3], f)
+            queues.refresh()
+            history.record(queues, now=300)
+            self.assertEqual(history.throughput(), {'alice': 3})
+            history.close()
+
+    def test_failures(self):
+        """Testing recording through failures of the scheduler"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs_file = os.path.join(tmp_dir, 'squeue.json')
+            history = QueueHistory(os.path.join(tmp_dir, 'history.sqlite'))
+            squeue(jobs_file, [(1, 'RUNNING', 'gen3', 'alice')])
+            queues = Queues(scheduler=Recorded(jobs_file, {'gen3': 2}))
+            os.remove(jobs_file)
+            err = io.StringIO()
+            with redirect_stderr(err):
+                history.run(queues, interval=0.01, duration=0.05)
+            self.assertIn('Could not sample the queues', err.getvalue())
+            self.assertEqual(list(history.jobs), ['1'])
+            history.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
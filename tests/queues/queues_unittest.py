@@ -0,0 +1,153 @@
+import os
+import stat
+import unittest
+import tempfile
+
+from sys import path
+
+path.insert(0, '../..')
+
+from qgrep import queues
+from qgrep.queues import Queues, diff_jobs, redraw
+from qgrep.schedulers import Recorded
+
+
+class TestQueues(unittest.TestCase):
+    """Tests reading saved qstat output"""
+
+    def test_sge(self):
+        """Testing replaying SGE xml"""
+        queues = Queues(omit=['debug.q'], xml_file='sge.xml', sizes={'gen3.q': 16})
+        self.assertEqual(queues.grid_engine, 'sge')
+        self.assertEqual(list(queues.queues), ['gen3.q', 'gen4.q'])
+        gen4 = queues.queues['gen4.q']
+        self.assertEqual(list(gen4.running), [113300, (113301, 3)])
+        self.assertEqual(list(gen4.queueing), [112742])
+        self.assertEqual(gen4.queueing[112742].owner, 'meghaanand')
+        # Sizes default to the number of running jobs
+        self.assertEqual(queues.sizes, {'gen3.q': 16, 'gen4.q': 2})
+        self.assertEqual(queues.queues['gen3.q'].avail, 15)
+        # Tasks of array jobs never share an id, and are sorted by task
+        gen4.set((113301, 10), gen4.running[(113301, 3)], 'running')
+        gen4.set((113301, 1), gen4.running[(113301, 3)], 'running')
+        self.assertEqual(list(gen4.running), [113300, (113301, 3), (113301, 10), (113301, 1)])
+        self.assertEqual(list(gen4.jobs)[:4], [113300, (113301, 1), (113301, 3), (113301, 10)])
+        self.assertIn(' 113301 ', str(gen4.running[(113301, 3)]))
+
+    def test_pbs(self):
+        """Testing replaying PBS xml"""
+        queues = Queues(xml_file='pbs.xml')
+        self.assertEqual(queues.grid_engine, 'pbs')
+        self.assertEqual(list(queues.queues), ['batch'])
+        batch = queues.queues['batch']
+        self.assertEqual(list(batch.running), [77816])
+        self.assertEqual(list(batch.queueing), [(77820, 2)])
+        self.assertEqual(batch.running[77816].workdir, '/home/sivalingam/s4')
+        self.assertEqual(batch.queueing[(77820, 2)].owner, 'mullinax')
+
+    def test_slurm(self):
+        """Testing replaying Slurm json"""
+        queues = Queues(scheduler=Recorded('slurm.json', 'slurm.sinfo'))
+        self.assertEqual(queues.grid_engine, 'slurm')
+        # Sizes and usage are both CPUs
+        self.assertEqual(queues.sizes, {'gen3': 256, 'gen4': 128})
+        self.assertEqual(list(queues.queues), ['gen4', 'gen3'])
+        gen4 = queues.queues['gen4']
+        self.assertEqual(list(gen4.running), [4242, (4250, 7)])
+        self.assertEqual(gen4.running[(4250, 7)].workdir, '/home/meghaanand/conformers')
+        self.assertEqual((gen4.used, gen4.avail), (10, 118))
+        freq = queues.queues['gen3'].queueing[4300]
+        self.assertEqual([freq.state, freq.owner], ['pd', 'mullinax'])
+
+    def test_jobs_view(self):
+        """Testing the views of the jobs of a queue"""
+        gen4 = Queues(xml_file='sge.xml').queues['gen4.q']
+        jobs = gen4.jobs
+        self.assertEqual(list(jobs), [113300, (113301, 3), 112742])
+        self.assertEqual(list(gen4.person_jobs('meghaanand')), [113300, 112742])
+        self.assertEqual(len(gen4.person_jobs('mullinax')), 1)
+        self.assertNotIn(113300, gen4.person_jobs('mullinax'))
+        # Views follow the queue
+        gen4.set(1, gen4.running[113300], 'running')
+        self.assertEqual(list(jobs)[:2], [1, 113300])
+        self.assertIs(jobs[1].owner, gen4.queueing[112742].owner)
+
+    def test_diff_jobs(self):
+        """Testing diff_jobs"""
+        old = Queues(xml_file='sge.xml').jobs
+        new = Queues(xml_file='sge.xml').jobs
+        self.assertFalse(diff_jobs(old, new))
+        del new[113254]
+        new[112742].state = 'r'
+        diff = diff_jobs(old, new)
+        self.assertEqual(diff.removed, [113254])
+        self.assertEqual(diff.changed, [112742])
+        self.assertEqual(diff.added, [])
+
+    def test_render(self):
+        """Testing reusing the formatted jobs between prints"""
+        queues = Queues(xml_file='sge.xml', sizes={'gen3.q': 16, 'gen4.q': 8, 'debug.q': 2})
+        out = queues.print()
+        cells = queues.renderer.cells
+        self.assertEqual(set(cells), set(queues.jobs))
+        self.assertEqual(queues.print(), out)
+        # Unchanged jobs are not formatted again
+        self.assertIs(queues.renderer.cells[113300][3], cells[113300][3])
+        queues.queues['gen4.q'].queueing[112742].state = 'r'
+        changed = queues.print()
+        self.assertIsNot(queues.renderer.cells[112742][3], cells[112742][3])
+        self.assertEqual([a == b for a, b in zip(out.split('\n'), changed.split('\n'))].count(False), 1)
+        # Only jobs shown are kept (small queues show all of their jobs)
+        queues.print(numjobs=0)
+        self.assertEqual(list(queues.renderer.cells), [112750])
+
+    def test_empty_queue(self):
+        """Testing queues without any jobs are still shown"""
+        queues = Queues(xml_file='sge.xml', sizes={'gen3.q': 16, 'gen4.q': 8, 'gen5.q': 4, 'debug.q': 2})
+        self.assertEqual(len(queues.queues['gen5.q']), 0)
+        lines = queues.print().split('\n')
+        self.assertIn('gen5.q ( 0/ 4/ 0)', lines[1])
+        # Every row of the table has a column for each large queue
+        self.assertEqual([lines[i].count('│') for i in (1, 3, 5)], [4]*3)
+        self.assertEqual(lines[0].count('┬'), 2)
+
+    def test_redraw(self):
+        """Testing only rewriting changed lines"""
+        self.assertEqual(redraw(['a', 'b', 'c'], ['a', 'b', 'd']), '\033[3F\033[2E\033[2Kd\n\033[J')
+        self.assertEqual(redraw(['a', 'b'], ['x', 'b']), '\033[2F\033[2Kx\n\033[1E\033[J')
+        self.assertEqual(redraw([], ['a']), '\033[2Ka\n\033[J')
+
+    def test_live(self):
+        """Testing querying a (fake) PBS scheduler"""
+        xml_file = os.path.abspath('pbs.xml')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            commands = {
+                # SGE flags are not understood
+                'qstat': '[ "$1" = "-x" ] && cat {} || exit 2'.format(xml_file),
+                'pbsnodes': 'printf "node1\\n    properties = batch\\n\\nnode2\\n    properties = big\\n"',
+            }
+            for command, script in commands.items():
+                file_name = os.path.join(tmp_dir, command)
+                with open(file_name, 'w') as f:
+                    f.write('#!/bin/sh\n' + script + '\n')
+                os.chmod(file_name, stat.S_IRWXU)
+
+            old_path, old_cache = os.environ['PATH'], queues.GRID_ENGINE_CACHE
+            os.environ['PATH'] = tmp_dir + os.pathsep + old_path
+            queues.GRID_ENGINE_CACHE = os.path.join(tmp_dir, 'grid_engine.json')
+            try:
+                live = Queues()
+                self.assertEqual(live.grid_engine, 'pbs')
+                self.assertEqual(queues.cached_grid_engine(), 'pbs')
+                self.assertEqual(live.sizes, {'batch': 2})
+                self.assertEqual(sorted(live.latency), ['pbsnodes', 'qstat -x -t'])
+                self.assertFalse(diff_jobs(Queues(xml_file='pbs.xml').jobs, live.jobs))
+                # Uses the cached grid engine
+                self.assertEqual(Queues().grid_engine, 'pbs')
+            finally:
+                os.environ['PATH'] = old_path
+                queues.GRID_ENGINE_CACHE = old_cache
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import json
+import stat
+import unittest
+import tempfile
+
+from glob import glob
+from sys import path
+
+path.insert(0, '../..')
+
+from qgrep.queues import Queues
+from qgrep.schedulers import Recorded, Slurm, count_tasks
+from qgrep.submit import BatchSubmitter, input_directories, read_geom, write_inputs
+
+
+class TestSubmit(unittest.TestCase):
+    """Tests writing and submitting batches of jobs"""
+
+    def test_read_geom(self):
+        """Testing reading an xyz geometry"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'water.xyz')
+            with open(file_name, 'w') as f:
+                f.write('3\nwater\nO 0 0 0\nH 0 0 0.96\nH 0.93 0 -0.24\n\n')
+            geom, charge, multiplicity = read_geom(file_name)
+        self.assertEqual(geom.splitlines()[1], '    H    0.0000000   0.0000000   0.9600000')
+        self.assertEqual(len(geom.splitlines()), 3)
+        self.assertEqual((charge, multiplicity), (0, 1))
+        # A blank comment line
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'water.xyz')
+            with open(file_name, 'w') as f:
+                f.write('3\n\nO 0 0 0\nH 0 0 0.96\nH 0.93 0 -0.24\n')
+            geom, charge, multiplicity = read_geom(file_name)
+        self.assertEqual(len(geom.splitlines()), 3)
+        self.assertEqual(geom.splitlines()[0], '    O    0.0000000   0.0000000   0.0000000')
+
+    def test_input_directories(self):
+        """Testing naming a unique directory for each input"""
+        self.assertEqual(input_directories(['a.xyz', 'b/b.xyz'], 'opt'), ['opt/a', 'opt/b'])
+        self.assertEqual(input_directories(['conf1/output.dat', 'conf2/output.dat'], 'opt'),
+                         ['opt/conf1_output', 'opt/conf2_output'])
+        self.assertRaises(ValueError, input_directories, ['a.xyz', 'a.xyz'], 'opt')
+
+    def test_count_tasks(self):
+        """Testing counting the tasks of array jobs"""
+        self.assertEqual(count_tasks('7'), 1)
+        self.assertEqual(count_tasks('1-100'), 100)
+        self.assertEqual(count_tasks('17-78:2'), 31)
+        self.assertEqual(count_tasks('1,3'), 2)
+        self.assertEqual(count_tasks('1,5-7%2'), 4)
+
+    def test_array(self):
+        """Testing submitting (fake) Slurm array jobs throttled by the queue depth"""
+        with open('slurm.json') as f:
+            squeue = json.load(f)
+        # An array job none of whose 10 tasks have started
+        squeue['jobs'].append({'array_job_id': 4400, 'array_task_id': None, 'array_task_string': '1-10%2',
+                               'job_id': 4400, 'job_state': 'PENDING', 'name': 'conf', 'partition': 'gen3',
+                               'user_name': 'mullinax'})
+        slurm_sinfo = os.path.abspath('slurm.sinfo')
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            slurm_json = os.path.join(tmp_dir, 'squeue.json')
+            with open(slurm_json, 'w') as f:
+                json.dump(squeue, f)
+            commands = {
+                'sbatch': 'echo "$@" >> sbatch.log\necho Submitted batch job 1',
+                'sinfo': 'printf "gen3\\ngen4*\\n"',
+            }
+            for command, script in commands.items():
+                with open(command, 'w') as f:
+                    f.write('#!/bin/sh\n' + script + '\n')
+                os.chmod(command, stat.S_IRWXU)
+            old_path = os.environ['PATH']
+            os.environ['PATH'] = tmp_dir + os.pathsep + old_path
+            try:
+                inputs = [('conf{}'.format(i), 'input {}'.format(i)) for i in range(5)]
+                directories = write_inputs(inputs)
+                with open('conf3/input.dat') as f:
+                    self.assertEqual(f.read(), 'input 3')
+
+                queues = Queues(scheduler=Recorded(slurm_json, slurm_sinfo))
+                self.assertEqual(Slurm().default_queue(), 'gen4')
+                # Recorded output does not know the default queue, so every queue is counted
+                self.assertIsNone(BatchSubmitter(queues=queues).target)
+                self.assertEqual(BatchSubmitter(queues=queues).depth(), 11)
+                # Every task of the pending array job counts
+                depth = queues.queues['gen3'].queued_tasks
+                self.assertEqual(depth, 11)
+                # Room for two jobs at a time
+                submitter = BatchSubmitter('conf', queue='gen3', max_queued=depth + 2, queues=queues)
+                self.assertEqual(submitter.depth(), depth)
+                self.assertEqual(submitter.submit(directories), ['Submitted batch job 1']*3)
+                with open('sbatch.log') as f:
+                    calls = f.read().split('\n')
+                scripts = [call.split()[1] for call in calls if call]
+                self.assertEqual([call.split()[0] for call in calls if call], ['--array=1-2']*2 + ['--array=1-1'])
+                self.assertTrue(os.path.basename(scripts[2]).startswith('conf_2_'))
+                with open(scripts[1][:-len('.sh')] + '.tasks') as f:
+                    self.assertEqual(f.read().split(), [os.path.abspath('conf2'), os.path.abspath('conf3')])
+                with open(scripts[0]) as f:
+                    script = f.read()
+                self.assertIn('#SBATCH -p gen3\n', script)
+                self.assertIn('#SBATCH -n 8\n', script)
+                # Stops waiting if the queue cannot be checked
+                broken = BatchSubmitter(max_queued=1, queues=queues)
+                broken.depth = lambda: 1/0
+                self.assertEqual(broken.wait(5), 5)
+                self.assertIsNone(broken.max_queued)
+                # Submitting again does not overwrite the task files of the first run
+                BatchSubmitter('conf', debug=True, queues=queues).submit(directories[:2])
+                self.assertEqual(len(glob('conf_0_*.tasks')), 2)
+            finally:
+                os.environ['PATH'] = old_path
+                os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    unittest.main()
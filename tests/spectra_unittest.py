@@ -0,0 +1,206 @@
+import os
+import unittest
+import tempfile
+import numpy as np
+
+from sys import path
+
+path.insert(0, '..')
+
+from qgrep.spectra import (BoltzmannSpectra, ConformerEnsemble, Spectra, SpectraLibrary, SpectralDifference, SpectralSum,
+                           batch_spectra, boltzmann_weights, broaden, broaden_fft, fft_error, gen_spectra, peak_functions,
+                           read_conformer, read_transitions, save_spectra, shared_grid, spectra_matrix, voigt_profile)
+
+
+class TestSpectra(unittest.TestCase):
+    """Tests broadening transitions into spectra"""
+
+    def setUp(self):
+        rng = np.random.RandomState(7)
+        self.energies = np.sort(rng.uniform(2, 8, 100))
+        self.intensities = rng.uniform(0, 1, 100)
+        self.xs = np.linspace(1, 9, 1001)
+
+    def loop(self, name, width):
+        """The spectrum from the peak functions, one point at a time"""
+        peaks = [peak_functions[name](e, i, width) for e, i in zip(self.energies, self.intensities)]
+        return np.array([sum(peak(x) for peak in peaks) for x in self.xs])
+
+    def test_broaden(self):
+        """Testing broadening matches the peak functions"""
+        for name in ['gaussian', 'lorentzian', 'voigt']:
+            ys = broaden(self.xs, self.energies, self.intensities, 0.1, name)
+            np.testing.assert_allclose(ys, self.loop(name, 0.1), rtol=1e-10, atol=1e-12)
+            # Chunks of a few transitions give the same spectrum
+            np.testing.assert_allclose(broaden(self.xs, self.energies, self.intensities, 0.1, name, chunk_size=3000), ys)
+        self.assertEqual(broaden(self.xs, [], [], 0.1).tolist(), [0]*1001)
+        # Transitions off the grid
+        self.assertEqual(broaden(self.xs, [20], [1], 0.1).max(), 0)
+
+    def test_broaden_fft(self):
+        """Testing broadening with FFTs is close to the peak functions"""
+        for name in ['gaussian', 'lorentzian']:
+            ys = broaden_fft(self.xs, self.energies, self.intensities, 0.1, name)
+            exact = self.loop(name, 0.1)
+            # The error of binning falls with the square of the spacing of the grid
+            self.assertLess(np.abs(ys - exact).max()/exact.max(), 1e-2)
+            fine = np.linspace(1, 9, 4001)
+            self.assertLess(fft_error(fine, self.energies, self.intensities, 0.1, name, sample=20), 1e-3)
+        # Transitions just off the grid still contribute
+        off = broaden_fft(self.xs, [9.2], [1], 0.1)
+        np.testing.assert_allclose(off, broaden(self.xs, [9.2], [1], 0.1), atol=1e-3)
+        self.assertRaises(ValueError, broaden_fft, self.xs**2, self.energies, self.intensities, 0.1)
+
+    def test_voigt(self):
+        """Testing the Voigt profile is normalized and tends to its limits"""
+        xs = np.linspace(-200, 200, 400001)
+        dx = xs[1] - xs[0]
+        self.assertAlmostEqual(voigt_profile(xs, 0, 0.5).sum()*dx, 1, 2)
+        gaussian = np.exp(-xs**2/2)/np.sqrt(2*np.pi)
+        np.testing.assert_allclose(voigt_profile(xs, 0, 1, gamma=1e-8), gaussian, atol=1e-6)
+
+    def test_spectrum(self):
+        """Testing the spectrum of a Spectra"""
+        spectra = Spectra(self.energies, self.intensities, 'random')
+        xs, ys = spectra.spectrum(npoints=1001, fwhh=0.1)
+        self.assertEqual(len(xs), 1001)
+        self.assertAlmostEqual(xs[0], self.energies[0] - (self.energies[-1] - self.energies[0])/10)
+        np.testing.assert_allclose(ys, broaden(xs, self.energies, self.intensities, 0.1))
+        spectra.options['broadening'] = 'fft'
+        np.testing.assert_allclose(spectra.spectrum(npoints=1001, fwhh=0.1)[1], ys, atol=1e-3*ys.max())
+
+    def test_batch(self):
+        """Testing broadening many spectra on a shared grid and writing them"""
+        self.assertIsNone(read_transitions('orca/Benzene_freqs.out', use_cache=False))
+        transitions = [(self.energies, self.intensities), None, (self.energies[:10] + 1, self.intensities[:10])]
+        xs = shared_grid(transitions, 1001, 0.1)
+        self.assertLess(xs[0], self.energies[0])
+        self.assertGreater(xs[-1], self.energies[9] + 1)
+        # Sets without transitions are left out
+        spectra = spectra_matrix(transitions, xs, 0.1, norm=True)
+        self.assertEqual(spectra.shape, (1001, 2))
+        self.assertAlmostEqual(spectra[:, 1].max(), 1)
+        ys = broaden(xs, self.energies, self.intensities, 0.1)
+        np.testing.assert_allclose(spectra[:, 0], ys/ys.max())
+        self.assertRaises(ValueError, shared_grid, [None])
+        self.assertRaises(ValueError, batch_spectra, ['orca/Benzene_freqs.out'], use_cache=False)
+        self.assertRaises(ValueError, gen_spectra, 'orca/Benzene_freqs.out', 'benzene', use_cache=False)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            save_spectra(os.path.join(tmp_dir, 'spectra.npy'), xs, spectra)
+            np.testing.assert_allclose(np.load(os.path.join(tmp_dir, 'spectra.npy')), np.column_stack([xs, spectra]))
+            save_spectra(os.path.join(tmp_dir, 'spectra.npz'), xs, spectra, ['a', 'b'])
+            saved = np.load(os.path.join(tmp_dir, 'spectra.npz'))
+            self.assertEqual(saved['names'].tolist(), ['a', 'b'])
+            np.testing.assert_allclose(saved['spectra'], spectra)
+            save_spectra(os.path.join(tmp_dir, 'spectra.csv'), xs, spectra, ['a', 'b'])
+            with open(os.path.join(tmp_dir, 'spectra.csv')) as f:
+                self.assertEqual(f.readline(), 'energy,a,b\n')
+            np.testing.assert_allclose(np.loadtxt(os.path.join(tmp_dir, 'spectra.csv'), delimiter=',', skiprows=1)[:, 1:],
+                                       spectra, atol=1e-15)
+
+    def test_library(self):
+        """Testing finding the most similar spectra of a library"""
+        library = SpectraLibrary(self.xs, 0.1)
+        rng = np.random.RandomState(3)
+        for i in range(20):
+            energies = np.sort(rng.uniform(2, 8, 10))
+            library.add(Spectra(energies, rng.uniform(0.1, 1, 10), 'random{}'.format(i)))
+        self.assertEqual(len(library), 20)
+        query = Spectra(self.energies, self.intensities, 'query')
+        library.add(query)
+        # Shifted by 0.4 eV (50 points)
+        library.add(broaden(self.xs, self.energies + 0.4, self.intensities, 0.1), 'shifted')
+        self.assertEqual(library.matrix.shape, (22, 1001))
+
+        for method in ['cosine', 'overlap']:
+            best = library.search(query, k=3, method=method)
+            self.assertEqual([match.name for match in best][0], 'query')
+            self.assertAlmostEqual(best[0].score, 1)
+            self.assertGreaterEqual(best[1].score, best[2].score)
+        best = library.search(query, k=2, method='shifted')
+        self.assertEqual(sorted(match.name for match in best), ['query', 'shifted'])
+        self.assertAlmostEqual(best[0].score, 1, 2)
+        shifts = {match.name: match.shift for match in best}
+        self.assertAlmostEqual(shifts['shifted'], 0.4)
+        self.assertEqual(shifts['query'], 0)
+        # Shifts are limited
+        self.assertNotIn('shifted', [match.name for match in library.search(query, 1, 'shifted', max_shift=0.2)])
+        self.assertRaises(ValueError, library.similarity, query, 'unknown')
+        self.assertRaises(ValueError, library.add, np.zeros(10), 'short')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            library.save(os.path.join(tmp_dir, 'library.npz'))
+            loaded = SpectraLibrary.load(os.path.join(tmp_dir, 'library.npz'))
+        self.assertEqual(loaded.names, library.names)
+        self.assertEqual(loaded.fwhh, 0.1)
+        np.testing.assert_allclose(loaded.matrix, library.matrix)
+
+    def test_combined(self):
+        """Testing combining many spectra broadened once on a shared grid"""
+        s1 = Spectra(self.energies, self.intensities, 'one')
+        # Fewer transitions than the others
+        s2 = Spectra(self.energies[:30] + 0.5, self.intensities[:30], 'two')
+        s3 = Spectra(self.energies[50:] - 0.5, self.intensities[50:], 'three')
+        total = s1 + s2 + s3
+        self.assertIsInstance(total, SpectralSum)
+        self.assertEqual(repr(total), '<SpectralSum one + two + three>')
+        xs, ys = total.spectrum(npoints=1001, fwhh=0.1)
+        low, high = self.energies.min(), self.energies.max()
+        self.assertAlmostEqual(xs[0], low - (high - low)/10)
+        separate = [broaden(xs, s.energies, s.intensities, 0.1) for s in [s1, s2, s3]]
+        np.testing.assert_allclose(ys, sum(separate))
+
+        difference = s1 - s2
+        self.assertIsInstance(difference, SpectralDifference)
+        np.testing.assert_allclose(difference.spectrum(npoints=1001, fwhh=0.1)[1],
+                                   broaden(difference.spectrum(1001, 0.1)[0], s1.energies, s1.intensities, 0.1)
+                                   - broaden(difference.spectrum(1001, 0.1)[0], s2.energies, s2.intensities, 0.1))
+
+        # Reweighting reuses the broadened spectra
+        components = total.components(1001, 0.1)[1]
+        total.weights = [0.5, 0.25, 0.25]
+        self.assertIs(total.components(1001, 0.1)[1], components)
+        np.testing.assert_allclose(total.spectrum(1001, 0.1)[1], components @ [0.5, 0.25, 0.25])
+        self.assertRaises(ValueError, setattr, total, 'weights', [1, 2])
+
+    def test_boltzmann(self):
+        """Testing Boltzmann weighted spectra"""
+        # 1 kcal/mol apart
+        weights = boltzmann_weights([-100, -100 + 1/627.509], 298.15)
+        self.assertAlmostEqual(weights[1]/weights[0], np.exp(-4.184/(8.314462618e-3*298.15)), 3)
+        self.assertAlmostEqual(weights.sum(), 1)
+        self.assertEqual(boltzmann_weights([0, 0, 0], units='kcal/mol').tolist(), [1/3]*3)
+
+        s1 = Spectra(self.energies, self.intensities, 'one')
+        s2 = Spectra(self.energies + 1, self.intensities, 'two')
+        ensemble = BoltzmannSpectra(s1, s2, energies=[0, 1], units='kcal/mol')
+        np.testing.assert_allclose(ensemble.weights, boltzmann_weights([0, 1], units='kcal/mol'))
+        xs, ys = ensemble.spectrum(1001, 0.1)
+        components = ensemble.components(1001, 0.1)[1]
+        ensemble.temperature = 1e5
+        self.assertAlmostEqual(ensemble.weights[0], 0.5, 2)
+        self.assertIs(ensemble.components(1001, 0.1)[1], components)
+
+    def test_ensemble(self):
+        """Testing the Boltzmann weighted spectrum of conformers"""
+        self.assertIsNone(read_conformer('orca/Benzene_freqs.out', use_cache=False))
+        transitions = [(self.energies[:40], self.intensities[:40]), (self.energies[40:] + 0.2, self.intensities[40:]),
+                       (self.energies[::3], self.intensities[::3])]
+        ensemble = ConformerEnsemble([-200.001, -200, -199.999], transitions, ['a', 'b', 'c'])
+        self.assertEqual(len(ensemble), 3)
+        np.testing.assert_allclose(ensemble.weights, boltzmann_weights([-200.001, -200, -199.999]))
+        xs, ys = ensemble.spectrum(npoints=1001, fwhh=0.1)
+        # The same as weighting each broadened spectrum
+        weighted = sum(w*broaden(xs, e, i, 0.1) for w, (e, i) in zip(ensemble.weights, transitions))
+        np.testing.assert_allclose(ys, weighted)
+        combined = ensemble.combined()
+        self.assertIsInstance(combined, BoltzmannSpectra)
+        np.testing.assert_allclose(combined.weights, ensemble.weights)
+        xs, ys = ensemble.spectrum(npoints=1001, fwhh=0.1, limits=(2, 9), broadening='fft')
+        self.assertEqual((xs[0], xs[-1]), (2, 9))
+        self.assertRaises(ValueError, ConformerEnsemble, [0], transitions)
+
+
+if __name__ == '__main__':
+    unittest.main()